@@ -0,0 +1,307 @@
+"""
+AI Flashcard Generator - 自适应上游并发控制（AIMD）
+按“模型 + 上游API Key”维护并发上限：延迟与错误正常时加性增长，
+遇到429或延迟突增时乘性下降；超出上限的调用在队列中按FIFO等待
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import httpx
+
+from config.app_config import app_config
+from rate_limiter import api_key_fingerprint
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 延迟基线（指数加权移动平均）的平滑系数
+LATENCY_ALPHA = 0.1
+
+
+class ConcurrencyQueueTimeout(Exception):
+    """在时间预算内没有等到可用的并发名额"""
+
+    def __init__(self, key: str, waited: float):
+        super().__init__(f"No upstream concurrency slot for {key} after {waited:.1f}s")
+        self.key = key
+        self.waited = waited
+
+
+class AdaptiveLimit:
+    """单个键的AIMD并发上限
+
+    - 成功且延迟不超过基线的 latency_tolerance 倍：上限每轮（约 limit 次成功）加 increase，
+      仅在上限被实际用满一半以上时增长，避免空闲时虚涨
+    - 429、超时或延迟突增：上限乘以 decrease_factor，同一轮内只下降一次
+    """
+
+    def __init__(self,
+                 key: str,
+                 initial: float,
+                 min_limit: float,
+                 max_limit: float,
+                 increase: float,
+                 decrease_factor: float,
+                 latency_tolerance: float):
+        self.key = key
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.baseline_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self.last_used = time.monotonic()
+        self.stats = {
+            "completed": 0,
+            "throttled": 0,
+            "latency_spikes": 0,
+            "increases": 0,
+            "decreases": 0,
+            "queued_total": 0,
+            "queue_timeouts": 0,
+        }
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < max(1, int(self.limit))
+
+    def try_acquire(self) -> bool:
+        """不排队地占用名额；没有空闲名额或已有等待者时返回 False"""
+        self.last_used = time.monotonic()
+        if self._waiters or not self._has_capacity():
+            return False
+        self.in_flight += 1
+        return True
+
+    async def acquire(self, timeout: Optional[float] = None):
+        if self.try_acquire():
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats["queued_total"] += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # 超时的同时被唤醒：名额已分配给本调用
+                return
+            self._discard_waiter(waiter)
+            self.stats["queue_timeouts"] += 1
+            raise ConcurrencyQueueTimeout(self.key, time.monotonic() - start)
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # 已分配的名额转交给下一个等待者
+                self.in_flight -= 1
+                self._wake()
+            else:
+                self._discard_waiter(waiter)
+            raise
+
+    def _discard_waiter(self, waiter: asyncio.Future):
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _wake(self):
+        while self._waiters and self._has_capacity():
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def release(self, latency: Optional[float] = None, throttled: bool = False, overloaded: bool = False):
+        """归还名额并根据本次调用结果调整上限
+
+        latency 为 None 表示调用结果不反映上游负载（如400、被取消），不调整上限。
+        """
+        utilised = self.in_flight * 2 >= self.limit
+        self.in_flight -= 1
+        self.last_used = time.monotonic()
+
+        if throttled or overloaded:
+            self._decrease(throttled)
+        elif latency is not None:
+            self.stats["completed"] += 1
+            baseline = self.baseline_latency
+            # 基线同样跟随突增样本缓慢移动，上游延迟整体变化后不会持续误判
+            self.baseline_latency = latency if baseline is None else (
+                baseline + LATENCY_ALPHA * (latency - baseline)
+            )
+            if baseline is not None and latency > baseline * self.latency_tolerance:
+                self.stats["latency_spikes"] += 1
+                self._decrease(False)
+            else:
+                if utilised and self.limit < self.max_limit:
+                    self.limit = min(self.max_limit, self.limit + self.increase / max(1.0, self.limit))
+                    self.stats["increases"] += 1
+        self._wake()
+
+    def finish(self, error: Optional[BaseException] = None, latency: Optional[float] = None):
+        """按调用结果归还名额：429视为限流，502/503/504与超时视为过载，其他错误不调整上限"""
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+            self.release(throttled=status == 429, overloaded=status in (502, 503, 504))
+        elif isinstance(error, httpx.TimeoutException):
+            self.release(overloaded=True)
+        elif error is not None:
+            self.release()
+        else:
+            self.release(latency=latency)
+
+    def _decrease(self, throttled: bool):
+        if throttled:
+            self.stats["throttled"] += 1
+        now = time.monotonic()
+        # 同一轮（约一个基线延迟）内的多次拥塞信号只下降一次
+        if now - self._last_decrease < (self.baseline_latency or 0.0):
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        if self.limit < previous:
+            self.stats["decreases"] += 1
+            logger.info(f"Upstream concurrency for {self.key} reduced {previous:.1f} -> {self.limit:.1f}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "baseline_latency": round(self.baseline_latency, 3) if self.baseline_latency is not None else None,
+            **self.stats,
+        }
+
+
+class AdaptiveConcurrency:
+    """按“模型 + 上游API Key指纹”管理AIMD并发上限"""
+
+    def __init__(self,
+                 enabled: Optional[bool] = None,
+                 initial: Optional[float] = None,
+                 min_limit: Optional[float] = None,
+                 max_limit: Optional[float] = None,
+                 increase: Optional[float] = None,
+                 decrease_factor: Optional[float] = None,
+                 latency_tolerance: Optional[float] = None,
+                 max_keys: Optional[int] = None):
+        self.enabled = enabled if enabled is not None else app_config.adaptive_concurrency_enabled
+        self.initial = initial if initial is not None else app_config.adaptive_concurrency_initial
+        self.min_limit = min_limit if min_limit is not None else app_config.adaptive_concurrency_min
+        self.max_limit = max_limit if max_limit is not None else app_config.adaptive_concurrency_max
+        self.increase = increase if increase is not None else app_config.adaptive_concurrency_increase
+        self.decrease_factor = (decrease_factor if decrease_factor is not None
+                                else app_config.adaptive_concurrency_decrease)
+        self.latency_tolerance = (latency_tolerance if latency_tolerance is not None
+                                  else app_config.adaptive_concurrency_latency_tolerance)
+        self.max_keys = max_keys if max_keys is not None else app_config.adaptive_concurrency_max_keys
+        self._limits: "OrderedDict[str, AdaptiveLimit]" = OrderedDict()
+
+    @staticmethod
+    def make_key(model_name: str, api_key: Optional[str]) -> str:
+        return f"{model_name}|{api_key_fingerprint(api_key)}" if api_key else model_name
+
+    def get(self, key: str) -> AdaptiveLimit:
+        limit = self._limits.get(key)
+        if limit is None:
+            limit = self._limits[key] = AdaptiveLimit(
+                key, self.initial, self.min_limit, self.max_limit,
+                self.increase, self.decrease_factor, self.latency_tolerance
+            )
+            self._evict()
+        else:
+            self._limits.move_to_end(key)
+        return limit
+
+    def _evict(self):
+        # 只淘汰空闲（无在途、无排队）的最久未用的键
+        while len(self._limits) > self.max_keys:
+            for key, limit in self._limits.items():
+                if limit.in_flight == 0 and limit.queued == 0:
+                    del self._limits[key]
+                    break
+            else:
+                return
+
+    def try_acquire(self, model_name: str, api_key: Optional[str]) -> bool:
+        """不排队地占用一个并发名额（用于对冲等可有可无的额外请求）
+
+        成功后须以 run(..., acquired=True) 执行或以 release() 归还。
+        """
+        return not self.enabled or self.get(self.make_key(model_name, api_key)).try_acquire()
+
+    def release(self, model_name: str, api_key: Optional[str]):
+        """归还 try_acquire() 占用但未使用的名额，不调整上限"""
+        if self.enabled:
+            self.get(self.make_key(model_name, api_key)).release()
+
+    async def acquire(self,
+                      model_name: str,
+                      api_key: Optional[str],
+                      timeout: Optional[float] = None) -> Optional[AdaptiveLimit]:
+        """占用一个并发名额并返回对应的 AdaptiveLimit，由调用方 finish()（用于持续整个流式响应的调用）
+
+        未启用时返回 None；timeout 秒内等不到名额时抛出 ConcurrencyQueueTimeout。
+        """
+        if not self.enabled:
+            return None
+        limit = self.get(self.make_key(model_name, api_key))
+        await limit.acquire(timeout)
+        return limit
+
+    async def run(self,
+                  model_name: str,
+                  api_key: Optional[str],
+                  fn: Callable[[], Awaitable[T]],
+                  timeout: Optional[float] = None,
+                  acquired: bool = False,
+                  record_latency: bool = True) -> T:
+        """在并发名额内执行 fn()；timeout 秒内等不到名额时抛出 ConcurrencyQueueTimeout
+
+        acquired=True 表示名额已通过 try_acquire() 占用；record_latency=False 时成功的调用不作为延迟样本
+        （如只等到流式首个token的调用，与完整响应的耗时不可比）。
+        """
+        if not self.enabled:
+            return await fn()
+        limit = self.get(self.make_key(model_name, api_key))
+        if not acquired:
+            await limit.acquire(timeout)
+        start = time.monotonic()
+        try:
+            result = await fn()
+        except BaseException as error:
+            limit.finish(error)
+            raise
+        limit.finish(latency=time.monotonic() - start if record_latency else None)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "keys": {key: limit.snapshot() for key, limit in self._limits.items()},
+            "queued": sum(limit.queued for limit in self._limits.values()),
+            "in_flight": sum(limit.in_flight for limit in self._limits.values()),
+        }
+
+
+# 全局实例
+upstream_concurrency = AdaptiveConcurrency()
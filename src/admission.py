@@ -0,0 +1,186 @@
+"""
+AI Flashcard Generator - 过载保护（准入控制）
+根据在途生成请求数、公平队列排队深度与事件循环延迟判断是否过载；
+过载时新的生成请求在进入业务逻辑前直接返回503与 Retry-After，不产生任何上游调用费用
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional
+
+from config.app_config import app_config
+from fair_scheduler import BACKGROUND, BATCH, INTERACTIVE, fair_scheduler, resolve_priority
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 受准入控制的接口（路径前缀，仅非GET请求）
+GENERATION_PATHS = ("/generate_flashcards",)
+
+# 各优先级按阈值的多大比例开始拒绝：低优先级请求先被拒绝，为交互式请求留出余量
+SHED_FACTORS = {
+    INTERACTIVE: 1.0,
+    BATCH: 0.8,
+    BACKGROUND: 0.5,
+}
+
+
+class LoopLagMonitor:
+    """周期性测量事件循环延迟（定时器实际唤醒时间与预期之差）
+
+    延迟上升时立即跟随，回落时按指数平滑缓慢下降，避免在过载边缘反复切换。
+    """
+
+    DECAY = 0.2
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, lag: float):
+        self.lag = lag if lag > self.lag else self.lag + self.DECAY * (lag - self.lag)
+        self.max_lag = max(self.max_lag, lag)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, loop.time() - start - self.interval))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class AdmissionController:
+    """生成请求的准入控制
+
+    任一信号超过阈值（乘以该优先级的 SHED_FACTORS）即拒绝新请求：
+    - in_flight：正在处理的生成请求数
+    - queue_depth：公平队列中等待上游名额的调用数
+    - loop_lag：事件循环延迟（秒）
+    阈值为0表示不检查该信号。
+    """
+
+    def __init__(self,
+                 enabled: Optional[bool] = None,
+                 max_in_flight: Optional[int] = None,
+                 max_queue_depth: Optional[int] = None,
+                 max_loop_lag: Optional[float] = None,
+                 retry_after: Optional[int] = None,
+                 monitor: Optional[LoopLagMonitor] = None):
+        self.enabled = enabled if enabled is not None else app_config.admission_enabled
+        self.max_in_flight = max_in_flight if max_in_flight is not None else app_config.admission_max_in_flight
+        self.max_queue_depth = (max_queue_depth if max_queue_depth is not None
+                                else app_config.admission_max_queue_depth)
+        self.max_loop_lag = max_loop_lag if max_loop_lag is not None else app_config.admission_max_loop_lag
+        self.retry_after = retry_after if retry_after is not None else app_config.admission_retry_after
+        self.monitor = monitor or LoopLagMonitor()
+
+        self.in_flight = 0
+        self.stats = {
+            "admitted": 0,
+            "shed": 0,
+            "shed_by_reason": {"in_flight": 0, "queue_depth": 0, "loop_lag": 0},
+            "shed_by_priority": {priority: 0 for priority in SHED_FACTORS},
+        }
+
+    def overload_reason(self, priority: str, queue_depth: Optional[int] = None) -> Optional[str]:
+        """返回拒绝原因，未过载时返回 None"""
+        factor = SHED_FACTORS.get(priority, 1.0)
+        if self.max_in_flight and self.in_flight >= self.max_in_flight * factor:
+            return "in_flight"
+        if self.max_queue_depth:
+            queue_depth = fair_scheduler.queued if queue_depth is None else queue_depth
+            if queue_depth >= self.max_queue_depth * factor:
+                return "queue_depth"
+        if self.max_loop_lag and self.monitor.lag >= self.max_loop_lag * factor:
+            return "loop_lag"
+        return None
+
+    def admit(self, priority: str) -> Optional[str]:
+        """尝试准入一个请求；准入时计入在途数（需调用 release），拒绝时返回原因"""
+        reason = self.overload_reason(priority)
+        if reason is not None:
+            self.stats["shed"] += 1
+            self.stats["shed_by_reason"][reason] += 1
+            self.stats["shed_by_priority"][priority] += 1
+            return reason
+        self.in_flight += 1
+        self.stats["admitted"] += 1
+        return None
+
+    def release(self):
+        self.in_flight -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "in_flight": self.in_flight,
+            "queue_depth": fair_scheduler.queued,
+            "loop_lag": round(self.monitor.lag, 4),
+            "max_loop_lag_seen": round(self.monitor.max_lag, 4),
+            "thresholds": {
+                "in_flight": self.max_in_flight,
+                "queue_depth": self.max_queue_depth,
+                "loop_lag": self.max_loop_lag,
+            },
+            **self.stats,
+        }
+
+
+class AdmissionMiddleware:
+    """在生成接口前执行准入控制的纯ASGI中间件（需位于 SchedulingMiddleware 内层以获取优先级）"""
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None):
+        self.app = app
+        self.controller = controller or admission_controller
+
+    async def __call__(self, scope, receive, send):
+        controller = self.controller
+        if (scope["type"] != "http" or not controller.enabled or scope["method"] in ("GET", "HEAD", "OPTIONS")
+                or not scope["path"].startswith(GENERATION_PATHS)):
+            await self.app(scope, receive, send)
+            return
+
+        priority = resolve_priority()
+        reason = controller.admit(priority)
+        if reason is not None:
+            logger.warning(f"服务过载（{reason}），拒绝 {priority} 请求 {scope['path']}")
+            body = json.dumps({"detail": {
+                "success": False,
+                "error_code": "OVERLOADED",
+                "message": "服务当前负载过高，请稍后重试。"
+            }}, ensure_ascii=False).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode("latin-1")),
+                            (b"retry-after", str(controller.retry_after).encode("latin-1"))]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release()
+
+
+# 全局实例
+admission_controller = AdmissionController()
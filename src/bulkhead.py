@@ -0,0 +1,238 @@
+"""
+AI Flashcard Generator - 按模型隔离上游并发（舱壁）
+每个模型（或按提供商前缀共享）有独立的并发上限、等待队列与等待超时：
+某个模型变慢时，其请求只会占满自己的舱壁并被快速拒绝（可切换备用模型），不会拖垮其他模型
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+from config.app_config import app_config
+from model_manager import model_manager
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 舱壁配置：(并发上限, 队列长度上限, 等待超时秒数)
+BulkheadConfig = Tuple[int, int, float]
+
+
+class BulkheadFullError(Exception):
+    """舱壁已满：等待队列已满或在等待超时内没有空出名额"""
+
+    def __init__(self, key: str, reason: str, waited: float = 0.0):
+        super().__init__(f"Bulkhead {key} is full ({reason})")
+        self.key = key
+        self.reason = reason
+        self.waited = waited
+
+
+class Bulkhead:
+    """单个舱壁：最多 max_concurrent 个并发调用，最多 max_queue 个调用按FIFO等待"""
+
+    def __init__(self, key: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.key = key
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.stats = {
+            "accepted": 0,
+            "queued_total": 0,
+            "rejected_queue_full": 0,
+            "rejected_timeout": 0,
+        }
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def configure(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        """更新配置（模型元数据修改后生效），上限提高时立即唤醒等待者"""
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._wake()
+
+    def _take(self):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self.stats["accepted"] += 1
+
+    def try_acquire(self) -> bool:
+        """不排队地占用名额；没有空闲名额或已有等待者时返回 False"""
+        if self._waiters or self.in_flight >= self.max_concurrent:
+            return False
+        self._take()
+        return True
+
+    async def acquire(self, timeout: Optional[float] = None):
+        if self.try_acquire():
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.stats["rejected_queue_full"] += 1
+            raise BulkheadFullError(self.key, "queue_full")
+
+        timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats["queued_total"] += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                return
+            self._discard(waiter)
+            self.stats["rejected_timeout"] += 1
+            raise BulkheadFullError(self.key, "timeout", time.monotonic() - start)
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # 已分配的名额转交给下一个等待者
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+
+    def _discard(self, waiter: asyncio.Future):
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.max_concurrent:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self._take()
+            waiter.set_result(None)
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "saturation": round(self.in_flight / self.max_concurrent, 3) if self.max_concurrent else 0,
+            "peak_in_flight": self.peak_in_flight,
+            **self.stats,
+        }
+
+
+class BulkheadRegistry:
+    """按模型解析舱壁配置并管理舱壁实例
+
+    配置优先级：
+    1. 模型元数据（local_model_metadata.json）中的 bulkhead 字段，该模型独占一个舱壁
+    2. BULKHEAD_PROVIDER_LIMITS 中最长匹配的提供商前缀（如 "anthropic/"），同一前缀的模型共享一个舱壁
+    3. BULKHEAD_DEFAULT_LIMIT，每个模型独占一个舱壁
+    """
+
+    def __init__(self,
+                 enabled: Optional[bool] = None,
+                 default_limit: Optional[int] = None,
+                 provider_limits: Optional[Dict[str, int]] = None,
+                 max_queue: Optional[int] = None,
+                 queue_timeout: Optional[float] = None,
+                 model_config: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None):
+        self.enabled = enabled if enabled is not None else app_config.bulkhead_enabled
+        self.default_limit = default_limit if default_limit is not None else app_config.bulkhead_default_limit
+        self.provider_limits = (provider_limits if provider_limits is not None
+                                else app_config.bulkhead_provider_limits)
+        self.max_queue = max_queue if max_queue is not None else app_config.bulkhead_max_queue
+        self.queue_timeout = queue_timeout if queue_timeout is not None else app_config.bulkhead_queue_timeout
+        self.model_config = model_config or model_manager.get_bulkhead_config
+        self._bulkheads: Dict[str, Bulkhead] = {}
+
+    def resolve(self, model_name: str) -> Tuple[str, BulkheadConfig]:
+        """返回 (舱壁键, 配置)"""
+        override = self.model_config(model_name)
+        if override and override.get("max_concurrent"):
+            return model_name, (
+                int(override["max_concurrent"]),
+                int(override.get("max_queue", self.max_queue)),
+                float(override.get("queue_timeout", self.queue_timeout)),
+            )
+        prefix = max((prefix for prefix in self.provider_limits if model_name.startswith(prefix)),
+                     key=len, default=None)
+        if prefix is not None:
+            return prefix, (self.provider_limits[prefix], self.max_queue, self.queue_timeout)
+        return model_name, (self.default_limit, self.max_queue, self.queue_timeout)
+
+    def get(self, model_name: str) -> Bulkhead:
+        key, config = self.resolve(model_name)
+        bulkhead = self._bulkheads.get(key)
+        if bulkhead is None:
+            bulkhead = self._bulkheads[key] = Bulkhead(key, *config)
+        elif (bulkhead.max_concurrent, bulkhead.max_queue, bulkhead.queue_timeout) != config:
+            bulkhead.configure(*config)
+        return bulkhead
+
+    def try_acquire(self, model_name: str) -> bool:
+        """不排队地占用模型舱壁的一个名额（用于对冲等可有可无的额外请求）
+
+        成功后须以 run(..., acquired=True) 执行或以 release() 归还。
+        """
+        return not self.enabled or self.get(model_name).try_acquire()
+
+    def release(self, model_name: str):
+        if self.enabled:
+            self.get(model_name).release()
+
+    async def acquire(self, model_name: str, timeout: Optional[float] = None) -> Optional[Bulkhead]:
+        """占用模型舱壁的一个名额并返回该舱壁，由调用方 release()（用于持续整个流式响应的调用）
+
+        未启用时返回 None；舱壁已满时抛出 BulkheadFullError。
+        """
+        if not self.enabled:
+            return None
+        bulkhead = self.get(model_name)
+        await bulkhead.acquire(timeout)
+        return bulkhead
+
+    async def run(self,
+                  model_name: str,
+                  fn: Callable[[], Awaitable[T]],
+                  timeout: Optional[float] = None,
+                  acquired: bool = False) -> T:
+        """在模型的舱壁内执行 fn()；舱壁已满时抛出 BulkheadFullError
+
+        acquired=True 表示名额已通过 try_acquire() 占用。
+        """
+        if not self.enabled:
+            return await fn()
+        bulkhead = self.get(model_name)
+        if not acquired:
+            await bulkhead.acquire(timeout)
+        try:
+            return await fn()
+        finally:
+            bulkhead.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "saturated": [key for key, bulkhead in self._bulkheads.items()
+                          if bulkhead.in_flight >= bulkhead.max_concurrent],
+            "bulkheads": {key: bulkhead.snapshot() for key, bulkhead in self._bulkheads.items()},
+        }
+
+
+# 全局实例
+upstream_bulkheads = BulkheadRegistry()
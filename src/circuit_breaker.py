@@ -0,0 +1,241 @@
+"""
+AI Flashcard Generator - 按模型熔断
+根据上游调用的滚动错误率与超时统计，为每个模型维护 closed/open/half_open 三态熔断器；
+熔断期间直接拒绝该模型的请求（由调用方返回503或切换备用模型），不再等待上游超时
+"""
+
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+import httpx
+
+from config.app_config import app_config
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 视为上游超时的错误
+TIMEOUT_ERRORS = (httpx.TimeoutException,)
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求未发往上游"""
+
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(f"Circuit for {key} is open")
+        self.key = key
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """单个模型的熔断器
+
+    - closed：统计最近 window 秒内的调用，样本不少于 min_requests 且失败率达到 failure_rate 时打开
+    - open：open_seconds 内拒绝所有调用，之后进入 half_open
+    - half_open：最多放行 half_open_max_calls 个探测调用；探测成功则关闭，失败则重新打开
+    """
+
+    def __init__(self,
+                 key: str,
+                 failure_rate: float,
+                 min_requests: int,
+                 window: float,
+                 open_seconds: float,
+                 half_open_max_calls: int):
+        self.key = key
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        # (时间, 是否失败, 是否超时)
+        self._calls: Deque[Tuple[float, bool, bool]] = deque()
+        self.stats = {
+            "opened": 0,
+            "rejected": 0,
+        }
+
+    def _prune(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+            logger.info(f"Circuit for {self.key} half-open, probing upstream")
+        return self._state
+
+    def retry_after(self) -> float:
+        """距离允许下一次探测的秒数"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and self._probes < self.half_open_max_calls:
+            self._probes += 1
+            return True
+        self.stats["rejected"] += 1
+        return False
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self.stats["opened"] += 1
+
+    def record_success(self):
+        now = time.monotonic()
+        if self._state == HALF_OPEN:
+            logger.info(f"Circuit for {self.key} closed after successful probe")
+            self._state = CLOSED
+            self._calls.clear()
+        self._calls.append((now, False, False))
+        self._prune(now)
+
+    def record_failure(self, timeout: bool = False):
+        now = time.monotonic()
+        self._calls.append((now, True, timeout))
+        self._prune(now)
+        if self._state == HALF_OPEN:
+            logger.warning(f"Circuit for {self.key} re-opened after failed probe")
+            self._open()
+            return
+        if self._state == CLOSED and len(self._calls) >= self.min_requests:
+            failures = sum(1 for _, failed, _ in self._calls if failed)
+            if failures / len(self._calls) >= self.failure_rate:
+                logger.warning(f"Circuit for {self.key} opened: {failures}/{len(self._calls)} calls failed "
+                               f"in the last {self.window:.0f}s")
+                self._open()
+
+    def release(self):
+        """未产生结果的调用（如被取消）归还探测名额"""
+        if self._state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._prune(time.monotonic())
+        calls = len(self._calls)
+        failures = sum(1 for _, failed, _ in self._calls if failed)
+        return {
+            "state": self.state,
+            "calls": calls,
+            "failures": failures,
+            "timeouts": sum(1 for _, _, timed_out in self._calls if timed_out),
+            "error_rate": round(failures / calls, 3) if calls else 0,
+            "retry_after": round(self.retry_after(), 1),
+            **self.stats,
+        }
+
+
+class CircuitBreakerRegistry:
+    """按键（模型ID）管理熔断器
+
+    上游返回 failure_statuses 中的状态码、连接失败或超时计为失败；
+    其余HTTP错误（如401/400）说明模型服务可用，计为成功。
+    """
+
+    def __init__(self,
+                 enabled: Optional[bool] = None,
+                 failure_rate: Optional[float] = None,
+                 min_requests: Optional[int] = None,
+                 window: Optional[float] = None,
+                 open_seconds: Optional[float] = None,
+                 half_open_max_calls: Optional[int] = None,
+                 failure_statuses: Optional[frozenset] = None):
+        self.enabled = enabled if enabled is not None else app_config.circuit_breaker_enabled
+        self.failure_rate = failure_rate if failure_rate is not None else app_config.circuit_breaker_failure_rate
+        self.min_requests = min_requests if min_requests is not None else app_config.circuit_breaker_min_requests
+        self.window = window if window is not None else app_config.circuit_breaker_window
+        self.open_seconds = open_seconds if open_seconds is not None else app_config.circuit_breaker_open_seconds
+        self.half_open_max_calls = (half_open_max_calls if half_open_max_calls is not None
+                                    else app_config.circuit_breaker_half_open_calls)
+        self.failure_statuses = (failure_statuses if failure_statuses is not None
+                                 else app_config.circuit_breaker_failure_statuses)
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, key: str) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(
+                key, self.failure_rate, self.min_requests, self.window,
+                self.open_seconds, self.half_open_max_calls
+            )
+        return breaker
+
+    def classify(self, error: BaseException) -> Optional[str]:
+        """返回 "timeout"、"error"，或 None（不计为上游故障）"""
+        if isinstance(error, TIMEOUT_ERRORS):
+            return "timeout"
+        if isinstance(error, httpx.HTTPStatusError):
+            return "error" if error.response.status_code in self.failure_statuses else None
+        if isinstance(error, httpx.RequestError):
+            return "error"
+        return None
+
+    def admit(self, key: str) -> Optional[CircuitBreaker]:
+        """放行一次调用并返回该键的熔断器，调用结束后须以 record() 记录结果（用于持续整个流式响应的调用）
+
+        熔断打开时抛出 CircuitOpenError；未启用时返回 None。
+        """
+        if not self.enabled:
+            return None
+        breaker = self.get(key)
+        if not breaker.allow_request():
+            raise CircuitOpenError(key, breaker.retry_after())
+        return breaker
+
+    def record(self, breaker: CircuitBreaker, error: Optional[BaseException] = None, upstream_failed: bool = False):
+        """记录一次已放行调用的结果；upstream_failed=True 表示上游在已开始的响应中报告了错误"""
+        failure = "error" if upstream_failed else (self.classify(error) if isinstance(error, Exception) else None)
+        if failure is not None:
+            breaker.record_failure(timeout=failure == "timeout")
+        elif error is None or isinstance(error, httpx.HTTPStatusError):
+            breaker.record_success()
+        else:
+            # 未得到上游响应的本地错误（如等待并发名额超时）或被取消的调用不计入统计
+            breaker.release()
+
+    async def call(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """经熔断器执行 fn()；熔断打开时抛出 CircuitOpenError 而不调用 fn"""
+        if not self.enabled:
+            return await fn()
+        breaker = self.admit(key)
+        try:
+            result = await fn()
+        except BaseException as error:
+            self.record(breaker, error)
+            raise
+        self.record(breaker)
+        return result
+
+    def open_keys(self):
+        return [key for key, breaker in self._breakers.items() if breaker.state == OPEN]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "open": self.open_keys(),
+            "models": {key: breaker.snapshot() for key, breaker in self._breakers.items()},
+        }
+
+
+# 全局实例
+upstream_breakers = CircuitBreakerRegistry()
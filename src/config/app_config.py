@@ -55,10 +55,382 @@ class AppConfig:
     def max_text_length(self) -> int:
         return int(os.getenv("MAX_TEXT_LENGTH", "10000"))
     
+    @property
+    def max_document_length(self) -> int:
+        return int(os.getenv("MAX_DOCUMENT_LENGTH", "500000"))
+    
+    @property
+    def document_max_cards(self) -> int:
+        return int(os.getenv("DOCUMENT_MAX_CARDS", "300"))
+    
+    @property
+    def document_chunk_max_chars(self) -> int:
+        return int(os.getenv("DOCUMENT_CHUNK_MAX_CHARS", "8000"))
+    
+    @property
+    def document_max_concurrency(self) -> int:
+        return int(os.getenv("DOCUMENT_MAX_CONCURRENCY", "4"))
+    
+    @property
+    def batch_max_items(self) -> int:
+        return int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+    
+    @property
+    def batch_max_concurrency(self) -> int:
+        return int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+    
+    # Async Jobs
+    @property
+    def job_db_path(self) -> str:
+        return os.getenv("JOB_DB_PATH", "cache/jobs.db")
+    
+    @property
+    def job_workers(self) -> int:
+        return int(os.getenv("JOB_WORKERS", "2"))
+    
+    @property
+    def job_lease_seconds(self) -> float:
+        return float(os.getenv("JOB_LEASE_SECONDS", "60"))
+    
+    @property
+    def job_poll_interval(self) -> float:
+        return float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+    
+    @property
+    def job_max_attempts(self) -> int:
+        return int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    
+    @property
+    def job_retention(self) -> int:
+        return int(os.getenv("JOB_RETENTION", "86400"))
+    
+    @property
+    def job_webhook_timeout(self) -> float:
+        return float(os.getenv("JOB_WEBHOOK_TIMEOUT", "10.0"))
+    
+    @property
+    def job_webhook_max_attempts(self) -> int:
+        return int(os.getenv("JOB_WEBHOOK_MAX_ATTEMPTS", "5"))
+    
+    @property
+    def job_webhook_retry_delay(self) -> float:
+        return float(os.getenv("JOB_WEBHOOK_RETRY_DELAY", "5.0"))
+    
+    @property
+    def job_webhook_allowed_hosts(self) -> List[str]:
+        hosts = os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "")
+        return [host.strip().lower() for host in hosts.split(",") if host.strip()]
+    
     @property
     def request_timeout(self) -> float:
         return float(os.getenv("REQUEST_TIMEOUT", "60.0"))
     
+    # Upstream HTTP Client
+    @property
+    def upstream_max_connections(self) -> int:
+        return int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+    
+    @property
+    def upstream_max_keepalive_connections(self) -> int:
+        return int(os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    
+    @property
+    def upstream_keepalive_expiry(self) -> float:
+        return float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30.0"))
+    
+    @property
+    def upstream_http2(self) -> bool:
+        return os.getenv("UPSTREAM_HTTP2", "false").lower() == "true"
+    
+    # Upstream Retry
+    @property
+    def upstream_retry_max_attempts(self) -> int:
+        return int(os.getenv("UPSTREAM_RETRY_MAX_ATTEMPTS", "3"))
+    
+    @property
+    def upstream_retry_base_delay(self) -> float:
+        return float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.5"))
+    
+    @property
+    def upstream_retry_max_delay(self) -> float:
+        return float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "8.0"))
+    
+    @property
+    def upstream_retry_budget(self) -> float:
+        """重试总预算：默认低于nginx的 proxy_read_timeout（30s），且不超过请求超时的90%（留出解析与响应的余量）"""
+        budget = float(os.getenv("UPSTREAM_RETRY_BUDGET", "25.0"))
+        return min(budget, self.request_timeout * 0.9)
+    
+    @property
+    def upstream_retry_statuses(self) -> frozenset:
+        statuses = os.getenv("UPSTREAM_RETRY_STATUSES", "408,429,502,503,504")
+        return frozenset(int(code) for code in statuses.split(",") if code.strip())
+    
+    # Upstream Hedging
+    @property
+    def hedge_enabled(self) -> bool:
+        return os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+    
+    @property
+    def hedge_quantile(self) -> float:
+        return float(os.getenv("HEDGE_QUANTILE", "0.95"))
+    
+    @property
+    def hedge_min_delay(self) -> float:
+        return float(os.getenv("HEDGE_MIN_DELAY", "1.0"))
+    
+    @property
+    def hedge_min_samples(self) -> int:
+        return int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+    
+    @property
+    def hedge_max_fraction(self) -> float:
+        return float(os.getenv("HEDGE_MAX_FRACTION", "0.1"))
+    
+    @property
+    def hedge_window(self) -> int:
+        return int(os.getenv("HEDGE_WINDOW", "200"))
+    
+    # Weighted Fair Queuing
+    @property
+    def fair_queue_enabled(self) -> bool:
+        return os.getenv("FAIR_QUEUE_ENABLED", "true").lower() == "true"
+    
+    @property
+    def fair_queue_capacity(self) -> int:
+        return int(os.getenv("FAIR_QUEUE_CAPACITY", "32"))
+    
+    @property
+    def fair_queue_default_weight(self) -> float:
+        return float(os.getenv("FAIR_QUEUE_DEFAULT_WEIGHT", "1"))
+    
+    @property
+    def fair_queue_weights(self) -> dict:
+        """租户权重，格式如 tenant:acme=4,key:<API Key指纹>=0.5"""
+        weights = {}
+        for entry in os.getenv("FAIR_QUEUE_WEIGHTS", "").split(","):
+            name, _, weight = entry.strip().rpartition("=")
+            if name and weight:
+                weights[name] = max(0.01, float(weight))
+        return weights
+    
+    @property
+    def fair_queue_tenant_header(self) -> str:
+        return os.getenv("FAIR_QUEUE_TENANT_HEADER", "")
+    
+    @property
+    def fair_queue_max_tenants(self) -> int:
+        return int(os.getenv("FAIR_QUEUE_MAX_TENANTS", "10000"))
+    
+    @property
+    def fair_queue_timeout(self) -> float:
+        """排队等待上游名额的最长时间（同时不超过请求剩余的重试预算）"""
+        return float(os.getenv("FAIR_QUEUE_TIMEOUT", "10"))
+    
+    # Priority Lanes
+    @property
+    def priority_reserved_shares(self) -> dict:
+        """各优先级保留的上游名额比例，格式如 interactive=0.5,batch=0.25,background=0.05"""
+        shares = {}
+        for entry in os.getenv("PRIORITY_RESERVED_SHARES", "interactive=0.5,batch=0.25,background=0.05").split(","):
+            name, _, share = entry.strip().partition("=")
+            if name and share:
+                shares[name] = max(0.0, float(share))
+        return shares
+    
+    @property
+    def priority_headroom(self) -> int:
+        return int(os.getenv("PRIORITY_HEADROOM", "2"))
+    
+    @property
+    def priority_header(self) -> str:
+        return os.getenv("PRIORITY_HEADER", "X-Request-Priority")
+    
+    # Admission Control (load shedding)
+    @property
+    def admission_enabled(self) -> bool:
+        return os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    
+    @property
+    def admission_max_in_flight(self) -> int:
+        return int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "200"))
+    
+    @property
+    def admission_max_queue_depth(self) -> int:
+        return int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "100"))
+    
+    @property
+    def admission_max_loop_lag(self) -> float:
+        return float(os.getenv("ADMISSION_MAX_LOOP_LAG", "0.5"))
+    
+    @property
+    def admission_retry_after(self) -> int:
+        return int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+    
+    # Client Disconnects
+    @property
+    def cancel_on_disconnect(self) -> bool:
+        return os.getenv("CANCEL_ON_DISCONNECT", "true").lower() == "true"
+    
+    @property
+    def disconnect_fill_cache(self) -> bool:
+        """客户端断开后仍完成上游调用以写入响应缓存"""
+        return os.getenv("DISCONNECT_FILL_CACHE", "false").lower() == "true"
+    
+    # Per-Model Bulkheads
+    @property
+    def bulkhead_enabled(self) -> bool:
+        return os.getenv("BULKHEAD_ENABLED", "true").lower() == "true"
+    
+    @property
+    def bulkhead_default_limit(self) -> int:
+        return int(os.getenv("BULKHEAD_DEFAULT_LIMIT", "16"))
+    
+    @property
+    def bulkhead_provider_limits(self) -> dict:
+        """按提供商前缀共享的并发上限，格式如 anthropic/=8,google/=16"""
+        limits = {}
+        for entry in os.getenv("BULKHEAD_PROVIDER_LIMITS", "").split(","):
+            prefix, _, limit = entry.strip().rpartition("=")
+            if prefix and limit:
+                limits[prefix] = max(1, int(limit))
+        return limits
+    
+    @property
+    def bulkhead_max_queue(self) -> int:
+        return int(os.getenv("BULKHEAD_MAX_QUEUE", "16"))
+    
+    @property
+    def bulkhead_queue_timeout(self) -> float:
+        return float(os.getenv("BULKHEAD_QUEUE_TIMEOUT", "10"))
+    
+    # Adaptive Upstream Concurrency (AIMD)
+    @property
+    def adaptive_concurrency_enabled(self) -> bool:
+        return os.getenv("ADAPTIVE_CONCURRENCY_ENABLED", "true").lower() == "true"
+    
+    @property
+    def adaptive_concurrency_initial(self) -> float:
+        return float(os.getenv("ADAPTIVE_CONCURRENCY_INITIAL", "8"))
+    
+    @property
+    def adaptive_concurrency_min(self) -> float:
+        return float(os.getenv("ADAPTIVE_CONCURRENCY_MIN", "1"))
+    
+    @property
+    def adaptive_concurrency_max(self) -> float:
+        return float(os.getenv("ADAPTIVE_CONCURRENCY_MAX", "64"))
+    
+    @property
+    def adaptive_concurrency_increase(self) -> float:
+        return float(os.getenv("ADAPTIVE_CONCURRENCY_INCREASE", "1"))
+    
+    @property
+    def adaptive_concurrency_decrease(self) -> float:
+        return float(os.getenv("ADAPTIVE_CONCURRENCY_DECREASE", "0.7"))
+    
+    @property
+    def adaptive_concurrency_latency_tolerance(self) -> float:
+        return float(os.getenv("ADAPTIVE_CONCURRENCY_LATENCY_TOLERANCE", "3.0"))
+    
+    @property
+    def adaptive_concurrency_max_keys(self) -> int:
+        return int(os.getenv("ADAPTIVE_CONCURRENCY_MAX_KEYS", "10000"))
+    
+    # Circuit Breaker
+    @property
+    def circuit_breaker_enabled(self) -> bool:
+        return os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+    
+    @property
+    def circuit_breaker_failure_rate(self) -> float:
+        return float(os.getenv("CIRCUIT_BREAKER_FAILURE_RATE", "0.5"))
+    
+    @property
+    def circuit_breaker_min_requests(self) -> int:
+        return int(os.getenv("CIRCUIT_BREAKER_MIN_REQUESTS", "10"))
+    
+    @property
+    def circuit_breaker_window(self) -> float:
+        return float(os.getenv("CIRCUIT_BREAKER_WINDOW", "60"))
+    
+    @property
+    def circuit_breaker_open_seconds(self) -> float:
+        return float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", "30"))
+    
+    @property
+    def circuit_breaker_half_open_calls(self) -> int:
+        return int(os.getenv("CIRCUIT_BREAKER_HALF_OPEN_CALLS", "1"))
+    
+    @property
+    def circuit_breaker_failure_statuses(self) -> frozenset:
+        statuses = os.getenv("CIRCUIT_BREAKER_FAILURE_STATUSES", "500,502,503,504")
+        return frozenset(int(code) for code in statuses.split(",") if code.strip())
+    
+    # Model Fallback
+    @property
+    def model_fallback_statuses(self) -> frozenset:
+        statuses = os.getenv("MODEL_FALLBACK_STATUSES", "408,429,502,503,504")
+        return frozenset(int(code) for code in statuses.split(",") if code.strip())
+    
+    @property
+    def model_fallback_max_models(self) -> int:
+        return int(os.getenv("MODEL_FALLBACK_MAX_MODELS", "3"))
+    
+    # Response Cache
+    @property
+    def response_cache_max_entries(self) -> int:
+        return int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    
+    @property
+    def response_cache_max_bytes(self) -> int:
+        return int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    
+    @property
+    def response_cache_ttl(self) -> int:
+        return int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+    
+    @property
+    def response_cache_sweep_interval(self) -> int:
+        return int(os.getenv("RESPONSE_CACHE_SWEEP_INTERVAL", "60"))
+    
+    @property
+    def response_cache_disk_path(self) -> str:
+        return os.getenv("RESPONSE_CACHE_DISK_PATH", "")
+    
+    @property
+    def response_cache_disk_max_bytes(self) -> int:
+        return int(os.getenv("RESPONSE_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+    
+    @property
+    def response_cache_disk_ttl(self) -> int:
+        return int(os.getenv("RESPONSE_CACHE_DISK_TTL", "86400"))
+    
+    @property
+    def response_cache_shared(self) -> bool:
+        return os.getenv("RESPONSE_CACHE_SHARED", "false").lower() == "true"
+    
+    @property
+    def response_cache_compact_interval(self) -> int:
+        return int(os.getenv("RESPONSE_CACHE_COMPACT_INTERVAL", "300"))
+    
+    # Model Catalog
+    @property
+    def model_metadata_save_delay(self) -> float:
+        return float(os.getenv("MODEL_METADATA_SAVE_DELAY", "1.0"))
+    
+    @property
+    def model_catalog_ttl(self) -> int:
+        return int(os.getenv("MODEL_CATALOG_TTL", "3600"))
+    
+    @property
+    def model_catalog_refresh_ahead(self) -> int:
+        return int(os.getenv("MODEL_CATALOG_REFRESH_AHEAD", "300"))
+    
+    @property
+    def model_catalog_retry_interval(self) -> int:
+        return int(os.getenv("MODEL_CATALOG_RETRY_INTERVAL", "60"))
+    
     # Rate Limiting
     @property
     def rate_limit_requests(self) -> int:
@@ -68,6 +440,39 @@ class AppConfig:
     def rate_limit_window(self) -> int:
         return int(os.getenv("RATE_LIMIT_WINDOW", "60"))
     
+    @property
+    def rate_limit_enabled(self) -> bool:
+        return os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    
+    @property
+    def rate_limit_read_requests(self) -> int:
+        return int(os.getenv("RATE_LIMIT_READ_REQUESTS", "600"))
+    
+    @property
+    def rate_limit_max_keys(self) -> int:
+        return int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+    
+    @property
+    def rate_limit_trust_proxy(self) -> bool:
+        return os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+    
+    @property
+    def rate_limit_trusted_proxies(self) -> List[str]:
+        """允许设置客户端IP请求头的代理地址（IP或CIDR）"""
+        proxies = os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "127.0.0.1,::1")
+        return [proxy.strip() for proxy in proxies.split(",") if proxy.strip()]
+    
+    @property
+    def rate_limit_exempt_paths(self) -> frozenset:
+        paths = os.getenv("RATE_LIMIT_EXEMPT_PATHS", "/health,/ready,/live")
+        return frozenset(path.strip() for path in paths.split(",") if path.strip())
+    
+    @property
+    def rate_limit_generation_paths(self) -> List[str]:
+        """写请求计入生成类额度的路径前缀（其余写请求如模板与管理接口按查询类额度计数）"""
+        paths = os.getenv("RATE_LIMIT_GENERATION_PATHS", "/generate_flashcards,/jobs")
+        return [path.strip() for path in paths.split(",") if path.strip()]
+    
     # Performance Settings
     @property
     def workers(self) -> int:
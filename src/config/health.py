@@ -7,7 +7,6 @@ import asyncio
 import logging
 from typing import Dict, Any, Optional
 from datetime import datetime
-import httpx
 
 
 class HealthChecker:
@@ -37,6 +36,9 @@ class HealthChecker:
             # System resources
             health_status["checks"]["resources"] = await self._check_system_resources()
             
+            # Per-model upstream circuit breakers
+            health_status["checks"]["circuit_breakers"] = self._check_circuit_breakers()
+            
             # Overall status determination
             failed_checks = [name for name, check in health_status["checks"].items() 
                            if not check.get("healthy", False)]
@@ -77,16 +79,17 @@ class HealthChecker:
     async def _check_openrouter_connectivity(self) -> Dict[str, Any]:
         """Check OpenRouter API connectivity (without making actual calls)."""
         try:
-            # Simple connectivity test to OpenRouter
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.head("https://openrouter.ai")
-                
-                return {
-                    "healthy": response.status_code < 500,
-                    "status_code": response.status_code,
-                    "response_time": response.elapsed.total_seconds() if response.elapsed else 0,
-                    "check_time": datetime.now().isoformat()
-                }
+            # Simple connectivity test to OpenRouter over the shared connection pool
+            from http_client import upstream_client
+            client = upstream_client.get_client()
+            response = await client.head("https://openrouter.ai", timeout=5.0)
+            
+            return {
+                "healthy": response.status_code < 500,
+                "status_code": response.status_code,
+                "response_time": response.elapsed.total_seconds() if response.elapsed else 0,
+                "check_time": datetime.now().isoformat()
+            }
         except Exception as e:
             return {
                 "healthy": False,
@@ -94,6 +97,17 @@ class HealthChecker:
                 "check_time": datetime.now().isoformat()
             }
     
+    def _check_circuit_breakers(self) -> Dict[str, Any]:
+        """Report per-model circuit breaker state (unhealthy while any breaker is open)."""
+        from circuit_breaker import upstream_breakers
+        stats = upstream_breakers.get_stats()
+        
+        return {
+            "healthy": not stats["open"],
+            **stats,
+            "check_time": datetime.now().isoformat()
+        }
+    
     async def _check_system_resources(self) -> Dict[str, Any]:
         """Check system resources."""
         try:
@@ -155,6 +169,11 @@ class MetricsCollector:
             "response_time_sum": 0.0,
             "response_time_count": 0,
             "flashcards_generated": 0,
+            "requests_coalesced": 0,
+            "upstream_retries": {},
+            "model_fallbacks": {},
+            "client_disconnects": 0,
+            "upstream_calls_cancelled": {},
             "api_errors": {},
             "model_usage": {}
         }
@@ -181,6 +200,39 @@ class MetricsCollector:
         """Record number of flashcards generated."""
         self.metrics["flashcards_generated"] += count
     
+    def record_coalesced_request(self):
+        """Record a request that was served by an identical in-flight upstream call."""
+        self.metrics["requests_coalesced"] += 1
+    
+    def _model_retry_stats(self, model_name: str) -> Dict[str, Any]:
+        return self.metrics["upstream_retries"].setdefault(
+            model_name, {"retries": 0, "recovered": 0, "exhausted": 0, "reasons": {}}
+        )
+    
+    def record_upstream_retry(self, model_name: str, reason: str):
+        """Record a retried upstream call for a model (reason is a status code or error type)."""
+        stats = self._model_retry_stats(model_name)
+        stats["retries"] += 1
+        stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+    
+    def record_retry_outcome(self, model_name: str, recovered: bool):
+        """Record whether a call that needed retries eventually succeeded."""
+        self._model_retry_stats(model_name)["recovered" if recovered else "exhausted"] += 1
+    
+    def record_model_fallback(self, from_model: str, to_model: str):
+        """Record a request that moved on to the next model in its fallback chain."""
+        targets = self.metrics["model_fallbacks"].setdefault(from_model, {})
+        targets[to_model] = targets.get(to_model, 0) + 1
+    
+    def record_client_disconnect(self):
+        """Record a generation request abandoned because the client disconnected."""
+        self.metrics["client_disconnects"] += 1
+    
+    def record_upstream_cancelled(self, model_name: str):
+        """Record an upstream call cancelled before completion because nobody needed its result."""
+        cancelled = self.metrics["upstream_calls_cancelled"]
+        cancelled[model_name] = cancelled.get(model_name, 0) + 1
+    
     def get_metrics(self) -> Dict[str, Any]:
         """Get current metrics."""
         avg_response_time = (
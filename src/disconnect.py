@@ -0,0 +1,84 @@
+"""
+AI Flashcard Generator - 客户端断开时取消生成
+客户端（关闭页面、fetch被中止）在响应完成前断开连接时，取消仍在处理中的生成请求，
+进而取消无人读取结果的上游调用；被其他合并请求共享或按缓存填充策略保留的上游调用不受影响
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from config.app_config import app_config
+from config.health import metrics_collector
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 断开时取消处理的接口（路径前缀，仅非GET请求）：单条、流式、长文档与批量生成
+CANCELLABLE_PATHS = ("/generate_flashcards",)
+
+
+class CancelOnDisconnectMiddleware:
+    """纯ASGI中间件：先读完请求体，之后由本中间件独占监听 http.disconnect
+
+    请求体会原样交还给应用；应用之后再调用 receive 时一直等待，直到客户端断开才返回 http.disconnect
+    （流式响应据此停止发送）。响应尚未发送完毕时客户端断开，则取消应用的处理任务。
+    """
+
+    def __init__(self, app, enabled: Optional[bool] = None):
+        self.app = app
+        self.enabled = enabled if enabled is not None else app_config.cancel_on_disconnect
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not self.enabled or scope["method"] in ("GET", "HEAD", "OPTIONS")
+                or not scope["path"].startswith(CANCELLABLE_PATHS)):
+            await self.app(scope, receive, send)
+            return
+
+        messages = []
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request" or not message.get("more_body", False):
+                break
+
+        client_gone = messages[-1]["type"] == "http.disconnect"
+        pending = list(messages)
+        disconnected = asyncio.Event()
+        response_complete = False
+
+        async def replay():
+            if pending:
+                return pending.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def tracked_send(message):
+            nonlocal response_complete
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+
+        handler = asyncio.create_task(self.app(scope, replay, tracked_send))
+
+        async def watch():
+            if not client_gone:
+                while (await receive())["type"] != "http.disconnect":
+                    pass
+            disconnected.set()
+            if not response_complete and not handler.done():
+                logger.info(f"客户端已断开，取消处理中的请求 {scope['path']}")
+                metrics_collector.record_client_disconnect()
+                handler.cancel()
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            # 因客户端断开而取消：无需再发送响应；否则是本请求自身被取消，继续向上传播
+            if not (disconnected.is_set() and handler.cancelled()):
+                handler.cancel()
+                raise
+        finally:
+            watcher.cancel()
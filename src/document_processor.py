@@ -0,0 +1,182 @@
+"""
+AI Flashcard Generator - 长文档处理
+负责按段落/标题切分长文本、分配卡片预算，并以有界并发执行分块生成
+（有界并发工具同样用于批量生成端点）
+"""
+
+import asyncio
+import logging
+import re
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+from config.app_config import app_config
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 中文文本约1字符/token，按保守值估算，避免超出模型上下文
+CHARS_PER_TOKEN = 1.0
+# 分块仅占用上下文窗口的一部分，为系统提示词与模型输出预留空间
+CONTEXT_INPUT_FRACTION = 0.5
+# 分块下限，避免过碎的分块导致卡片质量下降
+MIN_CHUNK_CHARS = 1000
+# 单块最多卡片数（与 PromptTemplate.max_cards 上限一致）
+MAX_CARDS_PER_CHUNK = 50
+
+_HEADING_PATTERN = re.compile(
+    r'^\s*(#{1,6}\s+\S|第[一二三四五六七八九十百千零\d]+[章节部分篇]|[一二三四五六七八九十]+、|\d+(\.\d+)*[\.、]?\s+\S)'
+)
+_SENTENCE_END_PATTERN = re.compile(r'(?<=[。！？!?；;.])\s*')
+
+
+def chunk_size_for_context(context_length: int, max_chunk_chars: Optional[int] = None) -> int:
+    """根据模型上下文长度计算分块字符数上限"""
+    max_chunk_chars = max_chunk_chars or app_config.document_chunk_max_chars
+    if context_length <= 0:
+        return max_chunk_chars
+
+    budget = int(context_length * CONTEXT_INPUT_FRACTION * CHARS_PER_TOKEN)
+    return max(MIN_CHUNK_CHARS, min(max_chunk_chars, budget))
+
+
+def _is_heading(paragraph: str) -> bool:
+    first_line = paragraph.strip().splitlines()[0] if paragraph.strip() else ""
+    return len(first_line) <= 80 and bool(_HEADING_PATTERN.match(first_line))
+
+
+def _split_oversized(paragraph: str, max_chars: int) -> List[str]:
+    """将超长段落按句子切分，仍超长的句子硬切分"""
+    pieces: List[str] = []
+    current = ""
+    for sentence in _SENTENCE_END_PATTERN.split(paragraph):
+        if not sentence:
+            continue
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + len(sentence) > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current += sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_document(text: str, max_chunk_chars: int) -> List[str]:
+    """将长文本切分为与段落/标题对齐的分块
+
+    段落按空行划分并贪心合并到 max_chunk_chars 以内；遇到标题且当前分块已有一定内容时
+    另起新块，使每块尽量对应一个完整章节；超长段落按句子继续切分。
+    """
+    paragraphs = [p.strip() for p in re.split(r'\n\s*\n', text) if p.strip()]
+    chunks: List[str] = []
+    current: List[str] = []
+    current_len = 0
+
+    def flush():
+        nonlocal current, current_len
+        if current:
+            chunks.append("\n\n".join(current))
+        current = []
+        current_len = 0
+
+    for paragraph in paragraphs:
+        if _is_heading(paragraph) and current_len >= max_chunk_chars * 0.3:
+            flush()
+
+        if len(paragraph) > max_chunk_chars:
+            flush()
+            for piece in _split_oversized(paragraph, max_chunk_chars):
+                chunks.append(piece)
+            continue
+
+        separator_len = 2 if current else 0
+        if current_len + separator_len + len(paragraph) > max_chunk_chars:
+            flush()
+            separator_len = 0
+
+        current.append(paragraph)
+        current_len += separator_len + len(paragraph)
+
+    flush()
+    return chunks
+
+
+def allocate_card_budget(chunks: List[str], max_cards: int) -> List[int]:
+    """按分块长度比例分配全局卡片预算（最大余数法）
+
+    预算不少于分块数时每块至少1张；否则只为最长的 max_cards 个分块各分配1张，
+    其余分块预算为0（调用方应跳过）。
+    """
+    count = len(chunks)
+    if count == 0:
+        return []
+
+    if max_cards < count:
+        longest = sorted(range(count), key=lambda i: len(chunks[i]), reverse=True)[:max_cards]
+        return [1 if i in longest else 0 for i in range(count)]
+
+    lengths = [max(1, len(chunk)) for chunk in chunks]
+    total_length = sum(lengths)
+    spare = max_cards - count
+    shares = [spare * length / total_length for length in lengths]
+    budgets = [1 + int(share) for share in shares]
+
+    remaining = max_cards - sum(budgets)
+    by_remainder = sorted(range(count), key=lambda i: shares[i] - int(shares[i]), reverse=True)
+    for i in by_remainder[:remaining]:
+        budgets[i] += 1
+
+    return [min(budget, MAX_CARDS_PER_CHUNK) for budget in budgets]
+
+
+async def run_bounded(items: List[T],
+                      worker: Callable[[int, T], Awaitable],
+                      max_concurrency: int) -> List:
+    """在信号量限制下并发处理所有分块，按输入顺序返回结果（异常作为结果返回）"""
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run_one(index: int, item: T):
+        async with semaphore:
+            return await worker(index, item)
+
+    return await asyncio.gather(
+        *(run_one(index, item) for index, item in enumerate(items)),
+        return_exceptions=True
+    )
+
+
+async def iter_bounded(items: List[T],
+                       worker: Callable[[int, T], Awaitable],
+                       max_concurrency: int) -> AsyncIterator[Tuple[int, Any]]:
+    """在并发上限内处理所有条目，按完成顺序逐个产出 (index, 结果或异常)
+
+    只创建 max_concurrency 个工作协程依次领取条目；调用方提前停止迭代时取消剩余工作。
+    """
+    pending = iter(enumerate(items))
+    completed: asyncio.Queue = asyncio.Queue()
+
+    async def run_worker():
+        for index, item in pending:
+            try:
+                result = await worker(index, item)
+            except Exception as e:
+                result = e
+            await completed.put((index, result))
+
+    runners = [asyncio.create_task(run_worker()) for _ in range(min(max(1, max_concurrency), len(items)))]
+    try:
+        for _ in range(len(items)):
+            yield await completed.get()
+    finally:
+        for runner in runners:
+            runner.cancel()
+        await asyncio.gather(*runners, return_exceptions=True)
@@ -0,0 +1,424 @@
+"""
+AI Flashcard Generator - 多租户加权公平排队与优先级通道
+上游调用名额（进程内共 capacity 个）满时，待发调用按优先级（交互式/批量/后台）进入不同通道，
+通道内再按租户分别排队，以加权的差额轮询（Deficit Round Robin）出队：
+大批量任务不会占满所有名额，交互式的单条请求只需等待下一个空出的名额
+"""
+
+import asyncio
+import contextvars
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, Optional, Tuple, TypeVar
+
+from config.app_config import app_config
+from rate_limiter import api_key_fingerprint
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 优先级（从高到低）
+INTERACTIVE = "interactive"
+BATCH = "batch"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BATCH, BACKGROUND)
+
+# 按接口划分的默认优先级（路径前缀），其余生成接口为交互式
+ENDPOINT_PRIORITIES = (
+    ("/generate_flashcards/batch", BATCH),
+    ("/generate_flashcards/document", BATCH),
+    ("/jobs", BATCH),
+)
+
+# 当前请求的租户（由 SchedulingMiddleware 从可信请求头设置，未设置时按API Key指纹区分）
+current_tenant: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_tenant", default=None)
+# 当前请求的优先级（由 SchedulingMiddleware 按接口与请求头设置）
+current_priority: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_priority", default=None)
+
+# 每个租户/通道保留的最近等待时间样本数
+WAIT_SAMPLES = 200
+
+
+class SchedulerQueueTimeout(Exception):
+    """在等待超时内没有轮到上游调用名额"""
+
+    def __init__(self, key: str, waited: float):
+        super().__init__(f"No fair queue slot for {key} after {waited:.1f}s")
+        self.key = key
+        self.waited = waited
+
+
+def resolve_tenant(api_key: Optional[str] = None, tenant: Optional[str] = None) -> str:
+    """确定调用所属租户：显式指定 > 请求头 > API Key指纹"""
+    tenant = tenant or current_tenant.get()
+    if tenant:
+        return tenant
+    return f"key:{api_key_fingerprint(api_key)}" if api_key else "anonymous"
+
+
+def resolve_priority(priority: Optional[str] = None) -> str:
+    """确定调用的优先级：显式指定 > 请求上下文 > 交互式"""
+    priority = priority or current_priority.get()
+    return priority if priority in PRIORITIES else INTERACTIVE
+
+
+def _wait_summary(waits: Iterable[float]) -> Dict[str, float]:
+    waits = sorted(waits)
+    return {
+        "avg_wait": round(sum(waits) / len(waits), 4) if waits else 0,
+        "p95_wait": round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 4) if waits else 0,
+    }
+
+
+class _Tenant:
+    """单个租户的统计（各通道中的排队数合计）"""
+
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = weight
+        self.queued = 0
+        self.in_flight = 0
+        self.dispatched = 0
+        self.waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "weight": self.weight,
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "dispatched": self.dispatched,
+            **_wait_summary(self.waits),
+        }
+
+
+class _TenantQueue:
+    """某个租户在一个优先级通道中的FIFO等待队列"""
+
+    __slots__ = ("tenant", "deficit", "waiters")
+
+    def __init__(self, tenant: _Tenant):
+        self.tenant = tenant
+        self.deficit = 0.0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+
+class _Lane:
+    """一个优先级通道：保留 reserved 个名额，通道内按租户加权差额轮询
+
+    只保存有等待者的租户队列，队列排空即移除。
+    """
+
+    def __init__(self, name: str, reserved: int):
+        self.name = name
+        self.reserved = reserved
+        self.in_flight = 0
+        self.dispatched = 0
+        self.borrowed = 0
+        self.timed_out = 0
+        self.waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self._queues: Dict[str, _TenantQueue] = {}
+        # 有等待者的租户队列（轮询顺序）
+        self._active: Deque[_TenantQueue] = deque()
+
+    @property
+    def waiting(self) -> bool:
+        return bool(self._active)
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue.waiters) for queue in self._active)
+
+    def push(self, tenant: _Tenant, waiter: asyncio.Future):
+        queue = self._queues.get(tenant.name)
+        if queue is None:
+            queue = self._queues[tenant.name] = _TenantQueue(tenant)
+            self._active.append(queue)
+        queue.waiters.append(waiter)
+        tenant.queued += 1
+
+    def remove(self, tenant: _Tenant, waiter: asyncio.Future):
+        queue = self._queues.get(tenant.name)
+        if queue is None:
+            return
+        try:
+            queue.waiters.remove(waiter)
+        except ValueError:
+            return
+        tenant.queued -= 1
+        if not queue.waiters:
+            del self._queues[tenant.name]
+            self._active.remove(queue)
+
+    def pop(self, quantum: float) -> Optional[Tuple[_Tenant, asyncio.Future]]:
+        """按加权差额轮询取出下一个等待者"""
+        while self._active:
+            queue = self._active[0]
+            # 跳过已取消（所属任务尚未来得及移除）的等待者
+            while queue.waiters and queue.waiters[0].done():
+                queue.waiters.popleft()
+                queue.tenant.queued -= 1
+            if not queue.waiters:
+                self._active.popleft()
+                del self._queues[queue.tenant.name]
+                continue
+            if queue.deficit < 1:
+                queue.deficit += quantum * queue.tenant.weight
+                if queue.deficit < 1:
+                    # 权重小于1的租户需要累积多轮额度
+                    self._active.rotate(-1)
+                    continue
+            queue.deficit -= 1
+            waiter = queue.waiters.popleft()
+            queue.tenant.queued -= 1
+            if not queue.waiters:
+                self._active.popleft()
+                del self._queues[queue.tenant.name]
+            elif queue.deficit < 1:
+                # 本轮额度用完，轮到下一个租户
+                self._active.rotate(-1)
+            return queue.tenant, waiter
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "reserved": self.reserved,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "dispatched": self.dispatched,
+            "borrowed": self.borrowed,
+            "timed_out": self.timed_out,
+            **_wait_summary(self.waits),
+        }
+
+
+class FairScheduler:
+    """按优先级通道与租户加权公平分配上游调用名额
+
+    - 有空闲名额且无人排队时直接执行
+    - 否则进入对应通道中该租户的FIFO队列。名额空出时：
+      1. 先满足未用满保留名额（reserved_shares * capacity）的通道，按优先级从高到低
+      2. 再交给有等待者的最高优先级通道：低优先级通道可以借用空闲名额，
+         但始终留出 headroom 个空闲名额给交互式请求，借出的名额归还后优先交给交互式请求
+    - 通道内按租户轮询，每轮为租户增加 quantum * weight 的额度，每次出队消耗1，
+      权重为2的租户每轮可发出两倍的调用
+    - 排队超过 queue_timeout（或调用方剩余的时间预算）仍未轮到时抛出 SchedulerQueueTimeout
+    """
+
+    def __init__(self,
+                 enabled: Optional[bool] = None,
+                 capacity: Optional[int] = None,
+                 weights: Optional[Dict[str, float]] = None,
+                 default_weight: Optional[float] = None,
+                 quantum: float = 1.0,
+                 max_tenants: Optional[int] = None,
+                 reserved_shares: Optional[Dict[str, float]] = None,
+                 headroom: Optional[int] = None,
+                 queue_timeout: Optional[float] = None):
+        self.enabled = enabled if enabled is not None else app_config.fair_queue_enabled
+        self.capacity = capacity if capacity is not None else app_config.fair_queue_capacity
+        self.weights = weights if weights is not None else app_config.fair_queue_weights
+        self.default_weight = default_weight if default_weight is not None else app_config.fair_queue_default_weight
+        self.quantum = quantum
+        self.max_tenants = max_tenants if max_tenants is not None else app_config.fair_queue_max_tenants
+        reserved_shares = reserved_shares if reserved_shares is not None else app_config.priority_reserved_shares
+        self.headroom = headroom if headroom is not None else app_config.priority_headroom
+        self.queue_timeout = queue_timeout if queue_timeout is not None else app_config.fair_queue_timeout
+
+        self.in_flight = 0
+        self._tenants: "OrderedDict[str, _Tenant]" = OrderedDict()
+        self._lanes: Dict[str, _Lane] = {
+            priority: _Lane(priority, int(self.capacity * reserved_shares.get(priority, 0.0)))
+            for priority in PRIORITIES
+        }
+
+    def _tenant(self, name: str) -> _Tenant:
+        tenant = self._tenants.get(name)
+        if tenant is None:
+            tenant = self._tenants[name] = _Tenant(name, self.weights.get(name, self.default_weight))
+            self._evict()
+        else:
+            self._tenants.move_to_end(name)
+        return tenant
+
+    def _evict(self):
+        # 只淘汰空闲租户的统计
+        while len(self._tenants) > self.max_tenants:
+            for name, tenant in self._tenants.items():
+                if tenant.queued == 0 and tenant.in_flight == 0:
+                    del self._tenants[name]
+                    break
+            else:
+                return
+
+    def _can_take(self, lane: _Lane) -> bool:
+        """通道能否占用一个空闲名额（调用方已确认有空闲名额）"""
+        if lane.name == INTERACTIVE or lane.in_flight < lane.reserved:
+            return True
+        return self.capacity - self.in_flight > self.headroom
+
+    def _next_lane(self) -> Optional[_Lane]:
+        waiting = [lane for lane in self._lanes.values() if lane.waiting]
+        for lane in waiting:
+            if lane.in_flight < lane.reserved:
+                return lane
+        if waiting and self._can_take(waiting[0]):
+            return waiting[0]
+        return None
+
+    def _grant(self, lane: _Lane, tenant: _Tenant):
+        self.in_flight += 1
+        lane.in_flight += 1
+        lane.dispatched += 1
+        if lane.in_flight > lane.reserved:
+            lane.borrowed += 1
+        tenant.in_flight += 1
+
+    def _dispatch(self):
+        """在空闲名额内按通道优先级与租户加权轮询唤醒等待者"""
+        while self.in_flight < self.capacity:
+            lane = self._next_lane()
+            if lane is None:
+                return
+            popped = lane.pop(self.quantum)
+            if popped is None:
+                continue
+            tenant, waiter = popped
+            self._grant(lane, tenant)
+            waiter.set_result(None)
+
+    async def acquire(self, name: str, priority: str = INTERACTIVE, timeout: Optional[float] = None):
+        """占用一个名额；timeout 为调用方剩余的时间预算，实际等待不超过 queue_timeout"""
+        lane = self._lanes[priority]
+        tenant = self._tenant(name)
+        start = time.monotonic()
+        if (self.in_flight < self.capacity and self._can_take(lane)
+                and not any(queued.waiting for queued in self._lanes.values())):
+            self._grant(lane, tenant)
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            lane.push(tenant, waiter)
+            # 低优先级通道的等待者不会占用余量名额，余量名额可立即交给本调用
+            self._dispatch()
+            timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+            # 直接等待 waiter（名额分配后在同一轮事件循环中唤醒），超时由定时器以异常结束等待
+            timer = asyncio.get_running_loop().call_later(max(0.0, timeout), self._expire,
+                                                          lane, tenant, waiter, start)
+            try:
+                await waiter
+            except SchedulerQueueTimeout:
+                raise
+            except BaseException:
+                if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                    # 已分配的名额转交给其他等待者
+                    self._release(lane, tenant)
+                else:
+                    waiter.cancel()
+                    lane.remove(tenant, waiter)
+                raise
+            finally:
+                timer.cancel()
+        wait = time.monotonic() - start
+        tenant.dispatched += 1
+        tenant.waits.append(wait)
+        lane.waits.append(wait)
+
+    @staticmethod
+    def _expire(lane: _Lane, tenant: _Tenant, waiter: asyncio.Future, start: float):
+        """排队超时：尚未分到名额的等待者移出队列并以 SchedulerQueueTimeout 结束"""
+        if waiter.done():
+            return
+        lane.remove(tenant, waiter)
+        lane.timed_out += 1
+        waiter.set_exception(SchedulerQueueTimeout(f"{lane.name}/{tenant.name}", time.monotonic() - start))
+
+    def _release(self, lane: _Lane, tenant: _Tenant):
+        self.in_flight -= 1
+        lane.in_flight -= 1
+        tenant.in_flight -= 1
+        self._dispatch()
+
+    def release(self, name: str, priority: str = INTERACTIVE):
+        self._release(self._lanes[priority], self._tenants[name])
+
+    @asynccontextmanager
+    async def slot(self, name: str, priority: str = INTERACTIVE,
+                   timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """占用一个上游调用名额（适用于需要在整个流式响应期间占用名额的场景）"""
+        if not self.enabled:
+            yield
+            return
+        await self.acquire(name, priority, timeout)
+        try:
+            yield
+        finally:
+            self.release(name, priority)
+
+    async def run(self, name: str, fn: Callable[[], Awaitable[T]], priority: str = INTERACTIVE,
+                  timeout: Optional[float] = None) -> T:
+        async with self.slot(name, priority, timeout):
+            return await fn()
+
+    @property
+    def queued(self) -> int:
+        return sum(lane.queued for lane in self._lanes.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "capacity": self.capacity,
+            "headroom": self.headroom,
+            "queue_timeout": self.queue_timeout,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "timed_out": sum(lane.timed_out for lane in self._lanes.values()),
+            "lanes": {name: lane.snapshot() for name, lane in self._lanes.items()},
+            "tenants": {name: tenant.snapshot() for name, tenant in self._tenants.items()},
+        }
+
+
+class SchedulingMiddleware:
+    """为每个请求确定排队的租户与优先级，写入 current_tenant / current_priority
+
+    - 租户：可信请求头（FAIR_QUEUE_TENANT_HEADER，默认关闭）
+    - 优先级：按接口确定（ENDPOINT_PRIORITIES），客户端可通过 PRIORITY_HEADER 请求头降低但不能提高优先级
+    """
+
+    def __init__(self, app, header: Optional[str] = None, priority_header: Optional[str] = None):
+        self.app = app
+        header = header if header is not None else app_config.fair_queue_tenant_header
+        priority_header = priority_header if priority_header is not None else app_config.priority_header
+        self.header = header.lower().encode("latin-1") if header else None
+        self.priority_header = priority_header.lower().encode("latin-1") if priority_header else None
+
+    def classify(self, path: str, requested: Optional[str]) -> str:
+        priority = next((lane for prefix, lane in ENDPOINT_PRIORITIES if path.startswith(prefix)), INTERACTIVE)
+        if requested in PRIORITIES and PRIORITIES.index(requested) > PRIORITIES.index(priority):
+            priority = requested
+        return priority
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        tenant = requested = None
+        for name, value in scope.get("headers", ()):
+            if name == self.header:
+                tenant = value.decode("latin-1").strip()[:128] or None
+            elif name == self.priority_header:
+                requested = value.decode("latin-1").strip().lower()
+        tenant_token = current_tenant.set(f"tenant:{tenant}" if tenant else None)
+        priority_token = current_priority.set(self.classify(scope["path"], requested))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_priority.reset(priority_token)
+            current_tenant.reset(tenant_token)
+
+
+# 全局实例
+fair_scheduler = FairScheduler()
@@ -0,0 +1,193 @@
+"""
+AI Flashcard Generator - 对冲请求
+首个上游请求在动态阈值（该模型近期延迟的p95）内仍未返回时，发出一个相同的对冲请求，
+采用先成功的结果并取消另一个；对冲请求占比受上限约束，避免放大上游负载
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from config.app_config import app_config
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 在对冲请求自己的并发名额内执行 attempt() 的函数
+HedgeRunner = Callable[[Callable[[], Awaitable[Any]]], Awaitable[Any]]
+
+
+class LatencyTracker:
+    """按键（模型）记录最近若干次成功请求的延迟，估算分位数"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, key: str, latency: float):
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.window)
+        samples.append(latency)
+
+    def count(self, key: str) -> int:
+        return len(self._samples.get(key, ()))
+
+    def quantile(self, key: str, q: float) -> Optional[float]:
+        samples = self._samples.get(key)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def keys(self):
+        return list(self._samples.keys())
+
+
+class HedgingPolicy:
+    """对冲请求策略（默认关闭，HEDGE_ENABLED=true 开启）
+
+    - 阈值：该键近期延迟的 quantile 分位数，不低于 min_delay；样本不足 min_samples 时不对冲
+    - 预算：最近 window 个请求中对冲请求占比不超过 max_fraction
+    - 名额：对冲请求不与首个请求共用并发名额，reserve() 拿不到空闲名额时不对冲
+    - 失败的一方不会"获胜"：先完成的请求出错时继续等待另一方
+    """
+
+    def __init__(self,
+                 enabled: Optional[bool] = None,
+                 quantile: Optional[float] = None,
+                 min_delay: Optional[float] = None,
+                 min_samples: Optional[int] = None,
+                 max_fraction: Optional[float] = None,
+                 window: Optional[int] = None):
+        self.enabled = enabled if enabled is not None else app_config.hedge_enabled
+        self.quantile = quantile if quantile is not None else app_config.hedge_quantile
+        self.min_delay = min_delay if min_delay is not None else app_config.hedge_min_delay
+        self.min_samples = min_samples if min_samples is not None else app_config.hedge_min_samples
+        self.max_fraction = max_fraction if max_fraction is not None else app_config.hedge_max_fraction
+        window = window if window is not None else app_config.hedge_window
+
+        self.latencies = LatencyTracker(window)
+        # 最近的请求是否发出了对冲，用于限制对冲占比
+        self._recent: Deque[bool] = deque(maxlen=window)
+        self.stats = {
+            "requests": 0,
+            "hedges_sent": 0,
+            "hedge_wins": 0,
+            "primary_wins": 0,
+            "skipped_budget": 0,
+            "skipped_capacity": 0,
+        }
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        """发出对冲请求前等待的时间；None 表示不对冲"""
+        if not self.enabled or self.latencies.count(key) < self.min_samples:
+            return None
+        return max(self.min_delay, self.latencies.quantile(key, self.quantile))
+
+    def _budget_allows(self) -> bool:
+        hedged = sum(self._recent)
+        return (hedged + 1) / (len(self._recent) + 1) <= self.max_fraction
+
+    async def run(self,
+                  key: str,
+                  attempt: Callable[[], Awaitable[T]],
+                  discard: Optional[Callable[[T], Awaitable[Any]]] = None,
+                  reserve: Optional[Callable[[], Optional[HedgeRunner]]] = None) -> T:
+        """执行 attempt()，必要时发出对冲请求
+
+        discard(result) 用于释放落败但已成功完成的结果（如关闭流式响应）。
+        reserve() 在发出对冲前不排队地占用对冲请求自己的并发名额，返回在该名额内执行 attempt 的函数；
+        返回 None 表示没有空闲名额，此时不对冲。
+        """
+        self.stats["requests"] += 1
+        delay = self.hedge_delay(key)
+        start = time.monotonic()
+        primary = asyncio.ensure_future(attempt())
+
+        if delay is None:
+            self._recent.append(False)
+            result = await primary
+            self.latencies.record(key, time.monotonic() - start)
+            return result
+
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+
+        hedge_allowed = not done and self._budget_allows()
+        if not done and not hedge_allowed:
+            self.stats["skipped_budget"] += 1
+        run_hedge = None
+        if hedge_allowed and reserve is not None:
+            run_hedge = reserve()
+            if run_hedge is None:
+                self.stats["skipped_capacity"] += 1
+                hedge_allowed = False
+
+        if not hedge_allowed:
+            self._recent.append(False)
+            result = await primary
+            self.latencies.record(key, time.monotonic() - start)
+            return result
+
+        self._recent.append(True)
+        self.stats["hedges_sent"] += 1
+        logger.info(f"Hedging upstream request for {key} after {delay:.2f}s")
+        hedge_start = time.monotonic()
+        hedge = asyncio.ensure_future(run_hedge(attempt) if run_hedge else attempt())
+        starts = {primary: start, hedge: hedge_start}
+        pending = {primary, hedge}
+        first_error: Optional[BaseException] = None
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        # 被外部取消的尝试不产生结果，继续等待另一方
+                        continue
+                    if task.exception() is None:
+                        winner = task
+                        break
+                    first_error = first_error or task.exception()
+                else:
+                    continue
+                break
+            else:
+                raise first_error or asyncio.CancelledError()
+        finally:
+            for task in (primary, hedge):
+                if not task.done():
+                    task.cancel()
+
+        loser = hedge if winner is primary else primary
+        await asyncio.gather(loser, return_exceptions=True)
+        if discard is not None and not loser.cancelled() and loser.exception() is None:
+            await discard(loser.result())
+
+        self.stats["hedge_wins" if winner is hedge else "primary_wins"] += 1
+        self.latencies.record(key, time.monotonic() - starts[winner])
+        return winner.result()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            # 每个对冲请求都是一次额外的上游调用（可能产生额外费用）
+            "extra_requests": self.stats["hedges_sent"],
+            "hedge_rate": self.stats["hedges_sent"] / self.stats["requests"] if self.stats["requests"] else 0,
+            "max_fraction": self.max_fraction,
+            "thresholds": {key: self.hedge_delay(key) for key in self.latencies.keys()},
+        }
+
+
+# 全局实例
+upstream_hedging = HedgingPolicy()
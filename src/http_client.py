@@ -0,0 +1,91 @@
+"""
+AI Flashcard Generator - 上游HTTP客户端管理
+为OpenRouter调用提供应用级共享的连接池客户端（keep-alive / 可选HTTP/2）
+"""
+
+import importlib.util
+import logging
+from typing import Optional
+
+import httpx
+
+from config.app_config import app_config
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class UpstreamClientManager:
+    """上游HTTP客户端管理器 - 在FastAPI生命周期内持有唯一的AsyncClient"""
+
+    def __init__(self,
+                 max_connections: Optional[int] = None,
+                 max_keepalive_connections: Optional[int] = None,
+                 keepalive_expiry: Optional[float] = None,
+                 http2: Optional[bool] = None,
+                 timeout: Optional[float] = None):
+        self.max_connections = max_connections if max_connections is not None else app_config.upstream_max_connections
+        self.max_keepalive_connections = (
+            max_keepalive_connections if max_keepalive_connections is not None
+            else app_config.upstream_max_keepalive_connections
+        )
+        self.keepalive_expiry = keepalive_expiry if keepalive_expiry is not None else app_config.upstream_keepalive_expiry
+        self.http2 = http2 if http2 is not None else app_config.upstream_http2
+        self.timeout = timeout if timeout is not None else app_config.request_timeout
+
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _http2_available(self) -> bool:
+        """HTTP/2 需要可选依赖 h2（pip install httpx[http2]）"""
+        return importlib.util.find_spec("h2") is not None
+
+    def _create_client(self) -> httpx.AsyncClient:
+        """按配置创建连接池客户端"""
+        http2 = self.http2
+        if http2 and not self._http2_available():
+            logger.warning("UPSTREAM_HTTP2 enabled but 'h2' is not installed, falling back to HTTP/1.1")
+            http2 = False
+
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry
+        )
+
+        logger.info(
+            f"Upstream client created (max_connections={self.max_connections}, "
+            f"keepalive={self.max_keepalive_connections}/{self.keepalive_expiry}s, http2={http2})"
+        )
+        return httpx.AsyncClient(limits=limits, timeout=self.timeout, http2=http2)
+
+    async def startup(self) -> httpx.AsyncClient:
+        """应用启动时创建共享客户端"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+        return self._client
+
+    async def shutdown(self):
+        """应用关闭时释放连接池"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("Upstream client closed")
+        self._client = None
+
+    def get_client(self) -> httpx.AsyncClient:
+        """获取共享客户端
+
+        正常情况下客户端由lifespan钩子创建；在脚本或测试等未经过lifespan的场景下惰性创建，
+        由最后的 shutdown() 负责关闭。
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+        return self._client
+
+    @property
+    def is_started(self) -> bool:
+        return self._client is not None and not self._client.is_closed
+
+
+# 全局实例
+upstream_client = UpstreamClientManager()
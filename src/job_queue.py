@@ -0,0 +1,615 @@
+"""
+AI Flashcard Generator - 异步任务队列
+基于SQLite（WAL模式）的持久化任务队列：长文档生成作为后台任务运行，
+按分块保存进度，进程重启后由任意worker接管并继续处理未完成的分块；
+任务结束后可选地回调webhook
+"""
+
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from config.app_config import app_config
+from document_processor import iter_bounded
+from http_client import upstream_client
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+# 分块状态
+CHUNK_PENDING = "pending"
+CHUNK_DONE = "done"
+CHUNK_FAILED = "failed"
+
+# webhook投递状态
+WEBHOOK_PENDING = "pending"
+WEBHOOK_DELIVERED = "delivered"
+WEBHOOK_FAILED = "failed"
+
+
+class WebhookURLError(ValueError):
+    """webhook地址不允许使用：非http(s)、无法解析，或指向内网/本机/链路本地等非公网地址"""
+
+
+async def validate_webhook_url(url: str) -> None:
+    """校验webhook地址，防止借回调访问服务端内网（SSRF）
+
+    JOB_WEBHOOK_ALLOWED_HOSTS 非空时只允许其中的主机（列出的主机视为可信，可以是内网地址）；
+    否则允许任意主机，但解析出的所有地址都必须是公网地址。提交任务与每次投递前都会校验。
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise WebhookURLError("webhook_url 必须是 http(s) 地址")
+    host = parts.hostname.lower()
+    allowed_hosts = app_config.job_webhook_allowed_hosts
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise WebhookURLError(f"webhook_url 的主机 {host} 不在允许列表中")
+        return
+
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, ValueError) as e:
+        raise WebhookURLError(f"webhook_url 的主机 {host} 无法解析: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise WebhookURLError(f"webhook_url 不能指向内网、本机或保留地址 ({address})")
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    request TEXT NOT NULL,
+    api_key TEXT,
+    webhook_url TEXT,
+    webhook_status TEXT,
+    webhook_attempts INTEGER NOT NULL DEFAULT 0,
+    webhook_next_at REAL,
+    error TEXT,
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_webhook ON jobs(webhook_status, webhook_next_at);
+CREATE TABLE IF NOT EXISTS job_chunks (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    chars INTEGER NOT NULL,
+    budget INTEGER,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+
+class JobStore:
+    """任务与分块进度的SQLite存储
+
+    所有数据库操作在线程池中执行，每个线程持有自己的连接；数据库在首次使用时创建。
+    API Key 仅在任务运行期间保存（用于重启后恢复），任务结束即清除。
+    """
+
+    def __init__(self, path: Optional[str] = None, max_workers: int = 2):
+        self.path = path or app_config.job_db_path
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-store")
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(SCHEMA)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    # ---- 同步实现（在线程池中执行） ----
+
+    def _create_sync(self, job_id: str, request: Dict[str, Any], api_key: str, webhook_url: Optional[str],
+                     chunks: List[str], budgets: List[Optional[int]]):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO jobs (id, status, request, api_key, webhook_url, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, JOB_QUEUED, json.dumps(request, ensure_ascii=False), api_key, webhook_url, time.time())
+            )
+            conn.executemany(
+                "INSERT INTO job_chunks (job_id, idx, text, chars, budget, status) VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, index, chunk, len(chunk), budgets[index], CHUNK_PENDING) for index, chunk in enumerate(chunks)]
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _claim_sync(self, owner: str, lease_seconds: float, max_attempts: int) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 排队中的任务，或租约已过期（原worker崩溃/重启）的运行中任务
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (JOB_QUEUED, JOB_RUNNING, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            if row["attempts"] >= max_attempts:
+                # 反复中断的任务不再重试，避免毒任务拖垮worker
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, api_key = NULL, finished_at = ?, lease_owner = NULL, "
+                    "webhook_status = CASE WHEN webhook_url IS NULL THEN NULL ELSE ? END, webhook_next_at = ? "
+                    "WHERE id = ?",
+                    (JOB_FAILED, json.dumps({"error_code": "JOB_ABANDONED", "message": "任务多次中断，已放弃"},
+                                            ensure_ascii=False),
+                     now, WEBHOOK_PENDING, now, row["id"])
+                )
+                conn.execute("COMMIT")
+                return {"id": row["id"], "abandoned": True}
+
+            conn.execute(
+                "UPDATE jobs SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                "started_at = COALESCE(started_at, ?) WHERE id = ?",
+                (JOB_RUNNING, owner, now + lease_seconds, now, row["id"])
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        job = dict(row)
+        job["request"] = json.loads(job["request"])
+        # 已开始过的任务（崩溃后租约过期，或优雅关闭时归还）视为恢复执行
+        job["resumed"] = row["started_at"] is not None
+        return job
+
+    def _renew_sync(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        conn = self._connect()
+        cursor = conn.execute(
+            "UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+            (time.time() + lease_seconds, job_id, owner, JOB_RUNNING)
+        )
+        return cursor.rowcount == 1
+
+    def _pending_chunks_sync(self, job_id: str) -> List[Dict[str, Any]]:
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT idx, text, budget FROM job_chunks WHERE job_id = ? AND status = ? ORDER BY idx",
+            (job_id, CHUNK_PENDING)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def _save_chunk_sync(self, job_id: str, index: int, status: str, result: Optional[str], error: Optional[str]):
+        conn = self._connect()
+        conn.execute(
+            "UPDATE job_chunks SET status = ?, result = ?, error = ? WHERE job_id = ? AND idx = ?",
+            (status, result, error, job_id, index)
+        )
+
+    def _finish_sync(self, job_id: str, owner: str, status: str, error: Optional[str]) -> bool:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, api_key = NULL, finished_at = ?, lease_owner = NULL, "
+                "lease_expires = NULL, webhook_status = CASE WHEN webhook_url IS NULL THEN NULL ELSE ? END, "
+                "webhook_next_at = ? WHERE id = ? AND lease_owner = ?",
+                (status, error, now, WEBHOOK_PENDING, now, job_id, owner)
+            )
+            if cursor.rowcount == 1:
+                # 结果已保存，释放原文占用的空间
+                conn.execute("UPDATE job_chunks SET text = '' WHERE job_id = ?", (job_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def _release_sync(self, owner: str) -> int:
+        conn = self._connect()
+        return conn.execute(
+            "UPDATE jobs SET status = ?, lease_owner = NULL, lease_expires = NULL, attempts = MAX(attempts - 1, 0) "
+            "WHERE lease_owner = ? AND status = ?",
+            (JOB_QUEUED, owner, JOB_RUNNING)
+        ).rowcount
+
+    def _get_sync(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job.pop("api_key", None)
+        job["request"] = json.loads(job["request"])
+        job["error"] = json.loads(job["error"]) if job["error"] else None
+        job["chunks"] = [
+            {
+                "index": chunk["idx"],
+                "chars": chunk["chars"],
+                "budget": chunk["budget"],
+                "status": chunk["status"],
+                "result": json.loads(chunk["result"]) if chunk["result"] else None,
+                "error": json.loads(chunk["error"]) if chunk["error"] else None,
+            }
+            for chunk in conn.execute(
+                "SELECT idx, chars, budget, status, result, error FROM job_chunks WHERE job_id = ? ORDER BY idx",
+                (job_id,)
+            )
+        ]
+        return job
+
+    def _claim_webhook_sync(self, hold_seconds: float) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, webhook_url, webhook_attempts FROM jobs WHERE webhook_status = ? AND webhook_next_at <= ? "
+                "ORDER BY webhook_next_at LIMIT 1",
+                (WEBHOOK_PENDING, now)
+            ).fetchone()
+            if row is not None:
+                # 推迟下次投递时间，作为投递期间的租约，避免多个worker重复投递
+                conn.execute("UPDATE jobs SET webhook_next_at = ? WHERE id = ?", (now + hold_seconds, row["id"]))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return dict(row) if row is not None else None
+
+    def _webhook_result_sync(self, job_id: str, delivered: bool, max_attempts: int, retry_delay: float) -> str:
+        conn = self._connect()
+        row = conn.execute("SELECT webhook_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        attempts = (row["webhook_attempts"] if row else 0) + 1
+        if delivered:
+            status = WEBHOOK_DELIVERED
+        elif attempts >= max_attempts:
+            status = WEBHOOK_FAILED
+        else:
+            status = WEBHOOK_PENDING
+        conn.execute(
+            "UPDATE jobs SET webhook_status = ?, webhook_attempts = ?, webhook_next_at = ? WHERE id = ?",
+            (status, attempts, time.time() + retry_delay * (2 ** (attempts - 1)), job_id)
+        )
+        return status
+
+    def _purge_sync(self, older_than: float) -> int:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = [row[0] for row in conn.execute(
+                "SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ? "
+                "AND (webhook_status IS NULL OR webhook_status != ?)",
+                (older_than, WEBHOOK_PENDING)
+            )]
+            conn.executemany("DELETE FROM job_chunks WHERE job_id = ?", [(job_id,) for job_id in expired])
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(expired)
+
+    def _counts_sync(self) -> Dict[str, int]:
+        conn = self._connect()
+        return {row[0]: row[1] for row in conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")}
+
+    # ---- 异步接口 ----
+
+    async def create(self, request: Dict[str, Any], api_key: str, webhook_url: Optional[str],
+                     chunks: List[str], budgets: List[Optional[int]]) -> str:
+        job_id = uuid.uuid4().hex
+        await self._run(self._create_sync, job_id, request, api_key, webhook_url, chunks, budgets)
+        return job_id
+
+    async def claim(self, owner: str, lease_seconds: float, max_attempts: int) -> Optional[Dict[str, Any]]:
+        return await self._run(self._claim_sync, owner, lease_seconds, max_attempts)
+
+    async def renew(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        return await self._run(self._renew_sync, job_id, owner, lease_seconds)
+
+    async def pending_chunks(self, job_id: str) -> List[Dict[str, Any]]:
+        return await self._run(self._pending_chunks_sync, job_id)
+
+    async def save_chunk_result(self, job_id: str, index: int, result: Dict[str, Any]):
+        await self._run(self._save_chunk_sync, job_id, index, CHUNK_DONE,
+                        json.dumps(result, ensure_ascii=False), None)
+
+    async def save_chunk_error(self, job_id: str, index: int, error: Dict[str, Any]):
+        await self._run(self._save_chunk_sync, job_id, index, CHUNK_FAILED,
+                        None, json.dumps(error, ensure_ascii=False))
+
+    async def finish(self, job_id: str, owner: str, status: str, error: Optional[Dict[str, Any]] = None) -> bool:
+        payload = json.dumps(error, ensure_ascii=False) if error else None
+        return await self._run(self._finish_sync, job_id, owner, status, payload)
+
+    async def release(self, owner: str) -> int:
+        return await self._run(self._release_sync, owner)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._run(self._get_sync, job_id)
+
+    async def claim_webhook(self, hold_seconds: float) -> Optional[Dict[str, Any]]:
+        return await self._run(self._claim_webhook_sync, hold_seconds)
+
+    async def record_webhook_result(self, job_id: str, delivered: bool, max_attempts: int, retry_delay: float) -> str:
+        return await self._run(self._webhook_result_sync, job_id, delivered, max_attempts, retry_delay)
+
+    async def purge(self, older_than: float) -> int:
+        return await self._run(self._purge_sync, older_than)
+
+    async def counts(self) -> Dict[str, int]:
+        return await self._run(self._counts_sync)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def _error_detail(error: BaseException) -> Dict[str, Any]:
+    """把分块异常转换为可持久化的错误信息（保留HTTP状态码与detail）"""
+    detail = getattr(error, "detail", None)
+    if not isinstance(detail, dict):
+        detail = {"error_code": "INTERNAL_ERROR", "message": str(detail or error)}
+    return {**detail, "status_code": getattr(error, "status_code", 500)}
+
+
+class JobRunner:
+    """后台任务执行器
+
+    每个进程运行若干worker协程，从共享的 JobStore 中以租约方式领取任务；
+    持有租约期间定期续约，进程崩溃后租约过期，任务由其他worker（或重启后的进程）接管，
+    仅处理仍为 pending 的分块。分块的生成逻辑与webhook负载由应用层注入。
+    """
+
+    def __init__(self,
+                 store: JobStore,
+                 process_chunk: Optional[Callable[[Dict[str, Any], int, str, Optional[int]], Awaitable[Dict[str, Any]]]] = None,
+                 build_result: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+                 workers: Optional[int] = None,
+                 lease_seconds: Optional[float] = None,
+                 poll_interval: Optional[float] = None,
+                 max_attempts: Optional[int] = None):
+        self.store = store
+        self.process_chunk = process_chunk
+        self.build_result = build_result
+        self.workers = workers if workers is not None else app_config.job_workers
+        self.lease_seconds = lease_seconds if lease_seconds is not None else app_config.job_lease_seconds
+        self.poll_interval = poll_interval if poll_interval is not None else app_config.job_poll_interval
+        self.max_attempts = max_attempts if max_attempts is not None else app_config.job_max_attempts
+
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_purge = 0.0
+        self.stats = {
+            "jobs_started": 0,
+            "jobs_resumed": 0,
+            "jobs_completed": 0,
+            "jobs_failed": 0,
+            "jobs_lost": 0,
+            "chunks_processed": 0,
+            "chunks_failed": 0,
+            "webhooks_delivered": 0,
+            "webhooks_failed": 0,
+        }
+
+    def configure(self, process_chunk, build_result):
+        """注入分块处理函数与结果构建函数（由应用层在启动时调用）"""
+        self.process_chunk = process_chunk
+        self.build_result = build_result
+
+    @property
+    def is_running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    def start(self):
+        if self.is_running:
+            return
+        if self.process_chunk is None:
+            raise RuntimeError("JobRunner.process_chunk must be configured before start()")
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker_loop(i)) for i in range(max(1, self.workers))]
+        logger.info(f"Job runner started with {self.workers} workers (owner {self.owner})")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # 归还未完成任务的租约，让重启后的进程立即接管
+        try:
+            released = await self.store.release(self.owner)
+            if released:
+                logger.info(f"Released {released} unfinished jobs back to the queue")
+        except sqlite3.Error as e:
+            logger.error(f"Failed to release job leases: {e}")
+
+    def notify(self):
+        """有新任务提交时唤醒空闲worker"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker_loop(self, worker_id: int):
+        while True:
+            try:
+                job = await self.store.claim(self.owner, self.lease_seconds, self.max_attempts)
+                if job is not None:
+                    if job.get("abandoned"):
+                        self.stats["jobs_failed"] += 1
+                        logger.warning(f"Job {job['id']} abandoned after {self.max_attempts} attempts")
+                    else:
+                        await self._run_job(job)
+                    continue
+
+                webhook = await self.store.claim_webhook(app_config.job_webhook_timeout * 2)
+                if webhook is not None:
+                    await self._deliver_webhook(webhook)
+                    continue
+
+                await self._maybe_purge()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker {worker_id} error: {e}", exc_info=True)
+                await asyncio.sleep(self.poll_interval)
+
+    async def _heartbeat(self, job_id: str, lease_lost: asyncio.Event):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await self.store.renew(job_id, self.owner, self.lease_seconds):
+                logger.warning(f"Lost lease on job {job_id}")
+                lease_lost.set()
+                return
+
+    async def _run_job(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        if job["resumed"]:
+            self.stats["jobs_resumed"] += 1
+            logger.info(f"Resuming job {job_id}, skipping already finished chunks")
+        else:
+            self.stats["jobs_started"] += 1
+
+        lease_lost = asyncio.Event()
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, lease_lost))
+        try:
+            pending = await self.store.pending_chunks(job_id)
+            concurrency = job["request"].get("max_concurrency") or app_config.document_max_concurrency
+
+            async def run_chunk(_: int, chunk: Dict[str, Any]):
+                try:
+                    result = await self.process_chunk(job, chunk["idx"], chunk["text"], chunk["budget"])
+                except Exception as e:
+                    self.stats["chunks_failed"] += 1
+                    await self.store.save_chunk_error(job_id, chunk["idx"], _error_detail(e))
+                    return
+                self.stats["chunks_processed"] += 1
+                await self.store.save_chunk_result(job_id, chunk["idx"], result)
+
+            # 每完成一个分块检查一次租约：租约已过期并被其他worker接管时停止，取消剩余分块，也不结束任务
+            async with aclosing(iter_bounded(pending, run_chunk, concurrency)) as completed:
+                async for _ in completed:
+                    if lease_lost.is_set():
+                        break
+            if lease_lost.is_set():
+                self.stats["jobs_lost"] += 1
+                logger.warning(f"Stopped processing job {job_id} after losing its lease")
+                return
+
+            snapshot = await self.store.get(job_id)
+            chunks = snapshot["chunks"] if snapshot else []
+            if chunks and all(chunk["status"] == CHUNK_FAILED for chunk in chunks):
+                status, error = JOB_FAILED, chunks[0]["error"]
+            else:
+                status, error = JOB_COMPLETED, None
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+
+        if await self.store.finish(job_id, self.owner, status, error):
+            self.stats["jobs_completed" if status == JOB_COMPLETED else "jobs_failed"] += 1
+            logger.info(f"Job {job_id} {status}")
+            self.notify()
+
+    async def _deliver_webhook(self, webhook: Dict[str, Any]):
+        job_id = webhook["id"]
+        delivered = False
+        try:
+            # 投递前重新解析：提交之后DNS记录可能已被改为内网地址
+            await validate_webhook_url(webhook["webhook_url"])
+            job = await self.store.get(job_id)
+            payload = self.build_result(job) if self.build_result else {"job_id": job_id, "status": job["status"]}
+            response = await upstream_client.get_client().post(
+                webhook["webhook_url"],
+                json=payload,
+                headers={"X-Flashcard-Job-Id": job_id},
+                timeout=app_config.job_webhook_timeout,
+                # 不跟随重定向，避免经由公网地址跳转到内网
+                follow_redirects=False
+            )
+            delivered = response.status_code < 300
+            if not delivered:
+                logger.warning(f"Webhook for job {job_id} returned {response.status_code}")
+        except Exception as e:
+            logger.warning(f"Webhook for job {job_id} failed: {e}")
+
+        status = await self.store.record_webhook_result(
+            job_id, delivered, app_config.job_webhook_max_attempts, app_config.job_webhook_retry_delay
+        )
+        if status == WEBHOOK_DELIVERED:
+            self.stats["webhooks_delivered"] += 1
+        elif status == WEBHOOK_FAILED:
+            self.stats["webhooks_failed"] += 1
+
+    async def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge < 600:
+            return
+        self._last_purge = now
+        purged = await self.store.purge(now - app_config.job_retention)
+        if purged:
+            logger.info(f"Purged {purged} finished jobs")
+
+    async def get_stats(self) -> Dict[str, Any]:
+        try:
+            counts = await self.store.counts()
+        except sqlite3.Error:
+            counts = {}
+        return {**self.stats, "running": self.is_running, "workers": self.workers, "jobs_by_status": counts}
+
+
+# 全局实例（分块处理函数由应用层在启动时注入）
+job_store = JobStore()
+job_runner = JobRunner(job_store)
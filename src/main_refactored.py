@@ -7,15 +7,35 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, AsyncIterator, Awaitable, Callable, Union
+from contextlib import asynccontextmanager
+from dataclasses import replace
+import asyncio
 import httpx
 import logging
+import math
 import re
 import time
 import json
 from prompt_manager import prompt_manager, CustomPromptTemplate
 from config.health import health_checker, metrics_collector
 from model_manager import model_manager
+from http_client import upstream_client
+from single_flight import SingleFlight
+from response_cache import response_cache, make_request_key
+from config.app_config import app_config
+from document_processor import split_document, chunk_size_for_context, allocate_card_budget, run_bounded, iter_bounded
+from job_queue import job_store, job_runner, validate_webhook_url, WebhookURLError, CHUNK_DONE, CHUNK_FAILED
+from retry_policy import upstream_retry, retry_reason
+from hedging import upstream_hedging, HedgeRunner
+from circuit_breaker import upstream_breakers, CircuitBreaker, CircuitOpenError
+from rate_limiter import rate_limiter, RateLimitMiddleware
+from adaptive_concurrency import upstream_concurrency, AdaptiveLimit, ConcurrencyQueueTimeout
+from fair_scheduler import (fair_scheduler, resolve_tenant, resolve_priority, current_tenant, current_priority,
+                            SchedulingMiddleware, SchedulerQueueTimeout, BATCH)
+from admission import admission_controller, AdmissionMiddleware
+from bulkhead import upstream_bulkheads, Bulkhead, BulkheadFullError
+from disconnect import CancelOnDisconnectMiddleware
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
@@ -81,6 +101,9 @@ SUPPORTED_MODELS = {
 
 DEFAULT_MODEL_ID = "google/gemini-2.5-flash-preview"
 
+# OpenRouter API 地址
+OPENROUTER_CHAT_URL = "https://openrouter.ai/api/v1/chat/completions"
+
 # 错误处理映射
 OPENROUTER_ERROR_MAP = {
     400: ("请求参数有误，请检查提交内容。", "BAD_REQUEST"),
@@ -93,12 +116,15 @@ OPENROUTER_ERROR_MAP = {
     503: ("无可用模型提供者，请尝试更换API Key或模型。", "SERVICE_UNAVAILABLE"),
 }
 
-# 简单缓存系统
-response_cache = {}
+# 在途生成请求合并
+generation_flights = SingleFlight("generation")
+
+# 与调用方凭据相关的上游错误，不应共享给使用其他API Key的合并请求
+KEY_SPECIFIC_ERROR_CODES = {401, 402, 403}
 
 # 数据模型定义
 class FlashcardRequest(BaseModel):
-    text: str = Field(..., min_length=1, max_length=10000, description="待处理的文本内容")
+    text: str = Field(..., min_length=1, max_length=app_config.max_text_length, description="待处理的文本内容")
     api_key: str = Field(..., min_length=1, description="OpenRouter API密钥")
     model_name: str = Field(..., description="使用的AI模型名称")
     
@@ -109,6 +135,7 @@ class FlashcardRequest(BaseModel):
     custom_user_prompt: Optional[str] = Field(default=None, description="自定义用户提示词")
     priority_keywords: Optional[List[str]] = Field(default=None, description="优先关键词列表")
     additional_instructions: Optional[str] = Field(default=None, max_length=500, description="附加指令")
+    fallback_models: Optional[List[str]] = Field(default=None, max_length=5, description="主模型暂时不可用（超时/429/5xx）时按顺序尝试的备用模型，默认使用模板配置")
     
     model_config = {
         "json_schema_extra": {
@@ -118,7 +145,8 @@ class FlashcardRequest(BaseModel):
                 "model_name": "google/gemini-2.5-flash-preview",
                 "template_id": "academic",
                 "max_cards": 8,
-                "priority_keywords": ["光合作用", "叶绿素", "ATP"]
+                "priority_keywords": ["光合作用", "叶绿素", "ATP"],
+                "fallback_models": ["openai/gpt-4.1-mini", "anthropic/claude-3-haiku"]
             }
         }
     }
@@ -134,6 +162,72 @@ class FlashcardResponse(BaseModel):
     cards_generated: Optional[int] = None
     processing_info: Optional[Dict[str, Any]] = None
 
+class DocumentFlashcardRequest(BaseModel):
+    text: str = Field(..., min_length=1, max_length=app_config.max_document_length, description="待处理的长文档内容")
+    api_key: str = Field(..., min_length=1, description="OpenRouter API密钥")
+    model_name: str = Field(..., description="使用的AI模型名称")
+    template_id: Optional[str] = Field(default=None, description="提示词模板ID")
+    max_cards: Optional[int] = Field(default=None, ge=1, le=app_config.document_max_cards, description="整份文档的最大卡片数量（按分块长度分配）")
+    additional_instructions: Optional[str] = Field(default=None, max_length=500, description="附加指令")
+    max_concurrency: Optional[int] = Field(default=None, ge=1, le=16, description="分块并发数")
+    fallback_models: Optional[List[str]] = Field(default=None, max_length=5, description="主模型暂时不可用（超时/429/5xx）时按顺序尝试的备用模型，默认使用模板配置")
+
+class JobRequest(DocumentFlashcardRequest):
+    webhook_url: Optional[str] = Field(default=None, max_length=2000, description="任务结束后以POST JSON回调的URL")
+
+class JobSubmitResponse(BaseModel):
+    job_id: str
+    status: str
+    chunks: int
+    status_url: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str
+    flashcards: List[FlashcardPair]
+    cards_generated: int
+    template_used: Optional[str] = None
+    error: Optional[Dict[str, Any]] = None
+    progress: Dict[str, Any]
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    processing_info: Optional[Dict[str, Any]] = None
+
+class BatchFlashcardItem(BaseModel):
+    text: str = Field(..., min_length=1, max_length=app_config.max_text_length, description="待处理的文本内容")
+    id: Optional[str] = Field(default=None, max_length=200, description="调用方自定义的条目标识，原样返回")
+    max_cards: Optional[int] = Field(default=None, ge=1, le=50, description="该条目的最大卡片数量（覆盖批量默认值）")
+    additional_instructions: Optional[str] = Field(default=None, max_length=500, description="该条目的附加指令（覆盖批量默认值）")
+
+class BatchFlashcardRequest(BaseModel):
+    items: List[BatchFlashcardItem] = Field(..., min_length=1, max_length=app_config.batch_max_items, description="待处理的文本列表")
+    api_key: str = Field(..., min_length=1, description="OpenRouter API密钥")
+    model_name: str = Field(..., description="使用的AI模型名称")
+    template_id: Optional[str] = Field(default=None, description="提示词模板ID")
+    max_cards: Optional[int] = Field(default=None, ge=1, le=50, description="每个条目的默认最大卡片数量")
+    additional_instructions: Optional[str] = Field(default=None, max_length=500, description="每个条目的默认附加指令")
+    max_concurrency: Optional[int] = Field(default=None, ge=1, le=64, description="批量并发数（不超过服务端上限）")
+    fallback_models: Optional[List[str]] = Field(default=None, max_length=5, description="主模型暂时不可用（超时/429/5xx）时按顺序尝试的备用模型，默认使用模板配置")
+    stream: bool = Field(default=False, description="以NDJSON流式返回，每完成一个条目输出一行")
+
+class BatchItemResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    flashcards: List[FlashcardPair] = []
+    cards_generated: int = 0
+    error: Optional[str] = None
+    error_code: Optional[str] = None
+    processing_info: Optional[Dict[str, Any]] = None
+
+class BatchFlashcardResponse(BaseModel):
+    results: List[BatchItemResult]
+    total: int
+    succeeded: int
+    failed: int
+    template_used: Optional[str] = None
+    processing_info: Optional[Dict[str, Any]] = None
+
 class TemplateListResponse(BaseModel):
     templates: Dict[str, Dict[str, Any]]
     default_template: str
@@ -217,22 +311,109 @@ def parse_llm_output(llm_output: str) -> List[FlashcardPair]:
     flashcards = [card for card in flashcards if card.q and card.a]
     return flashcards
 
-async def generate_flashcards_from_llm(
+class StreamingFlashcardParser:
+    """parse_llm_output 的增量（推式）版本
+
+    逐段喂入模型输出的token增量，内部按行驱动与 parse_llm_output 相同的Q/A状态机，
+    每张卡片一旦完整（遇到下一个Q、分隔符或输出结束）即返回。
+    """
+
+    pattern_q = re.compile(r'^[\s\-]*[Qq][：:]?\s*')
+    pattern_a = re.compile(r'^[\s\-]*[Aa][：:]?\s*')
+    pattern_separator = re.compile(r'^-{3,}$')
+
+    def __init__(self):
+        self._buffer = ""
+        self._reset_block()
+
+    def _reset_block(self):
+        self.question_text: Optional[str] = None
+        self.answer_lines: List[str] = []
+        self.current_state = 'finding_q'
+
+    def feed(self, delta: str) -> List[FlashcardPair]:
+        """喂入一段增量文本，返回本次新完成的卡片"""
+        self._buffer += delta
+        completed = []
+        while '\n' in self._buffer:
+            line, self._buffer = self._buffer.split('\n', 1)
+            completed.extend(self._process_line(line.rstrip('\r')))
+        return completed
+
+    def close(self) -> List[FlashcardPair]:
+        """输出结束，处理剩余缓冲并返回最后的卡片"""
+        completed = []
+        if self._buffer:
+            completed.extend(self._process_line(self._buffer.rstrip('\r')))
+            self._buffer = ""
+        completed.extend(self._finish_block())
+        return completed
+
+    def _make_card(self) -> List[FlashcardPair]:
+        if self.question_text and self.answer_lines:
+            answer = "\n".join(self.answer_lines).strip()
+            if answer:
+                return [FlashcardPair(q=self.question_text, a=answer)]
+        return []
+
+    def _finish_block(self) -> List[FlashcardPair]:
+        completed = self._make_card() if self.current_state == 'collecting_a' else []
+        self._reset_block()
+        return completed
+
+    def _process_line(self, line: str) -> List[FlashcardPair]:
+        # 分隔符结束当前卡片块
+        if self.pattern_separator.match(line):
+            return self._finish_block()
+
+        line_stripped = line.strip()
+        if not line_stripped:
+            return []
+
+        is_q_line = self.pattern_q.match(line_stripped)
+        is_a_line = self.pattern_a.match(line_stripped)
+        completed = []
+
+        if self.current_state == 'finding_q':
+            if is_q_line:
+                self.question_text = self.pattern_q.sub('', line_stripped).strip()
+                self.current_state = 'finding_a'
+        elif self.current_state == 'finding_a':
+            if is_a_line:
+                possible_answer_part = self.pattern_a.sub('', line_stripped).strip()
+                if possible_answer_part:
+                    self.answer_lines.append(possible_answer_part)
+                self.current_state = 'collecting_a'
+            elif is_q_line:
+                logger.error(f"Found Q without A: {self.question_text}")
+                self.question_text = self.pattern_q.sub('', line_stripped).strip()
+                self.answer_lines = []
+        elif self.current_state == 'collecting_a':
+            if is_q_line:
+                completed = self._make_card()
+                self.question_text = self.pattern_q.sub('', line_stripped).strip()
+                self.answer_lines = []
+                self.current_state = 'finding_a'
+            elif is_a_line:
+                completed = self._make_card()
+                logger.error(f"Found A without Q: {line_stripped}")
+                self._reset_block()
+            else:
+                self.answer_lines.append(line_stripped)
+
+        return completed
+
+def _build_prompts(
     text_to_process: str,
-    user_api_key: str,
-    model_name: str,
     template_id: Optional[str] = None,
     max_cards: Optional[int] = None,
     custom_system_prompt: Optional[str] = None,
     custom_user_prompt: Optional[str] = None,
-    additional_instructions: Optional[str] = None,
-    use_cache: bool = True
-) -> tuple[List[FlashcardPair], Dict[str, Any]]:
-    """调用 OpenRouter API 生成 Flashcards（支持模板系统和缓存）"""
-    
-    # 确定使用的模板和提示词
+    additional_instructions: Optional[str] = None
+) -> tuple[str, str, Dict[str, Any]]:
+    """确定使用的模板并渲染系统/用户提示词"""
     processing_info = {}
-    
+
     if custom_system_prompt and custom_user_prompt:
         # 使用完全自定义的提示词
         system_prompt = custom_system_prompt
@@ -251,43 +432,36 @@ async def generate_flashcards_from_llm(
         else:
             template = prompt_manager.get_default_template()
             template_id = prompt_manager.default_template_key
-        
-        # 处理max_cards参数
+
+        # 处理max_cards参数（使用副本，避免修改全局共享的模板对象）
         if max_cards:
-            template.max_cards = max_cards
-        
+            template = replace(template, max_cards=max_cards)
+
         # 格式化提示词
         format_kwargs = {}
         if additional_instructions:
             format_kwargs['additional_instructions'] = additional_instructions
-            
+
         system_prompt = template.format_system_prompt(**format_kwargs)
         user_prompt = template.format_user_prompt(text_to_process, **format_kwargs)
-        
+
         # 如果有额外指令，添加到系统提示词
         if additional_instructions:
             system_prompt += f"\n\n【额外要求】{additional_instructions}"
-        
+
         processing_info['prompt_source'] = 'template'
         processing_info['template_used'] = template_id
         processing_info['template_name'] = template.name
         processing_info['max_cards'] = template.max_cards
-    
-    # 生成缓存键
-    if use_cache:
-        cache_content = f"{model_name}:{system_prompt[:100]}:{hash(text_to_process)}"
-        cache_key = str(hash(cache_content))
-        if cache_key in response_cache:
-            cache_entry = response_cache[cache_key]
-            if time.time() - cache_entry['timestamp'] < 3600:  # 1小时过期
-                logger.info(f"Cache hit for key: {cache_key[:8]}...")
-                return cache_entry['flashcards'], cache_entry['processing_info']
-    
-    # 验证模型是否支持 - 使用动态模型管理器
+
+    return system_prompt, user_prompt, processing_info
+
+async def _validate_model(model_name: str):
+    """验证模型是否支持 - 使用动态模型管理器"""
     try:
         dynamic_models = await model_manager.get_all_models()
         if model_name not in dynamic_models:
-            available_models = [model_id for model_id, model_info in dynamic_models.items() 
+            available_models = [model_id for model_id, model_info in dynamic_models.items()
                               if model_info.status != "deprecated"]
             raise HTTPException(
                 status_code=400,
@@ -304,8 +478,92 @@ async def generate_flashcards_from_llm(
                 status_code=400,
                 detail=f"不支持的模型。当前仅支持: {list(SUPPORTED_MODELS.keys())}"
             )
-    
-    # 构建API请求
+
+async def _validate_fallback_models(fallback_models: Optional[List[str]]):
+    """校验请求中指定的备用模型（不支持的模型返回400）"""
+    for fallback_model in fallback_models or []:
+        await _validate_model(fallback_model)
+
+async def _fallback_chain(
+    model_name: str,
+    fallback_models: Optional[List[str]],
+    processing_info: Dict[str, Any]
+) -> List[str]:
+    """确定主模型之后按顺序尝试的备用模型
+
+    请求指定的备用模型优先（由调用方预先校验），否则使用模板配置的备用模型；
+    模板中已不在模型列表里的模型会被跳过。
+    """
+    candidates = fallback_models
+    if candidates is None:
+        template = None
+        if processing_info.get('prompt_source') == 'template':
+            template = prompt_manager.get_template(processing_info.get('template_used'))
+        candidates = template.fallback_models if template else []
+        if candidates:
+            try:
+                known_models = await model_manager.get_all_models()
+            except Exception as e:
+                logger.warning(f"Failed to get dynamic models for fallback chain, falling back to static: {e}")
+                known_models = SUPPORTED_MODELS
+            skipped = [candidate for candidate in candidates if candidate not in known_models]
+            if skipped:
+                logger.warning(f"模板备用模型不在模型列表中，已跳过: {skipped}")
+            candidates = [candidate for candidate in candidates if candidate in known_models]
+
+    chain = []
+    for candidate in candidates:
+        if candidate != model_name and candidate not in chain:
+            chain.append(candidate)
+    return chain[:app_config.model_fallback_max_models]
+
+def _should_fall_back(error: HTTPException) -> bool:
+    """超时、限流、网关错误等与模型/提供方相关的暂时性失败才切换备用模型"""
+    return error.status_code in app_config.model_fallback_statuses
+
+def _fallback_attempt(model_name: str, error: HTTPException) -> Dict[str, Any]:
+    """记录一次失败的模型尝试（写入 processing_info['fallbacks']）"""
+    detail = error.detail if isinstance(error.detail, dict) else {"message": error.detail}
+    return {
+        "model": model_name,
+        "status_code": error.status_code,
+        "error_code": detail.get("error_code", f"HTTP_{error.status_code}")
+    }
+
+def _request_identity(model_name: str, system_prompt: str, user_prompt: str,
+                      processing_info: Dict[str, Any]) -> str:
+    """完整请求身份的SHA-256键，同时用于响应缓存和在途请求合并"""
+    return make_request_key(model_name, system_prompt, user_prompt, {
+        "template_used": processing_info.get('template_used'),
+        "max_cards": processing_info.get('max_cards'),
+    })
+
+def _is_shareable_upstream_error(error: BaseException) -> bool:
+    """凭据相关错误（401/402/403）不共享，合并的请求会用自己的API Key重试"""
+    return not (isinstance(error, HTTPException) and error.status_code in KEY_SPECIFIC_ERROR_CODES)
+
+async def _get_cached_response(cache_key: str) -> Optional[tuple[List[FlashcardPair], Dict[str, Any]]]:
+    """读取未过期的缓存结果（内存未命中时查询持久化缓存）"""
+    cache_entry = await response_cache.lookup(cache_key)
+    if cache_entry is not None:
+        logger.info(f"Cache hit for key: {cache_key[:8]}...")
+        # 持久化缓存中的卡片以字典形式保存
+        flashcards = [card if isinstance(card, FlashcardPair) else FlashcardPair(**card)
+                      for card in cache_entry['flashcards']]
+        return flashcards, cache_entry['processing_info']
+    return None
+
+async def _store_cached_response(cache_key: str, flashcards: List[FlashcardPair], processing_info: Dict[str, Any]):
+    """写入缓存结果"""
+    await response_cache.store(cache_key, {
+        'flashcards': flashcards,
+        'processing_info': processing_info
+    })
+    logger.info(f"Cached response for key: {cache_key[:8]}...")
+
+def _build_upstream_request(model_name: str, system_prompt: str, user_prompt: str,
+                            user_api_key: str, stream: bool = False) -> tuple[Dict[str, Any], Dict[str, str]]:
+    """构建OpenRouter请求体和请求头"""
     payload = {
         "model": model_name,
         "messages": [
@@ -313,101 +571,932 @@ async def generate_flashcards_from_llm(
             {"role": "user", "content": user_prompt}
         ]
     }
+    if stream:
+        payload["stream"] = True
 
     # OpenRouter API 配置
     headers = {
         "Authorization": f"Bearer {user_api_key}",
         "Content-Type": "application/json",
     }
-    
+    return payload, headers
+
+def _upstream_http_error(e: httpx.HTTPStatusError) -> HTTPException:
+    """将OpenRouter的HTTP错误映射为面向用户的HTTPException"""
+    code = e.response.status_code
+    msg, codename = OPENROUTER_ERROR_MAP.get(code, ("调用模型服务时出现未知错误", "UNKNOWN"))
+    logger.error(f"OpenRouter返回错误: {code} {msg} | {e.response.text}")
+    return HTTPException(
+        status_code=code,
+        detail={
+            "success": False,
+            "error_code": codename,
+            "message": msg
+        }
+    )
+
+def _upstream_connection_error(e: httpx.RequestError) -> HTTPException:
+    """将网络错误映射为面向用户的HTTPException"""
+    logger.error(f"请求OpenRouter失败: {str(e)}")
+    return HTTPException(
+        status_code=503,
+        detail={
+            "success": False,
+            "error_code": "CONNECTION_ERROR",
+            "message": "无法连接到模型服务，请检查网络。"
+        }
+    )
+
+def _circuit_open_error(e: CircuitOpenError) -> HTTPException:
+    """熔断打开时的快速失败响应"""
+    logger.warning(f"模型 {e.key} 熔断中，拒绝请求（{e.retry_after:.0f}秒后重试探测）")
+    return HTTPException(
+        status_code=503,
+        detail={
+            "success": False,
+            "error_code": "CIRCUIT_OPEN",
+            "message": "该模型服务暂时不可用（已熔断），请稍后重试或切换模型。"
+        },
+        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+    )
+
+def _upstream_busy_error(
+    e: Union[ConcurrencyQueueTimeout, BulkheadFullError, SchedulerQueueTimeout]
+) -> HTTPException:
+    """在时间预算内未等到上游并发名额（或该模型的舱壁已满、公平队列排队超时）"""
+    logger.warning(f"等待上游并发名额超时: {e.key} ({e.waited:.1f}s)")
+    return HTTPException(
+        status_code=503,
+        detail={
+            "success": False,
+            "error_code": "UPSTREAM_BUSY",
+            "message": "模型服务繁忙，请稍后重试。"
+        }
+    )
+
+@asynccontextmanager
+async def _fair_slot(tenant: str, priority: str, timeout: float) -> AsyncIterator[None]:
+    """占用公平队列名额；排队超过 timeout（请求的时间预算）仍未轮到时以503 UPSTREAM_BUSY失败"""
+    try:
+        async with fair_scheduler.slot(tenant, priority, timeout):
+            yield
+    except SchedulerQueueTimeout as e:
+        raise _upstream_busy_error(e)
+
+def _stream_concurrency_key(model_name: str) -> str:
+    """流式调用的自适应并发按单独的键统计：其延迟是整个流的耗时，与非流式的完整响应时间不可比"""
+    return f"{model_name}#stream"
+
+class UpstreamLease:
+    """流式调用在整个流期间持有的上游名额：首个token到达后仍占用该模型的舱壁与自适应并发名额，
+    流结束、失败或被取消时由调用方 release() 归还（成功的流以整个流的耗时作为延迟样本）；
+    熔断器的结果也在流结束时才记录，中途失败的流计为该模型的失败
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.breaker: Optional[CircuitBreaker] = None
+        self.bulkhead: Optional[Bulkhead] = None
+        self.limit: Optional[AdaptiveLimit] = None
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self, error: Optional[BaseException] = None, upstream_failed: bool = False):
+        """upstream_failed=True 表示上游在流中途返回了错误数据"""
+        if self._released:
+            return
+        self._released = True
+        if self.breaker is not None:
+            upstream_breakers.record(self.breaker, error, upstream_failed)
+        if self.limit is not None:
+            self.limit.finish(error, latency=time.monotonic() - self.started)
+        if self.bulkhead is not None:
+            self.bulkhead.release()
+
+async def _call_upstream(
+    model_name: str,
+    attempt: Callable[[float], Awaitable[Any]],
+    api_key: Optional[str] = None,
+    stream: bool = False,
+    budget: Optional[float] = None
+) -> Any:
+    """按重试策略调用上游（attempt 接收剩余时间预算），并按模型统计重试
+
+    budget 为请求剩余的时间预算（已扣除在公平队列中的排队时间），未指定时使用重试策略的完整预算。
+
+    每次尝试都经过该模型的熔断器：熔断打开时立即以503失败（可切换备用模型），不再等待上游超时；
+    随后依次进入该模型的舱壁（独立的并发上限与等待队列，已满时以503失败）与“模型 + API Key”的自适应并发上限，
+    排队时间计入时间预算。
+    stream=True 时返回 (结果, UpstreamLease)：舱壁与自适应并发名额保留到调用方读完整个流后归还，
+    熔断器按整个流的结果记录。
+    """
+    retried = False
+
+    def on_retry(retry_number: int, error: BaseException, delay: float):
+        nonlocal retried
+        retried = True
+        metrics_collector.record_upstream_retry(model_name, retry_reason(error))
+
+    async def guarded(remaining: float) -> Any:
+        deadline = time.monotonic() + remaining
+        lease = UpstreamLease(model_name) if stream else None
+
+        async def limited() -> Any:
+            return await upstream_concurrency.run(
+                model_name, api_key, lambda: attempt(deadline - time.monotonic()),
+                timeout=deadline - time.monotonic()
+            )
+
+        async def isolated() -> Any:
+            if lease is None:
+                return await upstream_bulkheads.run(model_name, limited, timeout=remaining)
+            lease.bulkhead = await upstream_bulkheads.acquire(model_name, timeout=remaining)
+            lease.limit = await upstream_concurrency.acquire(
+                _stream_concurrency_key(model_name), api_key, timeout=deadline - time.monotonic()
+            )
+            lease.started = time.monotonic()
+            return await attempt(deadline - time.monotonic())
+
+        try:
+            if lease is None:
+                result = await upstream_breakers.call(model_name, isolated)
+            else:
+                lease.breaker = upstream_breakers.admit(model_name)
+                result = await isolated()
+        except BaseException as error:
+            if lease is not None:
+                lease.release(error)
+            raise
+        return result if lease is None else (result, lease)
+
+    try:
+        response = await upstream_retry.run(guarded, on_retry=on_retry, budget=budget)
+    except asyncio.CancelledError:
+        # 调用方已不需要结果（如客户端断开），上游请求随之取消
+        metrics_collector.record_upstream_cancelled(model_name)
+        raise
+    except (CircuitOpenError, ConcurrencyQueueTimeout, BulkheadFullError) as e:
+        if retried:
+            metrics_collector.record_retry_outcome(model_name, recovered=False)
+        if isinstance(e, CircuitOpenError):
+            raise _circuit_open_error(e)
+        raise _upstream_busy_error(e)
+    except Exception:
+        if retried:
+            metrics_collector.record_retry_outcome(model_name, recovered=False)
+        raise
+    if retried:
+        metrics_collector.record_retry_outcome(model_name, recovered=True)
+    return response
+
+def _hedge_reservation(model_name: str, api_key: Optional[str],
+                       stream: bool = False) -> Callable[[], Optional[HedgeRunner]]:
+    """对冲请求另占该模型的舱壁与自适应并发名额（不排队）；任一没有空闲名额时不对冲
+
+    首个请求的名额仍由 _call_upstream 持有，对冲请求不会越过两者的并发上限。
+    流式对冲只持有名额到首个token，其耗时不作为流式并发的延迟样本。
+    """
+    concurrency_key = _stream_concurrency_key(model_name) if stream else model_name
+
+    def reserve():
+        if not upstream_bulkheads.try_acquire(model_name):
+            return None
+        if not upstream_concurrency.try_acquire(concurrency_key, api_key):
+            upstream_bulkheads.release(model_name)
+            return None
+
+        async def run_hedge(attempt: Callable[[], Awaitable[Any]]) -> Any:
+            async def limited() -> Any:
+                return await upstream_concurrency.run(concurrency_key, api_key, attempt, acquired=True,
+                                                      record_latency=not stream)
+            return await upstream_bulkheads.run(model_name, limited, acquired=True)
+
+        return run_hedge
+
+    return reserve
+
+async def _fetch_flashcards(
+    model_name: str,
+    payload: Dict[str, Any],
+    headers: Dict[str, str],
+    processing_info: Dict[str, Any],
+    user_api_key: Optional[str] = None,
+    budget: Optional[float] = None
+) -> tuple[List[FlashcardPair], Dict[str, Any]]:
+    """向 OpenRouter 发送一次生成请求并解析卡片（user_api_key 用于按Key区分并发上限，budget 为剩余时间预算）"""
+
     # 日志记录
     logger.info(f"调用OpenRouter模型: {model_name}, 模板: {processing_info.get('template_used', 'unknown')}")
 
-    # 发送请求到 OpenRouter
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
+    # 发送请求到 OpenRouter（使用共享连接池客户端）
+    client = upstream_client.get_client()
+
+    async def send(remaining: float) -> httpx.Response:
+        async def post() -> httpx.Response:
             response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
+                OPENROUTER_CHAT_URL,
                 json=payload,
-                headers=headers
+                headers=headers,
+                timeout=min(app_config.request_timeout, remaining)
             )
             response.raise_for_status()
-            
-            # 解析响应
-            data = response.json()
-            
-            # LLM输出解析
-            llm_output = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-            if not llm_output or not isinstance(llm_output, str):
-                logger.error(f"OpenRouter输出为空或格式异常, 原始返回: {data}")
-                raise HTTPException(status_code=500, detail="模型未返回有效内容。")
-            
-            # 解析卡片
-            flashcards = parse_llm_output(llm_output)
-            if not flashcards:
-                logger.warning(f"LLM输出未能解析出有效问答对，原始输出：{llm_output[:200]}")
-                raise HTTPException(
-                    status_code=500,
-                    detail="生成内容未能解析成有效的问答卡片（可能原文太短，或LLM未遵守格式）。",
-                    headers={"x-llm-output": llm_output[:500]}
-                )
-            
-            # 更新处理信息
-            processing_info['cards_generated'] = len(flashcards)
-            processing_info['model_used'] = model_name
-            processing_info['raw_output_length'] = len(llm_output)
-            
-            # 缓存结果
-            if use_cache:
-                response_cache[cache_key] = {
-                    'flashcards': flashcards,
-                    'processing_info': processing_info,
-                    'timestamp': time.time()
-                }
-                logger.info(f"Cached response for key: {cache_key[:8]}...")
-                
-            return flashcards, processing_info
-            
-        except httpx.HTTPStatusError as e:
-            code = e.response.status_code
-            msg, codename = OPENROUTER_ERROR_MAP.get(code, ("调用模型服务时出现未知错误", "UNKNOWN"))
-            logger.error(f"OpenRouter返回错误: {code} {msg} | {e.response.text}")
+            return response
+
+        # 响应迟迟未返回时发出对冲请求（开启 HEDGE_ENABLED 时）
+        return await upstream_hedging.run(model_name, post, reserve=_hedge_reservation(model_name, user_api_key))
+
+    try:
+        # 429/502/503等暂时性错误按重试策略自动重试
+        response = await _call_upstream(model_name, send, api_key=user_api_key, budget=budget)
+
+        # 解析响应
+        data = response.json()
+
+        # LLM输出解析
+        llm_output = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        if not llm_output or not isinstance(llm_output, str):
+            logger.error(f"OpenRouter输出为空或格式异常, 原始返回: {data}")
+            raise HTTPException(status_code=500, detail="模型未返回有效内容。")
+
+        # 解析卡片
+        flashcards = parse_llm_output(llm_output)
+        if not flashcards:
+            logger.warning(f"LLM输出未能解析出有效问答对，原始输出：{llm_output[:200]}")
             raise HTTPException(
-                status_code=code,
-                detail={
-                    "success": False,
-                    "error_code": codename,
-                    "message": msg
-                }
+                status_code=500,
+                detail="生成内容未能解析成有效的问答卡片（可能原文太短，或LLM未遵守格式）。",
+                headers={"x-llm-output": llm_output[:500]}
             )
+
+        # 更新处理信息
+        processing_info['cards_generated'] = len(flashcards)
+        processing_info['model_used'] = model_name
+        processing_info['raw_output_length'] = len(llm_output)
+
+        return flashcards, processing_info
+
+    except HTTPException:
+        raise
+    except httpx.HTTPStatusError as e:
+        raise _upstream_http_error(e)
+    except httpx.RequestError as e:
+        raise _upstream_connection_error(e)
+    except Exception as e:
+        logger.error(f"未知错误: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "success": False,
+                "error_code": "INTERNAL_ERROR",
+                "message": f"生成Flashcards时发生未知错误: {str(e)}"
+            }
+        )
+
+async def _generate_with_model(
+    model_name: str,
+    system_prompt: str,
+    user_prompt: str,
+    processing_info: Dict[str, Any],
+    user_api_key: str,
+    use_cache: bool,
+    check_cache: bool = True,
+    tenant: Optional[str] = None,
+    priority: Optional[str] = None
+) -> tuple[List[FlashcardPair], Dict[str, Any]]:
+    """使用指定模型生成（读写缓存并合并相同的在途请求，上游调用按优先级与租户公平排队）"""
+
+    # 生成缓存键（完整请求身份）
+    cache_key = _request_identity(model_name, system_prompt, user_prompt, processing_info)
+    if use_cache and check_cache:
+        cached = await _get_cached_response(cache_key)
+        if cached:
+            return cached
+
+    # 构建API请求
+    payload, headers = _build_upstream_request(model_name, system_prompt, user_prompt, user_api_key)
+
+    async def fetch():
+        # 只有真正调用上游的leader占用公平队列名额，合并的请求不重复排队；
+        # 排队时间计入重试预算，上游调用只能使用剩余的部分
+        deadline = time.monotonic() + upstream_retry.budget
+        async with _fair_slot(resolve_tenant(user_api_key, tenant), resolve_priority(priority), upstream_retry.budget):
+            flashcards, info = await _fetch_flashcards(
+                model_name, payload, headers, processing_info, user_api_key, budget=deadline - time.monotonic()
+            )
+        # 缓存结果（由leader写入一次）
+        if use_cache:
+            await _store_cached_response(cache_key, flashcards, info)
+        return flashcards, info
+
+    # 合并相同身份的在途请求：并发的重复请求等待同一次上游调用；
+    # 所有等待者都离开（客户端断开）时取消上游调用，除非开启了 DISCONNECT_FILL_CACHE
+    (flashcards, info), coalesced = await generation_flights.do(
+        cache_key, fetch, share_error=_is_shareable_upstream_error,
+        detach=use_cache and app_config.disconnect_fill_cache
+    )
+    if coalesced:
+        metrics_collector.record_coalesced_request()
+        info = {**info, 'coalesced': True}
+    return flashcards, info
+
+async def generate_flashcards_from_llm(
+    text_to_process: str,
+    user_api_key: str,
+    model_name: str,
+    template_id: Optional[str] = None,
+    max_cards: Optional[int] = None,
+    custom_system_prompt: Optional[str] = None,
+    custom_user_prompt: Optional[str] = None,
+    additional_instructions: Optional[str] = None,
+    use_cache: bool = True,
+    validate_model: bool = True,
+    fallback_models: Optional[List[str]] = None,
+    tenant: Optional[str] = None,
+    priority: Optional[str] = None
+) -> tuple[List[FlashcardPair], Dict[str, Any]]:
+    """调用 OpenRouter API 生成 Flashcards（支持模板系统和缓存）
+
+    主模型出现暂时性失败（重试后仍为超时/429/5xx）时，按备用模型链依次尝试，
+    实际使用的模型见 processing_info['model_used']。
+    validate_model=False 用于调用方已统一校验过模型（含备用模型）的场景（如批量生成）。
+    tenant/priority 为公平排队的租户与优先级（默认取自请求上下文，后台任务需显式传入）。
+    """
+
+    # 确定使用的模板和提示词
+    system_prompt, user_prompt, processing_info = _build_prompts(
+        text_to_process, template_id, max_cards,
+        custom_system_prompt, custom_user_prompt, additional_instructions
+    )
+
+    # 主模型的缓存命中时无需校验模型
+    if use_cache:
+        cached = await _get_cached_response(
+            _request_identity(model_name, system_prompt, user_prompt, processing_info)
+        )
+        if cached:
+            return cached
+
+    # 验证模型是否支持
+    if validate_model:
+        await _validate_model(model_name)
+        await _validate_fallback_models(fallback_models)
+
+    chain = [model_name] + await _fallback_chain(model_name, fallback_models, processing_info)
+    fallbacks = []
+    for position, candidate in enumerate(chain):
+        try:
+            flashcards, info = await _generate_with_model(
+                candidate, system_prompt, user_prompt, dict(processing_info), user_api_key, use_cache,
+                # 主模型的缓存已在上面查过
+                check_cache=position > 0,
+                tenant=tenant,
+                priority=priority
+            )
+        except HTTPException as e:
+            if position + 1 >= len(chain) or not _should_fall_back(e):
+                raise
+            logger.warning(f"模型 {candidate} 暂时不可用 ({e.status_code})，切换到备用模型 {chain[position + 1]}")
+            metrics_collector.record_model_fallback(candidate, chain[position + 1])
+            fallbacks.append(_fallback_attempt(candidate, e))
+            continue
+
+        if fallbacks:
+            info = {**info, 'model_requested': model_name, 'fallbacks': fallbacks}
+        return flashcards, info
+
+async def stream_flashcards_from_llm(
+    text_to_process: str,
+    user_api_key: str,
+    model_name: str,
+    system_prompt: str,
+    user_prompt: str,
+    processing_info: Dict[str, Any],
+    use_cache: bool = True,
+    fallback_chain: Optional[List[str]] = None
+) -> AsyncIterator[FlashcardPair]:
+    """以流式方式调用 OpenRouter，每解析出一张完整卡片立即产出
+
+    提示词构建、模型校验与备用模型链（_fallback_chain）由调用方预先完成（以便在响应开始前返回正确的HTTP状态码）；
+    只在收到首个token前切换备用模型。完成后 processing_info 会被补充统计信息，结果写入缓存。
+    整个流式响应期间占用一个公平队列名额。
+    """
+    cache_key = _request_identity(model_name, system_prompt, user_prompt, processing_info)
+    if use_cache:
+        cached = await _get_cached_response(cache_key)
+        if cached:
+            flashcards, cached_info = cached
+            processing_info.update(cached_info)
+            for card in flashcards:
+                yield card
+            return
+
+    parser = StreamingFlashcardParser()
+    flashcards: List[FlashcardPair] = []
+    raw_output_length = 0
+
+    client = upstream_client.get_client()
+
+    async def open_stream(candidate: str, remaining: float) -> tuple[httpx.Response, AsyncIterator[str], Optional[str]]:
+        payload, headers = _build_upstream_request(candidate, system_prompt, user_prompt, user_api_key, stream=True)
+
+        async def attempt():
+            request = client.build_request(
+                "POST", OPENROUTER_CHAT_URL, json=payload, headers=headers,
+                timeout=min(app_config.request_timeout, remaining)
+            )
+            response = await client.send(request, stream=True)
+            try:
+                if response.status_code >= 400:
+                    await response.aread()
+                    response.raise_for_status()
+                # 等到首个数据行（首个token）才算响应，注释行不计
+                lines = response.aiter_lines()
+                first_line = None
+                async for line in lines:
+                    if line.startswith("data:"):
+                        first_line = line
+                        break
+                return response, lines, first_line
+            except BaseException:
+                await response.aclose()
+                raise
+
+        async def discard(opened):
+            await opened[0].aclose()
+
+        # 首个token迟迟未到时发出对冲请求，按流式首token延迟单独统计阈值
+        return await upstream_hedging.run(
+            f"{candidate}#stream", attempt, discard=discard,
+            reserve=_hedge_reservation(candidate, user_api_key, stream=True)
+        )
+
+    chain = [model_name] + list(fallback_chain or [])
+    fallbacks = []
+
+    async def open_first_available():
+        for position, candidate in enumerate(chain):
+            logger.info(f"流式调用OpenRouter模型: {candidate}, 模板: {processing_info.get('template_used', 'unknown')}")
+            try:
+                opened, lease = await _call_upstream(
+                    candidate, lambda remaining: open_stream(candidate, remaining), api_key=user_api_key, stream=True,
+                    budget=deadline - time.monotonic()
+                )
+                return candidate, opened, lease
+            except (httpx.HTTPStatusError, httpx.RequestError, HTTPException) as e:
+                if isinstance(e, httpx.HTTPStatusError):
+                    error = _upstream_http_error(e)
+                elif isinstance(e, httpx.RequestError):
+                    error = _upstream_connection_error(e)
+                else:
+                    error = e
+                if position + 1 >= len(chain) or not _should_fall_back(error):
+                    raise error
+                logger.warning(f"模型 {candidate} 暂时不可用 ({error.status_code})，切换到备用模型 {chain[position + 1]}")
+                metrics_collector.record_model_fallback(candidate, chain[position + 1])
+                fallbacks.append(_fallback_attempt(candidate, error))
+
+    deadline = time.monotonic() + upstream_retry.budget
+    async with _fair_slot(resolve_tenant(user_api_key), resolve_priority(), upstream_retry.budget):
+        try:
+            # 只在收到首个token前重试/对冲/切换模型，已开始输出的流不会重发
+            # 舱壁名额（lease）持续到整个流读完，慢模型的长时间流式输出同样受其并发上限约束
+            model_used, (response, lines, first_line), lease = await open_first_available()
+
+            async def stream_lines():
+                if first_line is not None:
+                    yield first_line
+                async for line in lines:
+                    yield line
+
+            stream_error: Optional[BaseException] = None
+            upstream_failed = False
+            try:
+                async for line in stream_lines():
+                    # OpenRouter会发送 ": OPENROUTER PROCESSING" 等注释行，只处理data行
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        chunk = None
+                    if not isinstance(chunk, dict):
+                        # 单个损坏的数据行不应中断已开始的输出：记录后跳过
+                        logger.warning(f"跳过无法解析的OpenRouter流式数据行 ({model_used}): {data[:200]}")
+                        continue
+                    if "error" in chunk:
+                        logger.error(f"OpenRouter流式输出中返回错误: {chunk['error']}")
+                        upstream_failed = True
+                        raise HTTPException(
+                            status_code=502,
+                            detail={
+                                "success": False,
+                                "error_code": "STREAM_ERROR",
+                                "message": OPENROUTER_ERROR_MAP[502][0]
+                            }
+                        )
+
+                    delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content") or ""
+                    raw_output_length += len(delta)
+                    for card in parser.feed(delta):
+                        flashcards.append(card)
+                        yield card
+            except (asyncio.CancelledError, GeneratorExit) as e:
+                # 客户端断开：关闭上游流，不再为无人读取的输出付费
+                stream_error = e
+                metrics_collector.record_upstream_cancelled(model_used)
+                raise
+            except BaseException as e:
+                stream_error = e
+                raise
+            finally:
+                try:
+                    await response.aclose()
+                finally:
+                    lease.release(stream_error, upstream_failed)
+
+            for card in parser.close():
+                flashcards.append(card)
+                yield card
+
+        except httpx.HTTPStatusError as e:
+            raise _upstream_http_error(e)
         except httpx.RequestError as e:
-            logger.error(f"请求OpenRouter失败: {str(e)}")
-            raise HTTPException(
-                status_code=503,
-                detail={
-                    "success": False,
-                    "error_code": "CONNECTION_ERROR",
-                    "message": "无法连接到模型服务，请检查网络。"
-                }
+            raise _upstream_connection_error(e)
+
+    if not flashcards:
+        raise HTTPException(
+            status_code=500,
+            detail="生成内容未能解析成有效的问答卡片（可能原文太短，或LLM未遵守格式）。"
+        )
+
+    processing_info['cards_generated'] = len(flashcards)
+    processing_info['model_used'] = model_used
+    processing_info['raw_output_length'] = raw_output_length
+    processing_info['streamed'] = True
+
+    if use_cache:
+        if model_used != model_name:
+            cache_key = _request_identity(model_used, system_prompt, user_prompt, processing_info)
+        await _store_cached_response(cache_key, flashcards, dict(processing_info))
+
+    # 备用模型信息只属于本次请求，不写入缓存
+    if fallbacks:
+        processing_info['model_requested'] = model_name
+        processing_info['fallbacks'] = fallbacks
+
+async def _plan_document(
+    text: str,
+    model_name: str,
+    max_cards: Optional[int] = None,
+    fallback_models: Optional[List[str]] = None
+) -> tuple[int, List[str], List[Optional[int]]]:
+    """校验模型（含备用模型）并切分文档：返回 (分块字符上限, 分块列表, 每块卡片预算)"""
+
+    # 分块大小取决于所选模型的上下文长度
+    await _validate_model(model_name)
+    await _validate_fallback_models(fallback_models)
+    context_length = 0
+    try:
+        models = await model_manager.get_all_models()
+        if model_name in models:
+            context_length = models[model_name].context_length
+    except Exception as e:
+        logger.warning(f"Failed to get context length for {model_name}, using default chunk size: {e}")
+
+    chunk_chars = chunk_size_for_context(context_length)
+    chunks = split_document(text, chunk_chars)
+    if max_cards:
+        budgets = allocate_card_budget(chunks, max_cards)
+    else:
+        budgets = [None] * len(chunks)
+    return chunk_chars, chunks, budgets
+
+def _merge_chunk_results(
+    chunk_lengths: List[int],
+    budgets: List[Optional[int]],
+    results: List[Any]
+) -> tuple[List[FlashcardPair], List[Dict[str, Any]], Optional[Exception], Optional[str]]:
+    """按分块顺序合并，每块不超过其预算，并去除重复问题
+
+    results 中每项为 (flashcards, processing_info)、异常，或 None（尚未完成的分块，跳过）。
+    返回 (卡片, 分块摘要, 首个错误, 使用的模板)。
+    """
+    flashcards: List[FlashcardPair] = []
+    seen_questions = set()
+    chunk_summaries = []
+    first_error: Optional[Exception] = None
+    template_used = None
+
+    for index, result in enumerate(results):
+        summary = {"index": index, "chars": chunk_lengths[index], "budget": budgets[index]}
+        if result is None:
+            summary["pending"] = True
+            chunk_summaries.append(summary)
+            continue
+        if isinstance(result, Exception):
+            first_error = first_error or result
+            summary["error"] = result.detail if isinstance(result, HTTPException) else str(result)
+            chunk_summaries.append(summary)
+            continue
+
+        chunk_cards, chunk_info = result
+        template_used = template_used or chunk_info.get('template_used')
+        if chunk_info.get('model_used'):
+            summary["model_used"] = chunk_info['model_used']
+        if budgets[index]:
+            chunk_cards = chunk_cards[:budgets[index]]
+        added = 0
+        for card in chunk_cards:
+            if card.q in seen_questions:
+                continue
+            seen_questions.add(card.q)
+            flashcards.append(card)
+            added += 1
+        summary["cards"] = added
+        chunk_summaries.append(summary)
+
+    return flashcards, chunk_summaries, first_error, template_used
+
+def _chunk_models_used(model_name: str, chunk_summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """分块实际使用的模型：全部相同时作为 model_used，否则另列出 models_used"""
+    models_used = []
+    for summary in chunk_summaries:
+        if summary.get("model_used") and summary["model_used"] not in models_used:
+            models_used.append(summary["model_used"])
+    if len(models_used) == 1:
+        return {'model_used': models_used[0]}
+    if len(models_used) > 1:
+        return {'model_used': model_name, 'models_used': models_used}
+    return {'model_used': model_name}
+
+async def generate_document_flashcards(
+    text: str,
+    user_api_key: str,
+    model_name: str,
+    template_id: Optional[str] = None,
+    max_cards: Optional[int] = None,
+    additional_instructions: Optional[str] = None,
+    max_concurrency: Optional[int] = None,
+    fallback_models: Optional[List[str]] = None
+) -> tuple[List[FlashcardPair], Dict[str, Any]]:
+    """长文档模式：按模型上下文切分文本，有界并发生成并合并为一副卡组"""
+
+    chunk_chars, chunks, budgets = await _plan_document(text, model_name, max_cards, fallback_models)
+    concurrency = max_concurrency or app_config.document_max_concurrency
+
+    logger.info(f"文档模式: {len(text)} 字符切分为 {len(chunks)} 块 (块上限 {chunk_chars} 字符, 并发 {concurrency})")
+
+    async def process_chunk(index: int, chunk: str):
+        if budgets[index] == 0:
+            return [], {}
+        return await generate_flashcards_from_llm(
+            text_to_process=chunk,
+            user_api_key=user_api_key,
+            model_name=model_name,
+            template_id=template_id,
+            max_cards=budgets[index],
+            additional_instructions=additional_instructions,
+            validate_model=False,
+            fallback_models=fallback_models
+        )
+
+    results = await run_bounded(chunks, process_chunk, concurrency)
+    flashcards, chunk_summaries, first_error, template_used = _merge_chunk_results(
+        [len(chunk) for chunk in chunks], budgets, results
+    )
+
+    if not flashcards and first_error:
+        raise first_error
+
+    processing_info = {
+        'prompt_source': 'template',
+        'template_used': template_used,
+        'mode': 'document',
+        'document_length': len(text),
+        'chunk_chars': chunk_chars,
+        'chunks': len(chunks),
+        'failed_chunks': sum(1 for summary in chunk_summaries if "error" in summary),
+        'max_cards': max_cards,
+        'max_concurrency': concurrency,
+        'cards_generated': len(flashcards),
+        **_chunk_models_used(model_name, chunk_summaries),
+        'chunk_details': chunk_summaries
+    }
+    return flashcards, processing_info
+
+async def _process_job_chunk(job: Dict[str, Any], index: int, text: str,
+                             budget: Optional[int]) -> Dict[str, Any]:
+    """异步任务的单块生成（与长文档模式一致），结果以可持久化的dict返回"""
+    if budget == 0:
+        return {"flashcards": [], "processing_info": {}}
+    request = job["request"]
+    generated_cards, processing_info = await generate_flashcards_from_llm(
+        text_to_process=text,
+        user_api_key=job["api_key"],
+        model_name=request["model_name"],
+        template_id=request.get("template_id"),
+        max_cards=budget,
+        additional_instructions=request.get("additional_instructions"),
+        validate_model=False,
+        fallback_models=request.get("fallback_models"),
+        tenant=request.get("tenant"),
+        priority=request.get("priority") or BATCH
+    )
+    metrics_collector.record_flashcards_generated(len(generated_cards))
+    return {
+        "flashcards": [card.model_dump() for card in generated_cards],
+        "processing_info": processing_info
+    }
+
+def _build_job_result(job: Dict[str, Any]) -> Dict[str, Any]:
+    """由任务及其分块进度构建状态响应（运行中返回已完成分块的部分卡片），同时用作webhook负载"""
+    results = []
+    for chunk in job["chunks"]:
+        if chunk["status"] == CHUNK_DONE:
+            results.append((
+                [FlashcardPair(**card) for card in chunk["result"]["flashcards"]],
+                chunk["result"]["processing_info"]
+            ))
+        elif chunk["status"] == CHUNK_FAILED:
+            error = dict(chunk["error"])
+            results.append(HTTPException(status_code=error.pop("status_code", 500), detail=error))
+        else:
+            results.append(None)
+
+    flashcards, chunk_summaries, _, template_used = _merge_chunk_results(
+        [chunk["chars"] for chunk in job["chunks"]],
+        [chunk["budget"] for chunk in job["chunks"]],
+        results
+    )
+    request = job["request"]
+    done = sum(1 for chunk in job["chunks"] if chunk["status"] == CHUNK_DONE)
+    failed = sum(1 for chunk in job["chunks"] if chunk["status"] == CHUNK_FAILED)
+
+    return JobStatusResponse(
+        job_id=job["id"],
+        status=job["status"],
+        flashcards=flashcards,
+        cards_generated=len(flashcards),
+        template_used=template_used or request.get("template_id"),
+        error=job["error"],
+        progress={
+            "chunks": len(job["chunks"]),
+            "completed": done,
+            "failed": failed,
+            "pending": len(job["chunks"]) - done - failed
+        },
+        created_at=job["created_at"],
+        started_at=job["started_at"],
+        finished_at=job["finished_at"],
+        processing_info={
+            'mode': 'job',
+            **_chunk_models_used(request.get("model_name"), chunk_summaries),
+            'max_cards': request.get("max_cards"),
+            'attempts': job["attempts"],
+            'webhook_status': job["webhook_status"],
+            'chunk_details': chunk_summaries
+        }
+    ).model_dump()
+
+def _batch_concurrency(max_concurrency: Optional[int]) -> int:
+    """批量并发数：默认使用服务端上限，且不超过该上限"""
+    limit = app_config.batch_max_concurrency
+    return max(1, min(max_concurrency or limit, limit))
+
+async def generate_batch_flashcards(
+    items: List[BatchFlashcardItem],
+    user_api_key: str,
+    model_name: str,
+    template_id: Optional[str] = None,
+    max_cards: Optional[int] = None,
+    additional_instructions: Optional[str] = None,
+    max_concurrency: Optional[int] = None,
+    fallback_models: Optional[List[str]] = None
+) -> AsyncIterator[tuple[int, Any]]:
+    """批量模式：共享API Key/模型/模板，在并发上限内逐条生成
+
+    按完成顺序产出 (index, (flashcards, processing_info) 或异常)；模型需由调用方预先校验。
+    """
+
+    async def process_item(index: int, item: BatchFlashcardItem):
+        start_time = time.time()
+        success = False
+        error_code = None
+        try:
+            if not item.text.strip():
+                error_code = "empty_text"
+                raise HTTPException(
+                    status_code=400,
+                    detail={"success": False, "error_code": "EMPTY_TEXT", "message": "输入文本不能为空"}
+                )
+
+            generated_cards, processing_info = await generate_flashcards_from_llm(
+                text_to_process=item.text,
+                user_api_key=user_api_key,
+                model_name=model_name,
+                template_id=template_id,
+                max_cards=item.max_cards or max_cards,
+                additional_instructions=item.additional_instructions or additional_instructions,
+                validate_model=False,
+                fallback_models=fallback_models
             )
-        except Exception as e:
-            logger.error(f"未知错误: {str(e)}", exc_info=True)
-            raise HTTPException(
-                status_code=500,
-                detail={
-                    "success": False,
-                    "error_code": "INTERNAL_ERROR",
-                    "message": f"生成Flashcards时发生未知错误: {str(e)}"
-                }
+            if generated_cards:
+                success = True
+                metrics_collector.record_flashcards_generated(len(generated_cards))
+            else:
+                error_code = "no_cards_generated"
+            return generated_cards, processing_info
+        except HTTPException as e:
+            error_code = error_code or f"http_{e.status_code}"
+            raise
+        except Exception:
+            error_code = "unknown_error"
+            raise
+        finally:
+            metrics_collector.record_request(
+                success=success,
+                response_time=time.time() - start_time,
+                model_name=model_name,
+                error_code=error_code
             )
 
+    async for index, outcome in iter_bounded(items, process_item, _batch_concurrency(max_concurrency)):
+        yield index, outcome
+
+def _batch_item_result(index: int, item: BatchFlashcardItem, outcome: Any) -> BatchItemResult:
+    """把单个条目的生成结果或异常转换为批量响应中的一项"""
+    if isinstance(outcome, HTTPException):
+        detail = outcome.detail if isinstance(outcome.detail, dict) else {"message": outcome.detail}
+        return BatchItemResult(
+            index=index,
+            id=item.id,
+            error=detail.get("message"),
+            error_code=detail.get("error_code", f"HTTP_{outcome.status_code}")
+        )
+    if isinstance(outcome, Exception):
+        logger.error(f"批量条目 {index} 生成失败: {str(outcome)}")
+        return BatchItemResult(index=index, id=item.id, error=str(outcome), error_code="INTERNAL_ERROR")
+
+    generated_cards, processing_info = outcome
+    if not generated_cards:
+        return BatchItemResult(
+            index=index,
+            id=item.id,
+            error="未能生成任何有效的Flashcards",
+            error_code="NO_CARDS_GENERATED",
+            processing_info=processing_info
+        )
+    return BatchItemResult(
+        index=index,
+        id=item.id,
+        flashcards=generated_cards,
+        cards_generated=len(generated_cards),
+        processing_info=processing_info
+    )
+
+# 应用生命周期：创建并释放共享的上游连接池，运行缓存过期清扫与模型列表刷新，退出前写入模型元数据
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await upstream_client.startup()
+    response_cache.start_sweeper()
+    model_manager.start_refresher()
+    job_runner.configure(_process_job_chunk, _build_job_result)
+    job_runner.start()
+    admission_controller.monitor.start()
+    try:
+        yield
+    finally:
+        await admission_controller.monitor.stop()
+        await job_runner.stop()
+        await response_cache.stop_sweeper()
+        await model_manager.stop_refresher()
+        await model_manager.close()
+        await upstream_client.shutdown()
+
 # FastAPI 应用初始化
 app = FastAPI(
     title="AI Flashcard Generator",
     description="AI驱动的智能抽认卡生成器，支持多种提示词模板",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
+# 客户端断开时取消处理中的生成请求（最内层，直接包裹业务处理）
+app.add_middleware(CancelOnDisconnectMiddleware)
+
+# 过载保护：过载时生成请求在产生上游费用前直接返回503（位于 SchedulingMiddleware 内层，按优先级拒绝）
+app.add_middleware(AdmissionMiddleware, controller=admission_controller)
+
+# 公平排队的租户与优先级（按接口分类，可信租户请求头默认关闭）
+app.add_middleware(SchedulingMiddleware)
+
+# 限流（放在CORS内层，使429响应同样带CORS头）
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
 # CORS 设置
 app.add_middleware(
     CORSMiddleware,
@@ -421,7 +1510,7 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory="."), name="static")
 
 # 导入FileResponse
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 
 # 为方便访问，在根路径提供前端文件
 @app.get("/unified")
@@ -460,7 +1549,19 @@ async def liveness_check():
 @app.get("/metrics")
 async def get_metrics():
     """获取应用指标"""
-    return metrics_collector.get_metrics()
+    return {
+        **metrics_collector.get_metrics(),
+        "response_cache": response_cache.get_stats(),
+        "single_flight": generation_flights.get_stats(),
+        "jobs": await job_runner.get_stats(),
+        "hedging": upstream_hedging.get_stats(),
+        "circuit_breakers": upstream_breakers.get_stats(),
+        "rate_limit": rate_limiter.get_stats(),
+        "upstream_concurrency": upstream_concurrency.get_stats(),
+        "fair_queue": fair_scheduler.get_stats(),
+        "admission": admission_controller.get_stats(),
+        "bulkheads": upstream_bulkheads.get_stats()
+    }
 
 @app.get("/")
 async def root():
@@ -568,7 +1669,10 @@ async def get_model_sync_status():
 async def sync_models():
     """手动同步OpenRouter模型"""
     try:
-        models = await model_manager.get_all_models(force_refresh=True)
+        if not await model_manager.refresh(force=True):
+            # 同步失败时继续使用原有模型列表
+            raise RuntimeError(model_manager.refresh_stats["last_error"])
+        models = await model_manager.get_all_models()
         return {
             "success": True,
             "message": f"同步完成，发现 {len(models)} 个模型",
@@ -639,6 +1743,8 @@ async def get_admin_dashboard():
             "system_health": health_status,
             "metrics": metrics,
             "sync_status": sync_status,
+            "circuit_breakers": upstream_breakers.get_stats(),
+            "bulkheads": upstream_bulkheads.get_stats(),
             "model_stats": {
                 "total": len(models),
                 "new": sum(1 for m in models.values() if m.status == "new"),
@@ -773,7 +1879,7 @@ async def create_flashcards(request: FlashcardRequest):
             return FlashcardResponse(flashcards=[], error="API密钥不能为空")
         
         # 文本长度限制
-        MAX_TEXT_LENGTH = 10000
+        MAX_TEXT_LENGTH = app_config.max_text_length
         if len(request.text) > MAX_TEXT_LENGTH:
             error_code = "text_too_long"
             return FlashcardResponse(
@@ -790,7 +1896,8 @@ async def create_flashcards(request: FlashcardRequest):
             max_cards=request.max_cards,
             custom_system_prompt=request.custom_system_prompt,
             custom_user_prompt=request.custom_user_prompt,
-            additional_instructions=request.additional_instructions
+            additional_instructions=request.additional_instructions,
+            fallback_models=request.fallback_models
         )
         
         if not generated_cards:
@@ -828,6 +1935,298 @@ async def create_flashcards(request: FlashcardRequest):
             error_code=error_code
         )
 
+@app.post("/generate_flashcards/document", response_model=FlashcardResponse)
+async def create_document_flashcards(request: DocumentFlashcardRequest):
+    """长文档模式：自动分块并发生成并合并为一副卡组"""
+
+    start_time = time.time()
+    success = False
+    error_code = None
+
+    try:
+        if not request.text.strip():
+            error_code = "empty_text"
+            return FlashcardResponse(flashcards=[], error="输入文本不能为空")
+
+        if not request.api_key.strip():
+            error_code = "empty_api_key"
+            return FlashcardResponse(flashcards=[], error="API密钥不能为空")
+
+        generated_cards, processing_info = await generate_document_flashcards(
+            text=request.text,
+            user_api_key=request.api_key,
+            model_name=request.model_name,
+            template_id=request.template_id,
+            max_cards=request.max_cards,
+            additional_instructions=request.additional_instructions,
+            max_concurrency=request.max_concurrency,
+            fallback_models=request.fallback_models
+        )
+
+        if not generated_cards:
+            error_code = "no_cards_generated"
+            return FlashcardResponse(
+                flashcards=[],
+                error="未能生成任何有效的Flashcards"
+            )
+
+        success = True
+        metrics_collector.record_flashcards_generated(len(generated_cards))
+
+        return FlashcardResponse(
+            flashcards=generated_cards,
+            template_used=processing_info.get('template_used'),
+            cards_generated=len(generated_cards),
+            processing_info=processing_info
+        )
+
+    except HTTPException as e:
+        error_code = f"http_{e.status_code}"
+        raise e
+    except Exception as e:
+        error_code = "unknown_error"
+        logger.error(f"处理文档请求时发生未知错误: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    finally:
+        response_time = time.time() - start_time
+        metrics_collector.record_request(
+            success=success,
+            response_time=response_time,
+            model_name=request.model_name,
+            error_code=error_code
+        )
+
+@app.post("/jobs", response_model=JobSubmitResponse, status_code=202)
+async def submit_job(request: JobRequest):
+    """提交异步生成任务：立即返回任务ID，生成在后台进行，不受HTTP/代理超时限制
+
+    任务持久化在本地SQLite队列中，按分块保存进度，服务重启后继续处理未完成的分块。
+    """
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="输入文本不能为空")
+    if not request.api_key.strip():
+        raise HTTPException(status_code=400, detail="API密钥不能为空")
+    if request.template_id and not prompt_manager.get_template(request.template_id):
+        raise HTTPException(status_code=400, detail=f"模板 {request.template_id} 不存在")
+    if request.webhook_url:
+        try:
+            await validate_webhook_url(request.webhook_url)
+        except WebhookURLError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    _, chunks, budgets = await _plan_document(
+        request.text, request.model_name, request.max_cards, request.fallback_models
+    )
+    job_id = await job_store.create(
+        # 后台处理时没有请求上下文，记录提交时的租户与优先级
+        request={**request.model_dump(exclude={"text", "api_key", "webhook_url"}),
+                 "tenant": current_tenant.get(), "priority": current_priority.get()},
+        api_key=request.api_key,
+        webhook_url=request.webhook_url,
+        chunks=chunks,
+        budgets=budgets
+    )
+    job_runner.notify()
+    logger.info(f"任务 {job_id} 已提交: {len(request.text)} 字符, {len(chunks)} 块")
+
+    return JobSubmitResponse(job_id=job_id, status="queued", chunks=len(chunks), status_url=f"/jobs/{job_id}")
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """查询任务状态与（部分）生成结果"""
+    job = await job_store.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail={"success": False, "error_code": "JOB_NOT_FOUND", "message": "任务不存在或已过期"}
+        )
+    return _build_job_result(job)
+
+def _sse_event(event: str, data: Any) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/generate_flashcards/stream")
+async def create_flashcards_stream(request: FlashcardRequest):
+    """流式生成Flashcards（SSE）：每张卡片解析完成后立即推送
+
+    事件类型：
+    - card: 单张卡片 {"index", "q", "a"}
+    - done: 生成结束 {"cards_generated", "template_used", "processing_info"}
+    - error: 生成失败 {"error_code", "message"}
+    """
+    start_time = time.time()
+
+    # 基本输入验证（与非流式端点一致，以错误事件返回）
+    validation_error = None
+    if not request.text.strip():
+        validation_error = ("empty_text", "输入文本不能为空")
+    elif not request.api_key.strip():
+        validation_error = ("empty_api_key", "API密钥不能为空")
+    elif len(request.text) > app_config.max_text_length:
+        validation_error = ("text_too_long", f"文本太长，请保持在{app_config.max_text_length}字符以内")
+
+    if validation_error:
+        error_code, message = validation_error
+        metrics_collector.record_request(
+            success=False,
+            response_time=time.time() - start_time,
+            model_name=request.model_name,
+            error_code=error_code
+        )
+
+        async def error_stream():
+            yield _sse_event("error", {"error_code": error_code, "message": message})
+
+        return StreamingResponse(error_stream(), media_type="text/event-stream")
+
+    # 在响应开始前完成提示词构建与模型校验，使错误能以正确的状态码返回
+    try:
+        system_prompt, user_prompt, processing_info = _build_prompts(
+            request.text, request.template_id, request.max_cards,
+            request.custom_system_prompt, request.custom_user_prompt,
+            request.additional_instructions
+        )
+        await _validate_model(request.model_name)
+        await _validate_fallback_models(request.fallback_models)
+        fallback_chain = await _fallback_chain(request.model_name, request.fallback_models, processing_info)
+    except HTTPException as e:
+        metrics_collector.record_request(
+            success=False,
+            response_time=time.time() - start_time,
+            model_name=request.model_name,
+            error_code=f"http_{e.status_code}"
+        )
+        raise
+
+    async def event_stream():
+        success = False
+        error_code = None
+        cards_generated = 0
+        try:
+            async for card in stream_flashcards_from_llm(
+                text_to_process=request.text,
+                user_api_key=request.api_key,
+                model_name=request.model_name,
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                processing_info=processing_info,
+                fallback_chain=fallback_chain
+            ):
+                yield _sse_event("card", {"index": cards_generated, "q": card.q, "a": card.a})
+                cards_generated += 1
+
+            success = True
+            metrics_collector.record_flashcards_generated(cards_generated)
+            yield _sse_event("done", {
+                "cards_generated": cards_generated,
+                "template_used": processing_info.get('template_used'),
+                "processing_info": processing_info
+            })
+        except HTTPException as e:
+            error_code = f"http_{e.status_code}"
+            detail = e.detail if isinstance(e.detail, dict) else {"error_code": error_code, "message": e.detail}
+            yield _sse_event("error", detail)
+        except Exception as e:
+            error_code = "unknown_error"
+            logger.error(f"流式生成时发生未知错误: {str(e)}", exc_info=True)
+            yield _sse_event("error", {"error_code": "INTERNAL_ERROR", "message": str(e)})
+        finally:
+            metrics_collector.record_request(
+                success=success,
+                response_time=time.time() - start_time,
+                model_name=request.model_name,
+                error_code=error_code
+            )
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # 关闭nginx缓冲，保证事件即时送达
+        }
+    )
+
+@app.post("/generate_flashcards/batch", response_model=BatchFlashcardResponse)
+async def create_flashcards_batch(request: BatchFlashcardRequest):
+    """批量生成Flashcards：一次请求处理多段文本，共享API Key、模型与模板
+
+    - 默认按输入顺序返回全部结果，单个条目失败不影响其他条目
+    - stream=true 时以NDJSON流式返回：每完成一个条目输出一行 {"type": "item", ...}，
+      最后输出 {"type": "done", "total", "succeeded", "failed"}
+    """
+    start_time = time.time()
+
+    # 公共参数只校验一次（API Key、模板、模型），错误以正确的状态码返回
+    if not request.api_key.strip():
+        raise HTTPException(status_code=400, detail="API密钥不能为空")
+    if request.template_id and not prompt_manager.get_template(request.template_id):
+        raise HTTPException(status_code=400, detail=f"模板 {request.template_id} 不存在")
+    await _validate_model(request.model_name)
+    await _validate_fallback_models(request.fallback_models)
+
+    concurrency = _batch_concurrency(request.max_concurrency)
+    results = generate_batch_flashcards(
+        items=request.items,
+        user_api_key=request.api_key,
+        model_name=request.model_name,
+        template_id=request.template_id,
+        max_cards=request.max_cards,
+        additional_instructions=request.additional_instructions,
+        max_concurrency=concurrency,
+        fallback_models=request.fallback_models
+    )
+
+    if request.stream:
+        async def ndjson_stream():
+            succeeded = 0
+            async for index, outcome in results:
+                item_result = _batch_item_result(index, request.items[index], outcome)
+                if item_result.error is None:
+                    succeeded += 1
+                yield json.dumps({"type": "item", **item_result.model_dump()}, ensure_ascii=False) + "\n"
+            yield json.dumps({
+                "type": "done",
+                "total": len(request.items),
+                "succeeded": succeeded,
+                "failed": len(request.items) - succeeded,
+                "duration": round(time.time() - start_time, 3)
+            }, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(
+            ndjson_stream(),
+            media_type="application/x-ndjson",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no"
+            }
+        )
+
+    ordered: List[Optional[BatchItemResult]] = [None] * len(request.items)
+    async for index, outcome in results:
+        ordered[index] = _batch_item_result(index, request.items[index], outcome)
+
+    succeeded = sum(1 for item_result in ordered if item_result.error is None)
+    template_used = next(
+        (item_result.processing_info.get('template_used') for item_result in ordered if item_result.processing_info),
+        request.template_id
+    )
+    return BatchFlashcardResponse(
+        results=ordered,
+        total=len(ordered),
+        succeeded=succeeded,
+        failed=len(ordered) - succeeded,
+        template_used=template_used,
+        processing_info={
+            'mode': 'batch',
+            'model_used': request.model_name,
+            'max_concurrency': concurrency,
+            'duration': round(time.time() - start_time, 3)
+        }
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
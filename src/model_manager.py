@@ -3,19 +3,42 @@ AI Flashcard Generator - 模型管理器
 负责动态模型发现、元数据管理和API数据融合
 """
 
+import asyncio
+import hashlib
 import json
 import os
+import tempfile
 import time
 import logging
-from typing import Dict, List, Optional, Any, Union
-from dataclasses import dataclass, asdict
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Dict, FrozenSet, List, Mapping, Optional, Any, Set, Tuple, Union
+from dataclasses import dataclass, asdict, field
 from datetime import datetime
-import httpx
+
+from config.app_config import app_config
+from http_client import upstream_client
+from single_flight import SingleFlight
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有 flock，只在进程内合并刷新
+    fcntl = None
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+OPENROUTER_MODELS_URL = "https://openrouter.ai/api/v1/models"
+
+# 模型级差异：这些字段记录新旧值，其余字段（描述较长）只记录字段名
+DIFF_VALUE_FIELDS = ("name", "pricing", "context_length")
+DIFF_OTHER_FIELDS = ("description", "architecture", "top_provider")
+
+# 等待其他进程完成刷新的最长时间（略大于拉取模型列表的30秒超时），超时后不持锁直接刷新
+REFRESH_LOCK_TIMEOUT = 45.0
+REFRESH_LOCK_POLL_INTERVAL = 0.05
+
 @dataclass
 class ModelMetadata:
     """模型元数据结构"""
@@ -28,12 +51,16 @@ class ModelMetadata:
     last_updated: str = ""
     added_by: str = "system"
     test_results: Dict[str, Any] = None
+    # 上游并发舱壁：{"max_concurrent": 4, "max_queue": 8, "queue_timeout": 10}，为空时使用全局配置
+    bulkhead: Dict[str, Any] = None
     
     def __post_init__(self):
         if self.preferred_for is None:
             self.preferred_for = []
         if self.test_results is None:
             self.test_results = {}
+        if self.bulkhead is None:
+            self.bulkhead = {}
         if not self.last_updated:
             self.last_updated = datetime.now().strftime("%Y-%m-%d")
 
@@ -95,22 +122,160 @@ class CombinedModelInfo:
             "status": self.status
         }
 
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """融合后模型目录的不可变快照，API缓存或元数据变化时整体替换"""
+    version: int
+    # (API缓存版本, 元数据版本)：与当前版本不一致时快照过期
+    key: Tuple[int, int]
+    models: Mapping[str, CombinedModelInfo]
+    active_ids: FrozenSet[str]
+    built_at: float = field(default_factory=time.time)
+    
+    def __contains__(self, model_id: str) -> bool:
+        return model_id in self.models
+    
+    def get(self, model_id: str) -> Optional[CombinedModelInfo]:
+        return self.models.get(model_id)
+    
+    def is_active(self, model_id: str) -> bool:
+        return model_id in self.active_ids
+
+@dataclass
+class CatalogFetch:
+    """一次模型列表拉取的结果；not_modified 表示上游内容未变化（304或内容哈希相同），此时 models 为空"""
+    models: List[OpenRouterModel] = field(default_factory=list)
+    etag: str = ""
+    last_modified: str = ""
+    content_hash: str = ""
+    not_modified: bool = False
+
+def diff_models(old: List[Dict[str, Any]], new: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """计算两份模型列表的模型级差异：新增、移除与字段变化（价格、上下文长度等）"""
+    old_by_id = {model["id"]: model for model in old}
+    new_by_id = {model["id"]: model for model in new}
+    changed = {}
+    for model_id, model in new_by_id.items():
+        previous = old_by_id.get(model_id)
+        if previous is None or previous == model:
+            continue
+        changes: Dict[str, Any] = {
+            name: {"old": previous.get(name), "new": model.get(name)}
+            for name in DIFF_VALUE_FIELDS if previous.get(name) != model.get(name)
+        }
+        other_fields = [name for name in DIFF_OTHER_FIELDS if previous.get(name) != model.get(name)]
+        if other_fields:
+            changes["other_fields"] = other_fields
+        changed[model_id] = changes
+    return {
+        "added": [model_id for model_id in new_by_id if model_id not in old_by_id],
+        "removed": [model_id for model_id in old_by_id if model_id not in new_by_id],
+        "changed": changed,
+    }
+
+def _write_json_atomic(path: str, data: Any) -> bool:
+    """先写入同目录下的临时文件再 os.replace，其他进程不会读到写了一半的文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return True
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
 class ModelManager:
-    """模型管理器 - 负责动态模型发现和元数据管理"""
+    """模型管理器 - 负责动态模型发现和元数据管理
+    
+    元数据按条目记录修改：只有条目变化时才写盘，多次修改在 save_delay 秒内合并为一次，
+    写入在线程池中原子完成（临时文件 + os.replace），生成请求的模型校验不再产生磁盘I/O。
+    融合后的模型目录缓存为 CatalogSnapshot，只在API缓存或元数据变化后重建，模型校验为O(1)查找。
+    OpenRouter模型列表由后台任务在过期前刷新（stale-while-revalidate）：请求始终使用最近一次成功的数据，
+    刷新失败或返回空列表时保留原数据。并发的刷新在进程内合并为一次（single-flight），
+    多个worker进程之间通过缓存文件旁的 .lock 文件锁串行，后到的进程直接采用刚写入的缓存文件。
+    同步使用条件请求（ETag / If-Modified-Since）与内容哈希，内容未变化时不重新解析；
+    有变化时按模型级差异只更新受影响的快照条目与本地元数据。
+    """
     
     def __init__(self, 
                  metadata_file: str = "local_model_metadata.json",
                  cache_file: str = "openrouter_cache.json",
-                 cache_ttl: int = 3600):  # 1小时缓存
+                 cache_ttl: Optional[int] = None,
+                 save_delay: Optional[float] = None,
+                 refresh_ahead: Optional[float] = None,
+                 retry_interval: Optional[float] = None):
         self.metadata_file = metadata_file
         self.cache_file = cache_file
-        self.cache_ttl = cache_ttl
+        self.cache_ttl = cache_ttl if cache_ttl is not None else app_config.model_catalog_ttl
+        # 提前量不超过TTL的一半，避免刷新成功后立即再次刷新
+        refresh_ahead = refresh_ahead if refresh_ahead is not None else app_config.model_catalog_refresh_ahead
+        self.refresh_ahead = min(refresh_ahead, self.cache_ttl / 2)
+        self.retry_interval = (retry_interval if retry_interval is not None
+                               else app_config.model_catalog_retry_interval)
+        self.save_delay = save_delay if save_delay is not None else app_config.model_metadata_save_delay
         
         # 加载本地元数据
         self.local_metadata: Dict[str, ModelMetadata] = self._load_local_metadata()
         
+        # 已修改、尚未写盘的条目；各条目最近一次的序列化结果（未修改的条目写盘时直接复用）
+        self._dirty: Set[str] = set()
+        self._serialized: Dict[str, Dict[str, Any]] = {
+            model_id: asdict(metadata) for model_id, metadata in self.local_metadata.items()
+        }
+        self._save_task: Optional[asyncio.Task] = None
+        # 单线程执行写盘，保证按快照顺序落盘
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-metadata")
+        self.persistence_stats = {"writes": 0, "failed_writes": 0, "entries_written": 0}
+        
+        # 模型目录快照：API缓存替换或元数据修改时递增对应版本，快照随之过期
+        self._api_version = 0
+        self._metadata_version = 0
+        self._catalog: Optional[CatalogSnapshot] = None
+        # 下次取快照时需要重新融合的模型（API差异或元数据修改）；为真时整体重建
+        self._pending_ids: Set[str] = set()
+        self._full_rebuild = False
+        # 最近一次有变化的同步的模型级差异
+        self.last_diff: Optional[Dict[str, Any]] = None
+        
+        # 后台刷新
+        self._refresher: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._refresh_flight = SingleFlight("model-catalog")
+        self.refresh_stats = {
+            "attempts": 0,
+            "failures": 0,
+            "consecutive_failures": 0,
+            "last_attempt": None,
+            "last_success": None,
+            "last_duration": None,
+            "last_error": None,
+            # 采用其他进程刚写入的缓存文件、未自行拉取的次数
+            "adopted_from_file": 0,
+            # 上游内容未变化（304或内容哈希相同）的次数
+            "not_modified": 0,
+        }
+        # 等待时间：合并到在途刷新的调用方（follower）与等待其他进程释放文件锁
+        self.refresh_wait_stats = {
+            "followers": 0,
+            "follower_wait_total": 0.0,
+            "follower_wait_max": 0.0,
+            "lock_waits": 0,
+            "lock_wait_total": 0.0,
+            "lock_wait_max": 0.0,
+            "lock_timeouts": 0,
+            "lock_errors": 0,
+        }
+        
         # OpenRouter API缓存
         self.api_cache: Dict[str, Any] = self._load_api_cache()
+        self._api_index: Dict[str, Dict[str, Any]] = {model["id"]: model for model in self.api_cache.get("models", [])}
         
         logger.info(f"ModelManager initialized with {len(self.local_metadata)} local models")
     
@@ -138,24 +303,74 @@ class ModelManager:
             logger.error(f"Failed to load metadata file: {e}")
             return {}
     
-    def _save_local_metadata(self) -> bool:
-        """保存本地模型元数据"""
+    def _mark_dirty(self, model_id: str):
+        """记录条目已修改，并安排一次合并写盘；没有运行中的事件循环时（脚本调用）立即写盘"""
+        self._dirty.add(model_id)
+        self._pending_ids.add(model_id)
+        self._metadata_version += 1
         try:
-            # 转换为可序列化的字典
-            data = {}
-            for model_id, metadata in self.local_metadata.items():
-                data[model_id] = asdict(metadata)
-            
-            with open(self.metadata_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._save_local_metadata()
+            return
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_later())
+    
+    async def _save_later(self):
+        await asyncio.sleep(self.save_delay)
+        await self.flush()
+    
+    def _serialize_dirty(self) -> Tuple[Optional[Dict[str, Any]], Set[str]]:
+        """只重新序列化已修改的条目，返回 (完整的待写入数据, 本次取出的已修改条目)；没有修改时数据为 None"""
+        dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return None, dirty
+        for model_id in dirty:
+            metadata = self.local_metadata.get(model_id)
+            if metadata is None:
+                self._serialized.pop(model_id, None)
+            else:
+                self._serialized[model_id] = asdict(metadata)
+        self.persistence_stats["entries_written"] += len(dirty)
+        return {model_id: self._serialized[model_id] for model_id in self.local_metadata}, dirty
+    
+    def _write_metadata(self, data: Dict[str, Any]) -> bool:
+        try:
+            _write_json_atomic(self.metadata_file, data)
+            self.persistence_stats["writes"] += 1
             logger.info(f"Saved {len(data)} model metadata entries")
             return True
-            
         except Exception as e:
+            self.persistence_stats["failed_writes"] += 1
             logger.error(f"Failed to save metadata file: {e}")
             return False
     
+    def _save_local_metadata(self) -> bool:
+        """同步保存本地模型元数据（仅在没有事件循环时使用）"""
+        data, dirty = self._serialize_dirty()
+        if data is None or self._write_metadata(data):
+            return True
+        self._dirty.update(dirty)
+        return False
+    
+    async def flush(self) -> bool:
+        """立即在线程池中写入所有已修改的条目"""
+        data, dirty = self._serialize_dirty()
+        if data is None:
+            return True
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(self._executor, self._write_metadata, data):
+            return True
+        # 写盘失败：只把本次取出的条目重新标记为已修改，下次修改或退出时重试
+        self._dirty.update(dirty)
+        return False
+    
+    async def close(self):
+        """取消待执行的合并写盘并立即写入剩余修改（应用退出时调用）"""
+        if self._save_task is not None and not self._save_task.done():
+            self._save_task.cancel()
+        await self.flush()
+    
     def _load_api_cache(self) -> Dict[str, Any]:
         """加载OpenRouter API缓存"""
         try:
@@ -169,18 +384,12 @@ class ModelManager:
             logger.error(f"Failed to load API cache: {e}")
             return {"models": [], "timestamp": 0}
     
-    def _save_api_cache(self, models: List[Dict]) -> bool:
+    def _save_api_cache(self, cache_data: Dict[str, Any]) -> bool:
         """保存OpenRouter API缓存"""
         try:
-            cache_data = {
-                "models": models,
-                "timestamp": time.time()
-            }
-            
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
+            _write_json_atomic(self.cache_file, cache_data)
             
-            logger.info(f"Cached {len(models)} models from OpenRouter API")
+            logger.info(f"Cached {len(cache_data['models'])} models from OpenRouter API")
             return True
             
         except Exception as e:
@@ -196,42 +405,247 @@ class ModelManager:
         return cache_age < self.cache_ttl
     
     async def fetch_openrouter_models(self) -> List[OpenRouterModel]:
-        """从OpenRouter API获取模型列表"""
+        """从OpenRouter API获取模型列表（失败时返回空列表）"""
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get("https://openrouter.ai/api/v1/models")
-                response.raise_for_status()
-                
-                data = response.json()
-                models = []
-                
-                for model_data in data.get("data", []):
-                    try:
-                        # 只保留文本生成模型
-                        if self._is_text_generation_model(model_data):
-                            model = OpenRouterModel(
-                                id=model_data.get("id", ""),
-                                name=model_data.get("name", ""),
-                                description=model_data.get("description", ""),
-                                pricing=model_data.get("pricing", {}),
-                                context_length=model_data.get("context_length", 0),
-                                architecture=model_data.get("architecture", {}),
-                                top_provider=model_data.get("top_provider", {})
-                            )
-                            models.append(model)
-                    except Exception as e:
-                        logger.warning(f"Failed to parse model {model_data.get('id', 'unknown')}: {e}")
-                
-                # 缓存结果
-                self._save_api_cache([asdict(model) for model in models])
-                logger.info(f"Fetched {len(models)} text generation models from OpenRouter")
-                
-                return models
-                
+            return (await self._fetch_models(conditional=False)).models
         except Exception as e:
             logger.error(f"Failed to fetch models from OpenRouter: {e}")
             return []
     
+    async def _fetch_models(self, conditional: bool = True) -> CatalogFetch:
+        """拉取模型列表；conditional 时带上次的 ETag / Last-Modified，上游未变化则不解析"""
+        cached = self.api_cache if conditional and self.api_cache.get("models") else {}
+        headers = {}
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+        
+        client = upstream_client.get_client()
+        response = await client.get(OPENROUTER_MODELS_URL, headers=headers, timeout=30.0)
+        etag = response.headers.get("etag", "")
+        last_modified = response.headers.get("last-modified", "")
+        if response.status_code == 304 and headers:
+            logger.info("OpenRouter model list not modified (304)")
+            return CatalogFetch(etag=etag or cached.get("etag", ""),
+                                last_modified=last_modified or cached.get("last_modified", ""),
+                                content_hash=cached.get("content_hash", ""), not_modified=True)
+        response.raise_for_status()
+        
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        if cached and content_hash == cached.get("content_hash"):
+            # 上游不支持条件请求，但内容与上次相同
+            logger.info("OpenRouter model list unchanged (same content hash)")
+            return CatalogFetch(etag=etag, last_modified=last_modified, content_hash=content_hash, not_modified=True)
+        
+        data = response.json()
+        models = []
+        
+        for model_data in data.get("data", []):
+            try:
+                # 只保留文本生成模型
+                if self._is_text_generation_model(model_data):
+                    model = OpenRouterModel(
+                        id=model_data.get("id", ""),
+                        name=model_data.get("name", ""),
+                        description=model_data.get("description", ""),
+                        pricing=model_data.get("pricing", {}),
+                        context_length=model_data.get("context_length", 0),
+                        architecture=model_data.get("architecture", {}),
+                        top_provider=model_data.get("top_provider", {})
+                    )
+                    models.append(model)
+            except Exception as e:
+                logger.warning(f"Failed to parse model {model_data.get('id', 'unknown')}: {e}")
+        
+        logger.info(f"Fetched {len(models)} text generation models from OpenRouter")
+        return CatalogFetch(models=models, etag=etag, last_modified=last_modified, content_hash=content_hash)
+    
+    async def refresh(self, force: bool = False) -> bool:
+        """刷新模型列表：并发调用合并为一次，返回是否得到了新数据
+        
+        force=False 时，如果其他进程已写入足够新的缓存文件则直接采用；force=True 时只采用
+        本次等锁期间其他进程写入的结果。
+        """
+        start = time.time()
+        refreshed, shared = await self._refresh_flight.do(
+            "catalog", lambda: self._refresh_locked(start, force), detach=True)
+        if shared:
+            waited = time.time() - start
+            stats = self.refresh_wait_stats
+            stats["followers"] += 1
+            stats["follower_wait_total"] += waited
+            stats["follower_wait_max"] = max(stats["follower_wait_max"], waited)
+        return refreshed
+    
+    async def _refresh_locked(self, started_at: float, force: bool) -> bool:
+        lock_fd = await self._acquire_refresh_lock()
+        try:
+            if await self._adopt_cache_file(started_at, force):
+                return True
+            return await self._fetch_and_replace()
+        finally:
+            if lock_fd is not None:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+                os.close(lock_fd)
+    
+    async def _acquire_refresh_lock(self) -> Optional[int]:
+        """获取跨进程刷新锁；用非阻塞 flock 轮询，等待期间可被取消"""
+        if fcntl is None:
+            return None
+        try:
+            fd = os.open(self.cache_file + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            # 锁文件不可用（如目录只读）时退化为只在进程内合并刷新
+            logger.warning(f"Cannot open model catalog refresh lock, refreshing without it: {e}")
+            self.refresh_wait_stats["lock_errors"] += 1
+            return None
+        start = time.monotonic()
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() - start >= REFRESH_LOCK_TIMEOUT:
+                        logger.warning("Timed out waiting for model catalog refresh lock, refreshing without it")
+                        self.refresh_wait_stats["lock_timeouts"] += 1
+                        os.close(fd)
+                        return None
+                    await asyncio.sleep(REFRESH_LOCK_POLL_INTERVAL)
+        except BaseException:
+            os.close(fd)
+            raise
+        waited = time.monotonic() - start
+        if waited >= REFRESH_LOCK_POLL_INTERVAL:
+            stats = self.refresh_wait_stats
+            stats["lock_waits"] += 1
+            stats["lock_wait_total"] += waited
+            stats["lock_wait_max"] = max(stats["lock_wait_max"], waited)
+        return fd
+    
+    async def _adopt_cache_file(self, started_at: float, force: bool) -> bool:
+        """其他进程已经刷新过时，直接加载它写入的缓存文件"""
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(self._executor, self._load_api_cache)
+        timestamp = cached.get("timestamp", 0)
+        if not cached.get("models") or timestamp <= self.api_cache.get("timestamp", 0):
+            return False
+        fresh = timestamp >= started_at if force else time.time() - timestamp < self.cache_ttl - self.refresh_ahead
+        if not fresh:
+            return False
+        self._replace_api_cache(cached)
+        self.refresh_stats["adopted_from_file"] += 1
+        self.refresh_stats["consecutive_failures"] = 0
+        self.refresh_stats["last_error"] = None
+        self.refresh_stats["last_success"] = timestamp
+        logger.info(f"Adopted model catalog refreshed by another worker ({len(cached['models'])} models)")
+        return True
+    
+    async def _fetch_and_replace(self) -> bool:
+        """从OpenRouter拉取模型列表并替换API缓存；失败或结果为空时保留上一次成功的数据"""
+        stats = self.refresh_stats
+        stats["attempts"] += 1
+        stats["last_attempt"] = time.time()
+        start = time.monotonic()
+        try:
+            fetch = await self._fetch_models()
+            if not fetch.not_modified and not fetch.models:
+                raise ValueError("OpenRouter returned no text generation models")
+        except Exception as e:
+            stats["last_duration"] = round(time.monotonic() - start, 3)
+            stats["failures"] += 1
+            stats["consecutive_failures"] += 1
+            stats["last_error"] = str(e) or type(e).__name__
+            logger.error(f"Failed to refresh models from OpenRouter, keeping last good catalog: {e}")
+            return False
+        
+        stats["last_duration"] = round(time.monotonic() - start, 3)
+        stats["consecutive_failures"] = 0
+        stats["last_error"] = None
+        stats["last_success"] = time.time()
+        if fetch.not_modified:
+            stats["not_modified"] += 1
+        self._replace_api_cache({
+            "models": self.api_cache["models"] if fetch.not_modified else [asdict(model) for model in fetch.models],
+            "timestamp": stats["last_success"],
+            "etag": fetch.etag,
+            "last_modified": fetch.last_modified,
+            "content_hash": fetch.content_hash,
+        })
+        # 缓存结果（内容未变化时也写入，供其他进程读取新的时间戳）
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._save_api_cache, self.api_cache)
+        return True
+    
+    def _replace_api_cache(self, cache: Dict[str, Any]):
+        """替换API缓存，计算模型级差异，只把有变化的模型标记为待重新融合"""
+        old_models = self.api_cache.get("models", [])
+        unchanged = bool(old_models) and bool(cache.get("content_hash")) and \
+            cache["content_hash"] == self.api_cache.get("content_hash")
+        self.api_cache = cache
+        if unchanged:
+            return
+        
+        diff = diff_models(old_models, cache["models"])
+        self._api_index = {model["id"]: model for model in cache["models"]}
+        if not old_models:
+            # 此前没有API数据（快照只含本地元数据），整体重建
+            self._full_rebuild = True
+        elif not (diff["added"] or diff["removed"] or diff["changed"]):
+            return
+        self._pending_ids.update(diff["added"], diff["removed"], diff["changed"])
+        self._api_version += 1
+        self.last_diff = {
+            "at": datetime.fromtimestamp(cache["timestamp"]).strftime("%Y-%m-%d %H:%M:%S"),
+            "added_count": len(diff["added"]),
+            "removed_count": len(diff["removed"]),
+            "changed_count": len(diff["changed"]),
+            **diff,
+        }
+        logger.info(f"Model catalog changed: {len(diff['added'])} added, {len(diff['removed'])} removed, "
+                    f"{len(diff['changed'])} changed")
+    
+    def _schedule_refresh(self):
+        """在后台刷新模型列表（已有刷新在进行时不重复发起）"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+    
+    async def _refresh_loop(self):
+        while True:
+            try:
+                if self.refresh_stats["consecutive_failures"]:
+                    delay = self.retry_interval
+                else:
+                    cache_age = time.time() - self.api_cache.get("timestamp", 0)
+                    delay = max(0.0, self.cache_ttl - self.refresh_ahead - cache_age)
+                await asyncio.sleep(delay)
+                self._schedule_refresh()
+                await asyncio.shield(self._refresh_task)
+            except Exception as e:
+                # 单次刷新的意外错误不能终止后台刷新任务，按失败计数后在 retry_interval 后重试
+                stats = self.refresh_stats
+                stats["failures"] += 1
+                stats["consecutive_failures"] += 1
+                stats["last_error"] = str(e) or type(e).__name__
+                logger.exception(f"Background model catalog refresh failed: {e}")
+    
+    def start_refresher(self):
+        """启动后台刷新任务（在应用生命周期内运行），在缓存过期前 refresh_ahead 秒刷新"""
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.create_task(self._refresh_loop())
+    
+    async def stop_refresher(self):
+        for task in (self._refresher, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._refresher = None
+        self._refresh_task = None
+    
     def _is_text_generation_model(self, model_data: Dict) -> bool:
         """判断是否为文本生成模型"""
         model_id = model_data.get("id", "").lower()
@@ -301,72 +715,134 @@ class ModelManager:
         else:
             return "性价比均衡，多场景适用"
     
-    async def get_all_models(self, force_refresh: bool = False) -> Dict[str, CombinedModelInfo]:
-        """获取所有模型（API数据 + 本地元数据）"""
+    async def get_all_models(self, force_refresh: bool = False) -> Mapping[str, CombinedModelInfo]:
+        """获取所有模型（API数据 + 本地元数据），返回只读映射
+        
+        缓存过期时不等待：在后台刷新，本次仍返回最近一次成功的数据；force_refresh 时等待刷新完成
+        """
+        if force_refresh:
+            await self.refresh(force=True)
+        elif not self._is_cache_valid():
+            self._schedule_refresh()
         
-        # 获取OpenRouter模型数据
-        if force_refresh or not self._is_cache_valid():
-            api_models = await self.fetch_openrouter_models()
-            self.api_cache = {
-                "models": [asdict(model) for model in api_models],
-                "timestamp": time.time()
-            }
+        return self.get_snapshot().models
+    
+    def get_snapshot(self) -> CatalogSnapshot:
+        """同步获取当前模型目录快照（不触发API同步），仅在API缓存或元数据变化后更新"""
+        catalog = self._catalog
+        if catalog is not None and catalog.key == (self._api_version, self._metadata_version):
+            return catalog
+        version = catalog.version + 1 if catalog else 1
+        if catalog is None or self._full_rebuild or not self._api_index:
+            catalog = self._build_snapshot(version)
         else:
-            # 使用缓存数据
-            api_models = [OpenRouterModel(**model_data) for model_data in self.api_cache.get("models", [])]
-            logger.info(f"Using cached OpenRouter models ({len(api_models)} models)")
+            catalog = self._update_snapshot(catalog, version)
+        self._catalog = catalog
+        return catalog
+    
+    def _combine(self, model_id: str, metadata: ModelMetadata,
+                 api_model: Optional[OpenRouterModel] = None) -> CombinedModelInfo:
+        if api_model is None:
+            api_model = OpenRouterModel(
+                id=model_id,
+                name=model_id.split("/")[-1] if "/" in model_id else model_id,
+                description="缓存数据不可用，显示基础信息"
+            )
+        return CombinedModelInfo(
+            id=api_model.id,
+            name=api_model.name,
+            description=api_model.description,
+            pricing=api_model.pricing,
+            context_length=api_model.context_length,
+            architecture=api_model.architecture,
+            suggested_use=metadata.suggested_use,
+            local_notes=metadata.local_notes,
+            quality_rating=metadata.quality_rating,
+            cost_efficiency=metadata.cost_efficiency,
+            preferred_for=metadata.preferred_for,
+            status=metadata.status,
+            last_updated=metadata.last_updated,
+            test_results=metadata.test_results,
+            max_tokens=api_model.context_length  # 兼容旧格式
+        )
+    
+    def _merge(self, model_data: Dict[str, Any]) -> CombinedModelInfo:
+        """融合一个API模型与其本地元数据；新发现的模型创建智能默认元数据"""
+        api_model = OpenRouterModel(**model_data)
+        metadata = self.local_metadata.get(api_model.id)
         
-        # 融合API数据和本地元数据
+        if metadata is None:
+            metadata = ModelMetadata(
+                suggested_use=self._generate_smart_suggestion(api_model),
+                local_notes=f"从OpenRouter API自动发现于 {datetime.now().strftime('%Y-%m-%d')}",
+                status="new",
+                added_by="system"
+            )
+            self.local_metadata[api_model.id] = metadata
+            self._mark_dirty(api_model.id)
+            logger.info(f"New model discovered: {api_model.id} - {metadata.suggested_use}")
+        
+        return self._combine(api_model.id, metadata, api_model)
+    
+    def _deprecate_if_missing(self, model_id: str):
+        """API中已不存在的模型（可能已下线）标记为 deprecated"""
+        metadata = self.local_metadata.get(model_id)
+        if metadata is not None and metadata.status != "deprecated":
+            logger.warning(f"Model {model_id} not found in OpenRouter API, marking as deprecated")
+            metadata.status = "deprecated"
+            metadata.last_updated = datetime.now().strftime("%Y-%m-%d")
+            self._mark_dirty(model_id)
+    
+    def _snapshot_of(self, combined_models: Dict[str, CombinedModelInfo], version: int) -> CatalogSnapshot:
+        # 待处理集合与版本号在融合之后读取：融合过程中登记的元数据修改已包含在本快照中
+        self._pending_ids.clear()
+        self._full_rebuild = False
+        return CatalogSnapshot(
+            version=version,
+            key=(self._api_version, self._metadata_version),
+            models=MappingProxyType(combined_models),
+            active_ids=frozenset(model_id for model_id, model in combined_models.items()
+                                 if model.status != "deprecated")
+        )
+    
+    def _build_snapshot(self, version: int) -> CatalogSnapshot:
+        """整体融合API缓存与本地元数据：登记新发现的模型，将API中已不存在的模型标记为下线"""
         combined_models = {}
         
+        if not self._api_index:
+            # 尚无API数据，只用本地元数据构建基础模型列表（不据此标记下线）
+            logger.warning("API cache empty, using local metadata only")
+            for model_id, metadata in self.local_metadata.items():
+                if metadata.status != "deprecated":
+                    combined_models[model_id] = self._combine(model_id, metadata)
+        
         # 处理API返回的模型
-        for api_model in api_models:
-            metadata = self.local_metadata.get(api_model.id)
-            
-            if metadata is None:
-                # 新发现的模型，创建智能默认元数据
-                metadata = ModelMetadata(
-                    suggested_use=self._generate_smart_suggestion(api_model),
-                    local_notes=f"从OpenRouter API自动发现于 {datetime.now().strftime('%Y-%m-%d')}",
-                    status="new",
-                    added_by="system"
-                )
-                self.local_metadata[api_model.id] = metadata
-                logger.info(f"New model discovered: {api_model.id} - {metadata.suggested_use}")
-            
-            # 创建融合模型信息
-            combined_model = CombinedModelInfo(
-                id=api_model.id,
-                name=api_model.name,
-                description=api_model.description,
-                pricing=api_model.pricing,
-                context_length=api_model.context_length,
-                architecture=api_model.architecture,
-                suggested_use=metadata.suggested_use,
-                local_notes=metadata.local_notes,
-                quality_rating=metadata.quality_rating,
-                cost_efficiency=metadata.cost_efficiency,
-                preferred_for=metadata.preferred_for,
-                status=metadata.status,
-                last_updated=metadata.last_updated,
-                test_results=metadata.test_results,
-                max_tokens=api_model.context_length  # 兼容旧格式
-            )
-            
-            combined_models[api_model.id] = combined_model
+        for model_id, model_data in self._api_index.items():
+            combined_models[model_id] = self._merge(model_data)
         
         # 检查本地元数据中是否有API中不存在的模型（可能已下线）
-        for model_id, metadata in self.local_metadata.items():
-            if model_id not in combined_models and metadata.status != "deprecated":
-                logger.warning(f"Model {model_id} not found in OpenRouter API, marking as deprecated")
-                metadata.status = "deprecated"
-                metadata.last_updated = datetime.now().strftime("%Y-%m-%d")
+        if self._api_index:
+            for model_id in list(self.local_metadata):
+                if model_id not in combined_models:
+                    self._deprecate_if_missing(model_id)
         
-        # 保存更新的元数据
-        self._save_local_metadata()
+        logger.info(f"Combined {len(combined_models)} models with metadata (catalog v{version})")
+        return self._snapshot_of(combined_models, version)
+    
+    def _update_snapshot(self, catalog: CatalogSnapshot, version: int) -> CatalogSnapshot:
+        """只重新融合有变化的模型（API差异或元数据修改），其余条目沿用上一个快照"""
+        combined_models = dict(catalog.models)
+        pending = list(self._pending_ids)
+        for model_id in pending:
+            model_data = self._api_index.get(model_id)
+            if model_data is None:
+                combined_models.pop(model_id, None)
+                self._deprecate_if_missing(model_id)
+            else:
+                combined_models[model_id] = self._merge(model_data)
         
-        logger.info(f"Combined {len(combined_models)} models with metadata")
-        return combined_models
+        logger.info(f"Updated {len(pending)} models in catalog v{version}")
+        return self._snapshot_of(combined_models, version)
     
     def update_model_metadata(self, model_id: str, metadata: Dict[str, Any]) -> bool:
         """更新模型元数据"""
@@ -376,16 +852,16 @@ class ModelManager:
                 
                 # 更新允许的字段
                 for field in ["suggested_use", "local_notes", "quality_rating", 
-                             "cost_efficiency", "preferred_for", "status"]:
+                             "cost_efficiency", "preferred_for", "status", "bulkhead"]:
                     if field in metadata:
                         setattr(current_metadata, field, metadata[field])
                 
                 current_metadata.last_updated = datetime.now().strftime("%Y-%m-%d")
                 
-                # 保存到文件
-                if self._save_local_metadata():
-                    logger.info(f"Updated metadata for model: {model_id}")
-                    return True
+                # 合并写盘
+                self._mark_dirty(model_id)
+                logger.info(f"Updated metadata for model: {model_id}")
+                return True
             else:
                 logger.error(f"Model {model_id} not found in local metadata")
                 return False
@@ -394,88 +870,16 @@ class ModelManager:
             logger.error(f"Failed to update metadata for {model_id}: {e}")
             return False
     
+    def get_bulkhead_config(self, model_id: str) -> Optional[Dict[str, Any]]:
+        """获取模型的舱壁配置（未配置时返回 None）"""
+        metadata = self.local_metadata.get(model_id)
+        return metadata.bulkhead if metadata and metadata.bulkhead else None
+    
     def get_supported_models_legacy_format(self) -> Dict[str, Dict[str, Any]]:
-        """获取旧版格式的模型列表，用于向后兼容"""
-        import asyncio
-        
-        # 如果在异步上下文中，直接获取；否则创建新的事件循环
-        try:
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                # 在已有事件循环中，需要创建任务
-                future = asyncio.create_task(self.get_all_models())
-                # 这里我们使用缓存数据，避免在同步函数中等待异步操作
-                combined_models = self._get_models_from_cache()
-            else:
-                combined_models = loop.run_until_complete(self.get_all_models())
-        except RuntimeError:
-            # 没有事件循环，创建新的
-            combined_models = asyncio.run(self.get_all_models())
-        
-        # 转换为旧版格式
-        legacy_models = {}
-        for model_id, model_info in combined_models.items():
-            if model_info.status != "deprecated":  # 过滤掉已下线的模型
-                legacy_models[model_id] = model_info.to_legacy_format()
-        
-        return legacy_models
-    
-    def _get_models_from_cache(self) -> Dict[str, CombinedModelInfo]:
-        """从缓存获取模型（同步版本）"""
-        if not self._is_cache_valid():
-            # 缓存无效，返回基于本地元数据的基础模型列表
-            logger.warning("API cache invalid, using local metadata only")
-            combined_models = {}
-            
-            for model_id, metadata in self.local_metadata.items():
-                if metadata.status != "deprecated":
-                    combined_model = CombinedModelInfo(
-                        id=model_id,
-                        name=model_id.split("/")[-1] if "/" in model_id else model_id,
-                        description="缓存数据不可用，显示基础信息",
-                        pricing={},
-                        context_length=0,
-                        architecture={},
-                        suggested_use=metadata.suggested_use,
-                        local_notes=metadata.local_notes,
-                        quality_rating=metadata.quality_rating,
-                        cost_efficiency=metadata.cost_efficiency,
-                        preferred_for=metadata.preferred_for,
-                        status=metadata.status,
-                        last_updated=metadata.last_updated,
-                        test_results=metadata.test_results
-                    )
-                    combined_models[model_id] = combined_model
-            
-            return combined_models
-        
-        # 使用缓存数据
-        api_models = [OpenRouterModel(**model_data) for model_data in self.api_cache.get("models", [])]
-        combined_models = {}
-        
-        for api_model in api_models:
-            metadata = self.local_metadata.get(api_model.id)
-            if metadata and metadata.status != "deprecated":
-                combined_model = CombinedModelInfo(
-                    id=api_model.id,
-                    name=api_model.name,
-                    description=api_model.description,
-                    pricing=api_model.pricing,
-                    context_length=api_model.context_length,
-                    architecture=api_model.architecture,
-                    suggested_use=metadata.suggested_use,
-                    local_notes=metadata.local_notes,
-                    quality_rating=metadata.quality_rating,
-                    cost_efficiency=metadata.cost_efficiency,
-                    preferred_for=metadata.preferred_for,
-                    status=metadata.status,
-                    last_updated=metadata.last_updated,
-                    test_results=metadata.test_results,
-                    max_tokens=api_model.context_length
-                )
-                combined_models[api_model.id] = combined_model
-        
-        return combined_models
+        """获取旧版格式的模型列表，用于向后兼容（使用当前快照，不触发API同步）"""
+        catalog = self.get_snapshot()
+        return {model_id: catalog.models[model_id].to_legacy_format()
+                for model_id in catalog.models if catalog.is_active(model_id)}
     
     def get_sync_status(self) -> Dict[str, Any]:
         """获取同步状态信息"""
@@ -493,7 +897,25 @@ class ModelManager:
             "new_models": new_models,
             "verified_models": verified_models,
             "deprecated_models": deprecated_models,
-            "api_models_cached": len(self.api_cache.get("models", []))
+            "api_models_cached": len(self.api_cache.get("models", [])),
+            "catalog_version": self._catalog.version if self._catalog else 0,
+            "conditional_sync": {
+                "etag": self.api_cache.get("etag") or None,
+                "last_modified": self.api_cache.get("last_modified") or None,
+                "content_hash": (self.api_cache.get("content_hash") or "")[:16] or None,
+            },
+            "last_diff": self.last_diff,
+            "staleness_seconds": round(max(0.0, cache_age - self.cache_ttl), 1) if self.api_cache.get("timestamp") else None,
+            "refresh": {
+                **self.refresh_stats,
+                "in_progress": bool(self._refresh_flight.in_flight
+                                    or (self._refresh_task is not None and not self._refresh_task.done())),
+                "refresh_ahead": self.refresh_ahead,
+                "single_flight": self._refresh_flight.get_stats(),
+                "wait": {key: round(value, 3) if isinstance(value, float) else value
+                         for key, value in self.refresh_wait_stats.items()},
+            },
+            "metadata_persistence": {"pending_changes": len(self._dirty), **self.persistence_stats}
         }
 
 # 全局实例
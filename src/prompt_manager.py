@@ -24,6 +24,8 @@ class PromptTemplate:
     user_prompt_template: str
     priority_keywords: List[str] = field(default_factory=list)
     question_types: List[str] = field(default_factory=list)
+    # 主模型暂时不可用时按顺序尝试的备用模型
+    fallback_models: List[str] = field(default_factory=list)
     
     def __post_init__(self):
         """验证模板数据的有效性"""
@@ -76,6 +78,7 @@ class CustomPromptTemplate(BaseModel):
     user_prompt_template: str = Field(..., min_length=10, description="用户提示词模板")
     priority_keywords: List[str] = Field(default_factory=list, description="优先关键词")
     question_types: List[str] = Field(default_factory=list, description="问题类型")
+    fallback_models: List[str] = Field(default_factory=list, max_length=5, description="备用模型（按顺序尝试）")
     
     @validator('user_prompt_template')
     def validate_user_prompt_template(cls, v):
@@ -92,7 +95,8 @@ class CustomPromptTemplate(BaseModel):
             system_prompt=self.system_prompt,
             user_prompt_template=self.user_prompt_template,
             priority_keywords=self.priority_keywords,
-            question_types=self.question_types
+            question_types=self.question_types,
+            fallback_models=self.fallback_models
         )
 
 
@@ -177,7 +181,8 @@ A: <精准、完整、简明扼要的答案>
                 'name': template.name,
                 'description': template.description,
                 'max_cards': template.max_cards,
-                'question_types': template.question_types
+                'question_types': template.question_types,
+                'fallback_models': template.fallback_models
             }
             for template_id, template in self.templates.items()
         }
@@ -233,6 +238,9 @@ A: <精准、完整、简明扼要的答案>
             if 'question_types' in kwargs:
                 template.question_types = kwargs['question_types']
             
+            if 'fallback_models' in kwargs:
+                template.fallback_models = kwargs['fallback_models']
+            
             logger.info(f"Updated template {template_id}")
             return True
             
@@ -258,7 +266,8 @@ A: <精准、完整、简明扼要的答案>
                     'system_prompt': template.system_prompt,
                     'user_prompt_template': template.user_prompt_template,
                     'priority_keywords': template.priority_keywords,
-                    'question_types': template.question_types
+                    'question_types': template.question_types,
+                    'fallback_models': template.fallback_models
                 }
             
             with open(save_path, 'w', encoding='utf-8') as f:
@@ -0,0 +1,287 @@
+"""
+AI Flashcard Generator - 令牌桶限流
+按客户端IP与API Key指纹分别限流，生成类请求（发往生成接口的写请求）与其他请求使用不同额度；
+被拒绝的请求返回429，并带 Retry-After 与 X-RateLimit-* 响应头
+"""
+
+import hashlib
+import ipaddress
+import json
+import logging
+import math
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from config.app_config import app_config
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 从JSON请求体中提取API Key（避免为限流完整解析可能很大的文档请求体）
+API_KEY_PATTERN = re.compile(rb'"api_key"\s*:\s*"([^"\\]{1,512})"')
+
+READ_METHODS = frozenset({"GET", "HEAD"})
+
+
+class TokenBucketLimiter:
+    """一组按键隔离的令牌桶
+
+    桶容量为 capacity，每秒补充 refill_rate 个令牌。桶按最近访问顺序保存在 OrderedDict 中，
+    查找与更新均为 O(1)；已回满的空闲桶与新建桶等价，会从最久未访问的一端淘汰，
+    键数量超过 max_keys 时强制淘汰，内存有上限。
+    """
+
+    def __init__(self, capacity: float, refill_rate: float, max_keys: int):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.max_keys = max_keys
+        # 空闲这么久的桶一定已回满
+        self.idle_after = capacity / refill_rate
+        # 键 -> [剩余令牌, 上次更新时间]
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.stats = {"allowed": 0, "rejected": 0, "evicted": 0}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def acquire(self, key: str, now: Optional[float] = None, cost: float = 1.0) -> Tuple[bool, float, float]:
+        """尝试取出 cost 个令牌，返回 (是否允许, 剩余令牌, 需等待秒数)"""
+        return self.acquire_all((key,), now, cost)
+
+    def acquire_all(self, keys: Tuple[str, ...], now: Optional[float] = None,
+                    cost: float = 1.0) -> Tuple[bool, float, float]:
+        """所有键的桶都有余量时才一并扣减，被拒绝的请求不消耗任何桶的令牌
+
+        返回 (是否允许, 最少的剩余令牌, 需等待秒数)。
+        """
+        now = time.monotonic() if now is None else now
+        buckets = []
+        for key in keys:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.capacity, now]
+                self._evict(now)
+            else:
+                bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.refill_rate)
+                self._buckets.move_to_end(key)
+            bucket[1] = now
+            buckets.append(bucket)
+
+        tokens = min(bucket[0] for bucket in buckets)
+        allowed = tokens >= cost
+        if allowed:
+            for bucket in buckets:
+                bucket[0] -= cost
+            tokens -= cost
+            self.stats["allowed"] += 1
+        else:
+            self.stats["rejected"] += 1
+        wait = 0.0 if allowed else (cost - tokens) / self.refill_rate
+        return allowed, tokens, wait
+
+    def seconds_until_full(self, tokens: float) -> float:
+        return (self.capacity - tokens) / self.refill_rate
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            _, (tokens, updated) = next(iter(buckets.items()))
+            if len(buckets) <= self.max_keys and now - updated < self.idle_after:
+                break
+            buckets.popitem(last=False)
+            self.stats["evicted"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "keys": len(self._buckets),
+            "capacity": self.capacity,
+            "refill_per_second": round(self.refill_rate, 4),
+        }
+
+
+def api_key_fingerprint(api_key: str) -> str:
+    """API Key的指纹（不在内存中保存明文Key）"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class RateLimiter:
+    """生成类与查询类请求的限流器（按进程计数，多worker时每个worker各自限流）
+
+    - 生成类（发往 generation_paths 下接口的非GET/HEAD请求）：每个IP、每个API Key指纹各有一个桶，两者都需有余量
+    - 其他请求（查询、模板与管理接口的写请求等）：每个IP一个桶
+    - 客户端IP：仅当直连对端属于 trusted_proxies 时才采用 X-Real-IP，或 X-Forwarded-For 中最右侧的非可信地址
+    """
+
+    def __init__(self,
+                 enabled: Optional[bool] = None,
+                 generation_requests: Optional[int] = None,
+                 read_requests: Optional[int] = None,
+                 window: Optional[float] = None,
+                 max_keys: Optional[int] = None,
+                 trust_proxy: Optional[bool] = None,
+                 trusted_proxies: Optional[List[str]] = None,
+                 exempt_paths: Optional[FrozenSet[str]] = None,
+                 generation_paths: Optional[List[str]] = None):
+        self.enabled = enabled if enabled is not None else app_config.rate_limit_enabled
+        generation_requests = generation_requests if generation_requests is not None else app_config.rate_limit_requests
+        read_requests = read_requests if read_requests is not None else app_config.rate_limit_read_requests
+        window = window if window is not None else app_config.rate_limit_window
+        max_keys = max_keys if max_keys is not None else app_config.rate_limit_max_keys
+        self.trust_proxy = trust_proxy if trust_proxy is not None else app_config.rate_limit_trust_proxy
+        trusted_proxies = trusted_proxies if trusted_proxies is not None else app_config.rate_limit_trusted_proxies
+        self.trusted_proxies = [ipaddress.ip_network(network, strict=False) for network in trusted_proxies]
+        self.exempt_paths = exempt_paths if exempt_paths is not None else app_config.rate_limit_exempt_paths
+        generation_paths = generation_paths if generation_paths is not None else app_config.rate_limit_generation_paths
+        self.generation_paths = tuple(path.rstrip("/") for path in generation_paths)
+
+        self.generation = TokenBucketLimiter(generation_requests, generation_requests / window, max_keys)
+        self.read = TokenBucketLimiter(read_requests, read_requests / window, max_keys)
+
+    def is_generation(self, method: str, path: str) -> bool:
+        """是否为生成类请求：发往生成接口（路径本身或其子路径）的写请求"""
+        if method in READ_METHODS:
+            return False
+        return any(path == prefix or path.startswith(prefix + "/") for prefix in self.generation_paths)
+
+    def is_trusted_proxy(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+    def client_ip(self, scope: Dict[str, Any]) -> str:
+        """客户端IP：X-Forwarded-For 的左侧部分由客户端任意填写，只采用可信代理追加的地址"""
+        client = scope.get("client")
+        peer = client[0] if client else "unknown"
+        if not self.trust_proxy or not self.is_trusted_proxy(peer):
+            return peer
+
+        real_ip = _header(scope, b"x-real-ip")
+        if real_ip and real_ip.strip():
+            return real_ip.strip()
+        forwarded = _header(scope, b"x-forwarded-for")
+        if forwarded:
+            # 从右向左跳过可信代理，第一个非可信地址即由最外层可信代理看到的对端
+            hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+            for hop in reversed(hops):
+                if not self.is_trusted_proxy(hop):
+                    return hop
+            if hops:
+                return hops[0]
+        return peer
+
+    def check(self, generation: bool, client_ip: str,
+              api_key: Optional[str] = None) -> Tuple[bool, Dict[str, str]]:
+        """扣减对应的桶，返回 (是否允许, 响应头)；多个桶时按最紧张的一个报告
+
+        IP桶与API Key桶都有余量时才一并扣减，被拒绝的请求不消耗任何一个桶。
+        """
+        limiter = self.generation if generation else self.read
+        keys = (f"ip:{client_ip}",)
+        if api_key:
+            keys += (f"key:{api_key_fingerprint(api_key)}",)
+        allowed, remaining, wait = limiter.acquire_all(keys)
+
+        headers = {
+            "X-RateLimit-Limit": str(int(limiter.capacity)),
+            "X-RateLimit-Remaining": str(max(0, int(remaining))),
+            "X-RateLimit-Reset": str(math.ceil(limiter.seconds_until_full(remaining))),
+        }
+        if not allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(wait)))
+        return allowed, headers
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "generation": self.generation.get_stats(),
+            "read": self.read.get_stats(),
+        }
+
+
+def _header(scope: Dict[str, Any], name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class RateLimitMiddleware:
+    """纯ASGI限流中间件（不经过 BaseHTTPMiddleware，开销只有桶查找与少量头部处理）
+
+    生成类请求的API Key与应用实际使用的一致，从JSON请求体的 api_key 字段提取（请求头可由客户端任意轮换，不作为依据）；
+    读取过的请求体会原样交还给应用。
+    """
+
+    def __init__(self, app, limiter: Optional["RateLimiter"] = None):
+        self.app = app
+        self.limiter = limiter or rate_limiter
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.limiter
+        if (scope["type"] != "http" or not limiter.enabled
+                or scope["method"] == "OPTIONS" or scope["path"] in limiter.exempt_paths):
+            await self.app(scope, receive, send)
+            return
+
+        generation = limiter.is_generation(scope["method"], scope["path"])
+        api_key = None
+        if generation and "json" in (_header(scope, b"content-type") or ""):
+            receive, api_key = await self._body_api_key(receive)
+
+        allowed, headers = limiter.check(generation, limiter.client_ip(scope), api_key)
+        raw_headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+
+        if not allowed:
+            body = json.dumps({"detail": {
+                "success": False,
+                "error_code": "RATE_LIMITED",
+                "message": "请求过于频繁，请等待一段时间再试。"
+            }}, ensure_ascii=False).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode("latin-1"))] + raw_headers
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", ())) + raw_headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    @staticmethod
+    async def _body_api_key(receive):
+        """读取完整请求体并提取api_key，返回可重放请求体的 receive 与 api_key"""
+        messages = []
+        chunks = []
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+
+        match = API_KEY_PATTERN.search(b"".join(chunks))
+
+        async def replay():
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        return replay, match.group(1).decode("utf-8", "replace") if match else None
+
+
+# 全局实例
+rate_limiter = RateLimiter()
@@ -0,0 +1,451 @@
+"""
+AI Flashcard Generator - 响应缓存
+有界的内存LRU/TTL缓存：条目数与近似字节数双重预算、过期清扫、命中统计，
+缓存键为完整请求身份的SHA-256，跨进程确定且不受 hash() 随机盐影响；
+可选的SQLite持久化二级缓存，在重启/部署后保留已生成的结果；
+共享模式下同一主机上的多个worker进程共用同一个WAL数据库（默认位于 /dev/shm），
+命中率不随worker数下降
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from config.app_config import app_config
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 每个条目的固定开销估算（键、OrderedDict节点、元组等）
+ENTRY_OVERHEAD_BYTES = 256
+
+# 多worker共享缓存的默认文件名
+SHARED_CACHE_FILENAME = "flashcard-response-cache.db"
+
+
+def make_request_key(model_name: str, system_prompt: str, user_prompt: str,
+                     params: Optional[Dict[str, Any]] = None) -> str:
+    """基于完整请求身份（模型、渲染后的提示词、模板参数）生成确定性的SHA-256键"""
+    identity = {
+        "model": model_name,
+        "system_prompt": system_prompt,
+        "user_prompt": user_prompt,
+        "params": params or {},
+    }
+    canonical = json.dumps(identity, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _json_default(value: Any) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    return str(value)
+
+
+def estimate_size(value: Any) -> int:
+    """以JSON序列化长度近似估算条目占用的字节数"""
+    try:
+        payload = json.dumps(value, ensure_ascii=False, default=_json_default)
+        return len(payload.encode("utf-8")) + ENTRY_OVERHEAD_BYTES
+    except (TypeError, ValueError):
+        return ENTRY_OVERHEAD_BYTES
+
+
+class DiskCacheTier:
+    """SQLite（WAL模式）持久化缓存层
+
+    所有数据库操作都在线程池中执行，不阻塞事件循环；每个线程持有自己的连接。
+    条目以JSON保存，带TTL；compact() 清除过期条目，并在超出容量上限时按最久未访问淘汰，
+    随后回收WAL与空闲页。
+    同一数据库文件可被同主机上的多个worker进程同时打开，作为跨进程共享缓存。
+    """
+
+    # 压缩时淘汰到容量上限的该比例以下，避免每次写入都触发淘汰
+    COMPACT_TARGET_RATIO = 0.9
+
+    def __init__(self,
+                 path: str,
+                 max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None,
+                 max_workers: int = 4):
+        self.path = path
+        self.max_bytes = max_bytes if max_bytes is not None else app_config.response_cache_disk_max_bytes
+        self.ttl = ttl if ttl is not None else app_config.response_cache_disk_ttl
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="disk-cache")
+        self._local = threading.local()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "errors": 0,
+        }
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        try:
+            # auto_vacuum 必须在建表前设置才会生效
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache(expires_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_access ON response_cache(last_access)")
+        finally:
+            conn.close()
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _get_sync(self, key: str) -> Tuple[Optional[str], bool]:
+        """返回 (条目内容, 是否已过期)；统计由事件循环一侧更新，线程池中不修改 stats"""
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None, False
+        if row[1] <= now:
+            conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            return None, True
+        conn.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+        return row[0], False
+
+    def _delete_sync(self, key: str):
+        self._connect().execute("DELETE FROM response_cache WHERE key = ?", (key,))
+
+    def _set_sync(self, key: str, payload: str, ttl: float):
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, value, size, expires_at, last_access) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, payload, len(payload.encode("utf-8")), now + ttl, now)
+        )
+
+    def _compact_sync(self) -> Dict[str, int]:
+        conn = self._connect()
+        # BEGIN IMMEDIATE 取得写锁，多个worker同时压缩时串行执行，避免重复淘汰
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+
+            evicted = 0
+            if total > self.max_bytes:
+                target = int(self.max_bytes * self.COMPACT_TARGET_RATIO)
+                rows = conn.execute("SELECT key, size FROM response_cache ORDER BY last_access").fetchall()
+                victims = []
+                for key, size in rows:
+                    if total <= target:
+                        break
+                    victims.append((key,))
+                    total -= size
+                conn.executemany("DELETE FROM response_cache WHERE key = ?", victims)
+                evicted = len(victims)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        if expired or evicted:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("PRAGMA incremental_vacuum")
+        return {"expired": expired, "evicted": evicted, "bytes": total}
+
+    def _size_sync(self) -> Dict[str, int]:
+        conn = self._connect()
+        entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache").fetchone()
+        return {"entries": entries, "bytes": total}
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            payload, expired = await self._run(self._get_sync, key)
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            logger.error(f"Disk cache read failed: {e}")
+            return None
+
+        if expired:
+            self.stats["expirations"] += 1
+        if payload is None:
+            self.stats["misses"] += 1
+            return None
+        try:
+            value = json.loads(payload)
+        except ValueError as e:
+            # 损坏的条目（如写入被截断）按未命中处理并删除，避免每次都读到同一条坏数据
+            self.stats["errors"] += 1
+            logger.error(f"Disk cache entry is corrupt, dropping it: {e}")
+            try:
+                await self._run(self._delete_sync, key)
+            except sqlite3.Error as e:
+                logger.error(f"Disk cache delete failed: {e}")
+            return None
+        self.stats["hits"] += 1
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        payload = json.dumps(value, ensure_ascii=False, default=_json_default)
+        try:
+            await self._run(self._set_sync, key, payload, ttl if ttl is not None else self.ttl)
+            self.stats["writes"] += 1
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            logger.error(f"Disk cache write failed: {e}")
+
+    async def compact(self) -> Dict[str, int]:
+        """清除过期条目并把占用压缩到容量上限以内"""
+        try:
+            result = await self._run(self._compact_sync)
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            logger.error(f"Disk cache compaction failed: {e}")
+            return {"expired": 0, "evicted": 0}
+
+        self.stats["expirations"] += result["expired"]
+        self.stats["evictions"] += result["evicted"]
+        if result["expired"] or result["evicted"]:
+            logger.info(f"Disk cache compacted: {result['expired']} expired, {result['evicted']} evicted")
+        return result
+
+    async def size(self) -> Dict[str, int]:
+        return await self._run(self._size_sync)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": self.stats["hits"] / lookups if lookups else 0,
+            "path": self.path,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+        }
+
+
+class ResponseCache:
+    """内存LRU/TTL响应缓存（可选挂载持久化二级缓存）
+
+    同步的 get/set 只访问内存；异步的 lookup/store 会在内存未命中时查询二级缓存
+    并回填内存，写入时同时写入两层。
+    """
+
+    def __init__(self,
+                 max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None,
+                 persistent: Optional[DiskCacheTier] = None):
+        self.max_entries = max_entries if max_entries is not None else app_config.response_cache_max_entries
+        self.max_bytes = max_bytes if max_bytes is not None else app_config.response_cache_max_bytes
+        self.ttl = ttl if ttl is not None else app_config.response_cache_ttl
+        self.persistent = persistent
+
+        # key -> (value, size_bytes, expires_at)，按最近使用顺序排列（末尾最新）
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._sweeper: Optional[asyncio.Task] = None
+
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[2] > time.time()
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取未过期的条目并标记为最近使用"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        value, _, expires_at = entry
+        if expires_at <= time.time():
+            self._remove(key)
+            self.stats["expirations"] += 1
+            self.stats["misses"] += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return value
+
+    def set(self, key: str, value: Any, size_bytes: Optional[int] = None, ttl: Optional[float] = None):
+        """写入条目，超出条目数或字节预算时按LRU淘汰"""
+        size_bytes = size_bytes if size_bytes is not None else estimate_size(value)
+        if size_bytes > self.max_bytes:
+            logger.warning(f"Response too large to cache ({size_bytes} bytes), skipping")
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        expires_at = time.time() + (ttl if ttl is not None else self.ttl)
+        self._entries[key] = (value, size_bytes, expires_at)
+        self._bytes += size_bytes
+        self._evict()
+
+    async def lookup(self, key: str) -> Optional[Any]:
+        """依次查询内存与持久化缓存，二级命中时回填内存"""
+        value = self.get(key)
+        if value is not None or self.persistent is None:
+            return value
+
+        value = await self.persistent.get(key)
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    async def store(self, key: str, value: Any, size_bytes: Optional[int] = None):
+        """写入内存，并写穿到持久化缓存"""
+        self.set(key, value, size_bytes=size_bytes)
+        if self.persistent is not None:
+            await self.persistent.set(key, value)
+
+    def delete(self, key: str) -> bool:
+        if key in self._entries:
+            self._remove(key)
+            return True
+        return False
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def _remove(self, key: str):
+        _, size_bytes, _ = self._entries.pop(key)
+        self._bytes -= size_bytes
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.stats["evictions"] += 1
+
+    def sweep(self) -> int:
+        """清除所有已过期条目，返回清除数量"""
+        now = time.time()
+        expired = [key for key, (_, _, expires_at) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            self._remove(key)
+        self.stats["expirations"] += len(expired)
+        if expired:
+            logger.info(f"Swept {len(expired)} expired cache entries")
+        return len(expired)
+
+    async def _sweep_loop(self, interval: float):
+        compact_interval = app_config.response_cache_compact_interval
+        last_compact = time.time()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sweep()
+                if self.persistent is not None and time.time() - last_compact >= compact_interval:
+                    await self.persistent.compact()
+                    last_compact = time.time()
+            except Exception as e:
+                logger.error(f"Cache sweep failed: {e}")
+
+    def start_sweeper(self, interval: Optional[float] = None):
+        """启动后台过期清扫任务（在应用生命周期内运行）"""
+        if self._sweeper is None or self._sweeper.done():
+            interval = interval if interval is not None else app_config.response_cache_sweep_interval
+            self._sweeper = asyncio.create_task(self._sweep_loop(interval))
+
+    async def stop_sweeper(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": self.stats["hits"] / lookups if lookups else 0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "persistent": self.persistent.get_stats() if self.persistent is not None else None,
+        }
+
+
+def default_shared_cache_path() -> str:
+    """多worker共享缓存的默认位置：优先 /dev/shm（tmpfs共享内存），否则系统临时目录"""
+    shm = "/dev/shm"
+    base = shm if os.path.isdir(shm) and os.access(shm, os.W_OK) else tempfile.gettempdir()
+    return os.path.join(base, SHARED_CACHE_FILENAME)
+
+
+def _create_persistent_tier() -> Optional[DiskCacheTier]:
+    """按配置创建持久化缓存层
+
+    RESPONSE_CACHE_DISK_PATH 指定数据库位置；未指定但开启 RESPONSE_CACHE_SHARED 时
+    使用共享内存中的默认位置；两者都未配置时禁用。
+    """
+    path = app_config.response_cache_disk_path
+    if not path and app_config.response_cache_shared:
+        path = default_shared_cache_path()
+    if not path:
+        return None
+    try:
+        tier = DiskCacheTier(path)
+        logger.info(f"Persistent response cache enabled at {path} (pid {os.getpid()})")
+        return tier
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Failed to open persistent response cache at {path}, continuing without it: {e}")
+        return None
+
+
+# 全局实例
+response_cache = ResponseCache(persistent=_create_persistent_tier())
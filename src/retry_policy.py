@@ -0,0 +1,123 @@
+"""
+AI Flashcard Generator - 上游重试策略
+对可重试的上游错误（429/502/503/504、未发出请求的连接错误）按指数退避+完全抖动重试，
+优先遵循 Retry-After，并在单次请求的总时间预算内结束
+"""
+
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, FrozenSet, Optional, TypeVar
+
+import httpx
+
+from config.app_config import app_config
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 请求未被上游处理、重发不会产生重复生成的连接类错误
+# （ReadTimeout等发生在请求已送达之后，重发可能重复计费，不重试）
+SAFE_TRANSPORT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（秒数或HTTP日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """指数退避 + 完全抖动（full jitter）的重试策略
+
+    第n次重试前等待 uniform(0, min(max_delay, base_delay * 2**n)) 秒；若上游返回 Retry-After 则按其等待。
+    所有尝试与等待都必须落在 budget 秒的总预算内，超出预算时直接抛出最后一次的错误。
+    """
+
+    def __init__(self,
+                 max_attempts: Optional[int] = None,
+                 base_delay: Optional[float] = None,
+                 max_delay: Optional[float] = None,
+                 budget: Optional[float] = None,
+                 retry_statuses: Optional[FrozenSet[int]] = None):
+        self.max_attempts = max_attempts if max_attempts is not None else app_config.upstream_retry_max_attempts
+        self.base_delay = base_delay if base_delay is not None else app_config.upstream_retry_base_delay
+        self.max_delay = max_delay if max_delay is not None else app_config.upstream_retry_max_delay
+        self.budget = budget if budget is not None else app_config.upstream_retry_budget
+        self.retry_statuses = retry_statuses if retry_statuses is not None else app_config.upstream_retry_statuses
+
+    def is_retryable(self, error: BaseException) -> bool:
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in self.retry_statuses
+        return isinstance(error, SAFE_TRANSPORT_ERRORS)
+
+    def backoff(self, retry_number: int) -> float:
+        """第 retry_number 次重试（从0开始）的抖动退避时间"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry_number)))
+
+    def delay_for(self, error: BaseException, retry_number: int) -> float:
+        if isinstance(error, httpx.HTTPStatusError):
+            retry_after = parse_retry_after(error.response.headers.get("retry-after"))
+            if retry_after is not None:
+                return retry_after
+        return self.backoff(retry_number)
+
+    async def run(self,
+                  attempt: Callable[[float], Awaitable[T]],
+                  on_retry: Optional[Callable[[int, BaseException, float], None]] = None,
+                  budget: Optional[float] = None) -> T:
+        """执行 attempt(剩余预算秒数)，遇到可重试错误时按策略重试
+
+        on_retry(重试序号, 错误, 等待秒数) 在每次重试前调用，用于记录指标。
+        budget 为调用方剩余的时间预算（如已在公平队列中等待过），不超过策略本身的预算。
+        """
+        deadline = time.monotonic() + (self.budget if budget is None else min(self.budget, budget))
+        retry_number = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                return await attempt(remaining)
+            except Exception as error:
+                if not self.is_retryable(error) or retry_number + 1 >= self.max_attempts:
+                    raise
+                delay = self.delay_for(error, retry_number)
+                if time.monotonic() + delay >= deadline:
+                    logger.warning(f"Retry budget exhausted, not retrying after {delay:.2f}s wait: {error}")
+                    raise
+                if on_retry is not None:
+                    on_retry(retry_number, error, delay)
+                logger.info(f"Retrying upstream call in {delay:.2f}s (retry {retry_number + 1}): {error}")
+                await asyncio.sleep(delay)
+                if time.monotonic() >= deadline:
+                    # 等待期间预算已耗尽（如事件循环繁忙），不在截止时间之后发起新的尝试
+                    raise
+                retry_number += 1
+
+
+def retry_reason(error: BaseException) -> str:
+    """用于指标统计的重试原因（状态码或错误类型）"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return str(error.response.status_code)
+    return type(error).__name__
+
+
+# 全局实例
+upstream_retry = RetryPolicy()
@@ -0,0 +1,104 @@
+"""
+AI Flashcard Generator - 在途请求合并（single-flight）
+相同身份的并发请求只向上游发起一次调用，其余请求等待同一个结果
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """一次在途调用及其等待者计数"""
+
+    def __init__(self, task: asyncio.Task, detach: bool = False):
+        self.task = task
+        self.waiters = 0
+        self.detach = detach
+
+
+class SingleFlight:
+    """按键合并并发调用
+
+    - 第一个到达的请求（leader）把上游调用放入独立的 asyncio.Task；同键的后续请求
+      （follower）直接等待该任务，不再发起新调用。
+    - 结果与异常都会传播给所有等待者。share_error 返回 False 的异常（例如与调用方
+      自身凭据相关的错误）不共享：follower 会改为用自己的 fn 单独重试一次。
+    - 取消语义：等待者被取消只会影响它自己（通过 asyncio.shield 隔离）；只有当所有
+      等待者都已取消时，底层上游任务才会被取消，避免为无人读取的结果继续付费。
+      leader 传入 detach=True 时（例如结果仍需写入缓存），无人等待的任务会继续执行到完成。
+    - 调用完成后立即从在途表移除，之后的请求由响应缓存负责命中。
+    """
+
+    def __init__(self, name: str = "default"):
+        self.name = name
+        self._flights: Dict[str, _Flight] = {}
+        self.stats = {
+            "leaders": 0,
+            "coalesced": 0,
+            "cancelled": 0,
+            "detached": 0,
+        }
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def do(self,
+                 key: str,
+                 fn: Callable[[], Awaitable[Any]],
+                 share_error: Optional[Callable[[BaseException], bool]] = None,
+                 detach: bool = False) -> Tuple[Any, bool]:
+        """执行或加入键为 key 的调用，返回 (结果, 是否为合并的follower)"""
+        flight = self._flights.get(key)
+        shared = flight is not None
+
+        if flight is None:
+            task = asyncio.create_task(fn())
+            flight = _Flight(task, detach)
+            self._flights[key] = flight
+            task.add_done_callback(lambda _t, k=key, f=flight: self._forget(k, f))
+            self.stats["leaders"] += 1
+        else:
+            self.stats["coalesced"] += 1
+            logger.info(f"Coalesced in-flight request ({self.name}) for key: {key[:8]}...")
+
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if not flight.task.done():
+                self._release(flight)
+            raise
+        except Exception as e:
+            flight.waiters -= 1
+            if shared and share_error is not None and not share_error(e):
+                return await fn(), False
+            raise
+
+        flight.waiters -= 1
+        return result, shared
+
+    def _release(self, flight: _Flight):
+        """等待者取消时递减计数，最后一个等待者离开时取消上游任务"""
+        flight.waiters -= 1
+        if flight.waiters <= 0:
+            if flight.detach:
+                self.stats["detached"] += 1
+                return
+            flight.task.cancel()
+            self.stats["cancelled"] += 1
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # 取出异常，避免无人等待时出现 "exception was never retrieved" 警告
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "in_flight": self.in_flight}
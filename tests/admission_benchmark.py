@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+AI Flashcard Generator 过载保护基准测试
+以超过上游处理能力的速率持续发送生成请求，客户端（nginx）超时后放弃等待；
+对比有/无准入控制时的有效吞吐（在超时前完成的请求数）与浪费的上游调用数
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from admission import AdmissionController, LoopLagMonitor  # noqa: E402
+from fair_scheduler import FairScheduler  # noqa: E402
+
+
+async def simulate(admission: bool, capacity: int, rate: float, duration: float,
+                   upstream_latency: float, client_timeout: float, max_queue_depth: int) -> Dict[str, Any]:
+    scheduler = FairScheduler(enabled=True, capacity=capacity, weights={}, default_weight=1.0,
+                              max_tenants=100, reserved_shares={}, headroom=0)
+    controller = AdmissionController(enabled=admission, max_in_flight=0, max_queue_depth=max_queue_depth,
+                                     max_loop_lag=0, retry_after=1, monitor=LoopLagMonitor())
+    results = {"sent": 0, "shed": 0, "goodput": 0, "timed_out": 0, "wasted_upstream_calls": 0}
+
+    async def upstream():
+        await asyncio.sleep(upstream_latency * random.uniform(0.8, 1.2))
+
+    async def request():
+        results["sent"] += 1
+        if admission and controller.overload_reason("interactive", queue_depth=scheduler.queued):
+            results["shed"] += 1
+            return
+        start = time.monotonic()
+        await scheduler.run("client", upstream)
+        if time.monotonic() - start <= client_timeout:
+            results["goodput"] += 1
+        else:
+            # 客户端已超时放弃，上游调用的费用白白浪费
+            results["timed_out"] += 1
+            results["wasted_upstream_calls"] += 1
+
+    tasks = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        tasks.append(asyncio.create_task(request()))
+        await asyncio.sleep(random.expovariate(rate))
+    await asyncio.gather(*tasks)
+
+    results["goodput_per_second"] = results["goodput"] / duration
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="过载保护基准测试")
+    parser.add_argument("--capacity", type=int, default=8, help="上游调用名额 (默认: 8)")
+    parser.add_argument("--latency", type=float, default=0.1, help="模拟上游平均延迟/秒 (默认: 0.1)")
+    parser.add_argument("--rate", type=float, default=200, help="请求到达速率/秒 (默认: 200，约为处理能力的2.5倍)")
+    parser.add_argument("--duration", type=float, default=5, help="持续时间/秒 (默认: 5)")
+    parser.add_argument("--client-timeout", type=float, default=1.0,
+                        help="客户端超时/秒，对应nginx的proxy_read_timeout按比例缩小 (默认: 1.0)")
+    parser.add_argument("--max-queue-depth", type=int, default=40, help="准入控制的排队深度阈值 (默认: 40)")
+    parser.add_argument("--output", help="结果输出文件 (JSON)")
+    args = parser.parse_args()
+
+    options = dict(capacity=args.capacity, rate=args.rate, duration=args.duration,
+                   upstream_latency=args.latency, client_timeout=args.client_timeout,
+                   max_queue_depth=args.max_queue_depth)
+    results = {
+        "capacity_per_second": args.capacity / args.latency,
+        "no_admission": asyncio.run(simulate(False, **options)),
+        "admission": asyncio.run(simulate(True, **options)),
+    }
+
+    print("=" * 60)
+    print("过载保护基准测试")
+    print("=" * 60)
+    print(f"处理能力: {results['capacity_per_second']:.0f} 请求/秒  到达速率: {args.rate:.0f} 请求/秒  "
+          f"客户端超时: {args.client_timeout}s")
+    for name, label in (("no_admission", "无准入控制"), ("admission", "有准入控制")):
+        result = results[name]
+        print(f"{label}: 有效吞吐 {result['goodput_per_second']:.0f} 请求/秒, 超时 {result['timed_out']}, "
+              f"提前拒绝 {result['shed']}, 浪费的上游调用 {result['wasted_upstream_calls']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n详细结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+AI Flashcard Generator 持久化缓存层基准测试
+模拟重启（部署/worker回收）后的冷启动，对比有无SQLite二级缓存时的命中率
+
+流量来源：
+- --traffic 指定录制的请求日志（JSONL，每行包含 model_name/text/template_id/max_cards）
+- 未指定时生成符合Zipf分布的合成流量（可用 --save-traffic 保存以便复现）
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from response_cache import DiskCacheTier, ResponseCache, make_request_key  # noqa: E402
+
+SAMPLE_VALUE = {
+    "flashcards": [{"q": "什么是光合作用？", "a": "植物将光能转化为化学能的过程。" * 4}] * 8,
+    "processing_info": {"template_used": "general", "cards_generated": 8},
+}
+
+
+def generate_traffic(requests: int, distinct: int, skew: float, seed: int = 42) -> List[Dict[str, Any]]:
+    """生成Zipf分布的合成流量：少量热门文本占大部分请求"""
+    rng = random.Random(seed)
+    weights = [1 / (rank ** skew) for rank in range(1, distinct + 1)]
+    texts = rng.choices(range(distinct), weights=weights, k=requests)
+    return [
+        {"model_name": "google/gemini-2.5-flash-preview", "text": f"课程材料 #{i}", "template_id": "general", "max_cards": 10}
+        for i in texts
+    ]
+
+
+def load_traffic(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def request_key(entry: Dict[str, Any]) -> str:
+    return make_request_key(entry.get("model_name", ""), entry.get("template_id") or "", entry.get("text", ""),
+                            {"max_cards": entry.get("max_cards")})
+
+
+class CacheTierBenchmark:
+    def __init__(self, traffic: List[Dict[str, Any]], restart_at: float, memory_entries: int):
+        self.traffic = traffic
+        self.restart_index = int(len(traffic) * restart_at)
+        self.memory_entries = memory_entries
+
+    async def _replay(self, cache: ResponseCache, entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        hits = 0
+        latencies = []
+        for entry in entries:
+            key = request_key(entry)
+            start = time.perf_counter()
+            value = await cache.lookup(key)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if value is not None:
+                hits += 1
+            else:
+                await cache.store(key, SAMPLE_VALUE)
+        return {
+            "requests": len(entries),
+            "hits": hits,
+            "hit_ratio": hits / len(entries) if entries else 0,
+            "avg_lookup_ms": statistics.mean(latencies) if latencies else 0,
+        }
+
+    async def _run_scenario(self, with_tier: bool, db_path: str) -> Dict[str, Any]:
+        def new_cache() -> ResponseCache:
+            tier = DiskCacheTier(db_path) if with_tier else None
+            return ResponseCache(max_entries=self.memory_entries, max_bytes=256 * 1024 * 1024, ttl=3600,
+                                 persistent=tier)
+
+        before = self.traffic[:self.restart_index]
+        after = self.traffic[self.restart_index:]
+
+        # 重启前：正常处理流量，填充缓存
+        cache = new_cache()
+        warm = await self._replay(cache, before)
+        if cache.persistent:
+            cache.persistent.close()
+
+        # 重启：内存缓存清空，仅持久化层保留
+        cache = new_cache()
+        cold = await self._replay(cache, after[:len(after) // 4])
+        if cache.persistent:
+            cache.persistent.close()
+
+        return {"before_restart": warm, "after_restart_first_quarter": cold}
+
+    async def run(self) -> Dict[str, Any]:
+        with tempfile.TemporaryDirectory() as tmp:
+            memory_only = await self._run_scenario(False, os.path.join(tmp, "unused.db"))
+            with_tier = await self._run_scenario(True, os.path.join(tmp, "response_cache.db"))
+        return {
+            "requests": len(self.traffic),
+            "restart_index": self.restart_index,
+            "memory_only": memory_only,
+            "with_persistent_tier": with_tier,
+        }
+
+    def print_results(self, results: Dict[str, Any]):
+        print("=" * 60)
+        print("持久化缓存层冷启动基准测试")
+        print("=" * 60)
+        print(f"总请求数: {results['requests']}  重启位置: 第 {results['restart_index']} 个请求")
+        for label, key in (("仅内存缓存", "memory_only"), ("内存 + SQLite持久化层", "with_persistent_tier")):
+            cold = results[key]["after_restart_first_quarter"]
+            print(f"\n{label}:")
+            print(f"  重启前命中率: {results[key]['before_restart']['hit_ratio']:.1%}")
+            print(f"  重启后命中率: {cold['hit_ratio']:.1%} ({cold['hits']}/{cold['requests']})")
+            print(f"  平均查询耗时: {cold['avg_lookup_ms']:.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="持久化缓存层冷启动基准测试")
+    parser.add_argument("--traffic", help="录制的请求日志 (JSONL)")
+    parser.add_argument("--save-traffic", help="保存生成的合成流量 (JSONL)")
+    parser.add_argument("--requests", type=int, default=5000, help="合成流量请求数 (默认: 5000)")
+    parser.add_argument("--distinct", type=int, default=800, help="合成流量中不同文本数 (默认: 800)")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf分布参数 (默认: 1.1)")
+    parser.add_argument("--restart-at", type=float, default=0.5, help="重启发生在流量的比例位置 (默认: 0.5)")
+    parser.add_argument("--memory-entries", type=int, default=1000, help="内存缓存条目上限 (默认: 1000)")
+    parser.add_argument("--output", help="结果输出文件 (JSON)")
+    args = parser.parse_args()
+
+    if args.traffic:
+        traffic = load_traffic(args.traffic)
+    else:
+        traffic = generate_traffic(args.requests, args.distinct, args.skew)
+        if args.save_traffic:
+            with open(args.save_traffic, "w", encoding="utf-8") as f:
+                for entry in traffic:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    benchmark = CacheTierBenchmark(traffic, args.restart_at, args.memory_entries)
+    results = asyncio.run(benchmark.run())
+    benchmark.print_results(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n详细结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
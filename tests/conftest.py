@@ -0,0 +1,20 @@
+"""
+AI Flashcard Generator - 测试共用夹具
+"""
+
+from typing import Callable, Optional
+
+import httpx
+import pytest
+
+
+@pytest.fixture
+def status_error() -> Callable[..., httpx.HTTPStatusError]:
+    """构造上游返回指定状态码（可带 Retry-After）时 raise_for_status() 抛出的错误"""
+    def build(status: int, retry_after: Optional[str] = None) -> httpx.HTTPStatusError:
+        request = httpx.Request("POST", "https://openrouter.ai/api/v1/chat/completions")
+        headers = {"Retry-After": retry_after} if retry_after else {}
+        response = httpx.Response(status, request=request, headers=headers)
+        return httpx.HTTPStatusError("upstream error", request=request, response=response)
+
+    return build
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+AI Flashcard Generator 公平排队基准测试
+模拟一个租户持续提交大量文档分块、另一个租户间歇提交单条请求，
+对比有/无公平排队时交互式请求的等待延迟（p50/p95）
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from fair_scheduler import FairScheduler  # noqa: E402
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+async def simulate(fair: bool, capacity: int, batch_calls: int, interactive_calls: int,
+                   upstream_latency: float, interactive_interval: float) -> Dict[str, Any]:
+    """batch 租户一次性提交 batch_calls 个调用，interactive 租户每隔 interactive_interval 秒提交一个"""
+    scheduler = FairScheduler(enabled=True, capacity=capacity, weights={}, default_weight=1.0, max_tenants=100)
+    # 所有调用共用一个租户即为单一FIFO队列
+    tenant_of = ({"batch": "batch", "interactive": "interactive"} if fair
+                 else {"batch": "shared", "interactive": "shared"})
+
+    latencies: List[float] = []
+
+    async def upstream():
+        await asyncio.sleep(upstream_latency * random.uniform(0.5, 1.5))
+
+    async def interactive_call():
+        start = time.monotonic()
+        await scheduler.run(tenant_of["interactive"], upstream)
+        latencies.append(time.monotonic() - start)
+
+    async def interactive_user():
+        calls = []
+        for _ in range(interactive_calls):
+            calls.append(asyncio.create_task(interactive_call()))
+            await asyncio.sleep(interactive_interval)
+        await asyncio.gather(*calls)
+
+    batch = [asyncio.create_task(scheduler.run(tenant_of["batch"], upstream)) for _ in range(batch_calls)]
+    await interactive_user()
+    for task in batch:
+        task.cancel()
+    await asyncio.gather(*batch, return_exceptions=True)
+
+    return {
+        "interactive_p50": percentile(latencies, 0.5),
+        "interactive_p95": percentile(latencies, 0.95),
+        "interactive_max": max(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="公平排队基准测试")
+    parser.add_argument("--capacity", type=int, default=8, help="上游调用名额 (默认: 8)")
+    parser.add_argument("--batch-calls", type=int, default=500, help="批量租户提交的分块数 (默认: 500)")
+    parser.add_argument("--interactive-calls", type=int, default=30, help="交互式请求数 (默认: 30)")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟上游平均延迟/秒 (默认: 0.05)")
+    parser.add_argument("--interval", type=float, default=0.05, help="交互式请求间隔/秒 (默认: 0.05)")
+    parser.add_argument("--output", help="结果输出文件 (JSON)")
+    args = parser.parse_args()
+
+    options = dict(capacity=args.capacity, batch_calls=args.batch_calls,
+                   interactive_calls=args.interactive_calls, upstream_latency=args.latency,
+                   interactive_interval=args.interval)
+    results = {
+        "fifo": asyncio.run(simulate(False, **options)),
+        "fair": asyncio.run(simulate(True, **options)),
+    }
+
+    print("=" * 60)
+    print("公平排队基准测试")
+    print("=" * 60)
+    print(f"名额: {args.capacity}  批量分块: {args.batch_calls}  交互式请求: {args.interactive_calls}  "
+          f"上游延迟: {args.latency * 1000:.0f}ms")
+    for name, label in (("fifo", "单一FIFO队列"), ("fair", "按租户公平排队")):
+        result = results[name]
+        print(f"{label}: 交互式 p50 {result['interactive_p50'] * 1000:.0f}ms, "
+              f"p95 {result['interactive_p95'] * 1000:.0f}ms, 最大 {result['interactive_max'] * 1000:.0f}ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n详细结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
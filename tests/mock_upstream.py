@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+本地模拟OpenRouter上游服务
+用于基准测试：支持 keep-alive、模拟建连开销（DNS/TCP/TLS）、响应延迟与流式输出，以及带ETag的模型列表
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Dict, List, Optional
+
+DEFAULT_COMPLETION = """Q: 什么是机器学习？
+A: 机器学习是人工智能的一个分支，让计算机能从数据中学习。
+
+---
+
+Q: 监督学习的特点是什么？
+A: 监督学习使用标记的训练数据进行学习。"""
+
+
+class MockUpstreamServer:
+    """极简HTTP/1.1服务器，模拟 /api/v1/chat/completions 与 /api/v1/models"""
+
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 handshake_delay: float = 0.0,
+                 response_delay: float = 0.0,
+                 completion: str = DEFAULT_COMPLETION,
+                 stream_chunk_size: int = 16,
+                 stream_chunk_delay: float = 0.0,
+                 malformed_stream_lines: int = 0,
+                 stream_error: bool = False,
+                 failures: Optional[List[int]] = None,
+                 retry_after: Optional[str] = None,
+                 response_delays: Optional[List[float]] = None,
+                 failing_models: Optional[Dict[str, int]] = None,
+                 catalog: Optional[List[Dict]] = None,
+                 catalog_etag: bool = True):
+        self.host = host
+        self.port = port
+        # 每条新连接的首个请求额外等待，模拟 DNS + TCP + TLS 握手成本
+        self.handshake_delay = handshake_delay
+        self.response_delay = response_delay
+        self.completion = completion
+        self.stream_chunk_size = stream_chunk_size
+        self.stream_chunk_delay = stream_chunk_delay
+        # 在首个流式数据行之后插入若干个无法解析的数据行，模拟上游偶发的损坏输出
+        self.malformed_stream_lines = malformed_stream_lines
+        # 在首个流式数据行之后返回错误事件并结束流，模拟上游在输出中途失败
+        self.stream_error = stream_error
+        # 依次以这些状态码响应最初的若干个请求，模拟上游暂时性错误
+        self.failures = list(failures or [])
+        self.retry_after = retry_after
+        # 依次作为最初若干个请求的响应延迟（覆盖 response_delay），模拟偶发的慢请求
+        self.response_delays = list(response_delays or [])
+        # 对这些模型的请求始终以对应状态码失败，模拟单个模型提供方故障
+        self.failing_models = dict(failing_models or {})
+        # /api/v1/models 返回的模型列表；catalog_etag 为 False 时模拟不支持条件请求的上游
+        self.catalog = list(catalog or [])
+        self.catalog_etag = catalog_etag
+        self.catalog_statuses: List[int] = []
+
+        self.connections_opened = 0
+        self.requests_served = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.models_requested: List[str] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def chat_url(self) -> str:
+        return f"{self.base_url}/api/v1/chat/completions"
+
+    @property
+    def models_url(self) -> str:
+        return f"{self.base_url}/api/v1/models"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections_opened += 1
+        first_request = True
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                body = b""
+                if int(headers.get("content-length", 0)):
+                    body = await reader.readexactly(int(headers["content-length"]))
+
+                if first_request and self.handshake_delay:
+                    await asyncio.sleep(self.handshake_delay)
+                first_request = False
+
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                try:
+                    delay = self.response_delays.pop(0) if self.response_delays else self.response_delay
+                    if delay:
+                        await asyncio.sleep(delay)
+
+                    path = request_line.decode("latin-1").split(" ")[1]
+                    if path == "/api/v1/models":
+                        await self._write_catalog(writer, headers)
+                    else:
+                        await self._write_completion(writer, json.loads(body) if body else {})
+                finally:
+                    self.in_flight -= 1
+                self.requests_served += 1
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def _write_completion(self, writer: asyncio.StreamWriter, payload: dict):
+        self.models_requested.append(payload.get("model"))
+        if self.failures or payload.get("model") in self.failing_models:
+            status = self.failures.pop(0) if self.failures else self.failing_models[payload["model"]]
+            await self._write_json(writer, {"error": {"code": status, "message": "mock failure"}},
+                                   status=status)
+        elif payload.get("stream"):
+            await self._write_stream(writer)
+        else:
+            await self._write_json(writer, {
+                "choices": [{"message": {"role": "assistant", "content": self.completion}}]
+            })
+
+    async def _write_catalog(self, writer: asyncio.StreamWriter, headers: Dict[str, str]):
+        body = json.dumps({"data": self.catalog}, ensure_ascii=False).encode("utf-8")
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if self.catalog_etag and headers.get("if-none-match") == etag:
+            self.catalog_statuses.append(304)
+            writer.write(
+                b"HTTP/1.1 304 Not Modified\r\n"
+                + f"ETag: {etag}\r\n".encode()
+                + b"Connection: keep-alive\r\n"
+                + b"Content-Length: 0\r\n\r\n"
+            )
+            await writer.drain()
+            return
+        self.catalog_statuses.append(200)
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            + b"Content-Type: application/json\r\n"
+            + (f"ETag: {etag}\r\n".encode() if self.catalog_etag else b"")
+            + b"Connection: keep-alive\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    async def _write_json(self, writer: asyncio.StreamWriter, data: dict, status: int = 200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        extra = f"Retry-After: {self.retry_after}\r\n" if status != 200 and self.retry_after else ""
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n".encode()
+            + b"Content-Type: application/json\r\n"
+            + b"Connection: keep-alive\r\n"
+            + extra.encode()
+            + f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    async def _write_stream(self, writer: asyncio.StreamWriter):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Connection: keep-alive\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+
+        def chunk(data: bytes) -> bytes:
+            return f"{len(data):x}\r\n".encode() + data + b"\r\n"
+
+        text = self.completion
+        for i in range(0, len(text), self.stream_chunk_size):
+            event = {"choices": [{"delta": {"content": text[i:i + self.stream_chunk_size]}}]}
+            writer.write(chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8")))
+            if i == 0:
+                for _ in range(self.malformed_stream_lines):
+                    writer.write(chunk(b'data: {"choices": [{"delta": \n\n'))
+                if self.stream_error:
+                    error = {"error": {"code": 502, "message": "Provider returned error"}}
+                    writer.write(chunk(f"data: {json.dumps(error)}\n\n".encode("utf-8")))
+                    break
+            await writer.drain()
+            if self.stream_chunk_delay:
+                await asyncio.sleep(self.stream_chunk_delay)
+
+        writer.write(chunk(b"data: [DONE]\n\n"))
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
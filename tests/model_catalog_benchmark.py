@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+AI Flashcard Generator 模型校验基准测试
+对比每次请求都重建融合模型列表（旧实现）与复用目录快照时，单次模型校验的耗时
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from model_manager import ModelManager  # noqa: E402
+
+# 重建时的 INFO 日志会淹没测量结果
+logging.getLogger("model_manager").setLevel(logging.WARNING)
+
+
+def _build_manager(directory: str, model_count: int) -> ModelManager:
+    model_ids = [f"openai/benchmark-model-{i}" for i in range(model_count)]
+    metadata_file = os.path.join(directory, "metadata.json")
+    cache_file = os.path.join(directory, "cache.json")
+    with open(metadata_file, "w", encoding="utf-8") as f:
+        json.dump({model_id: {"suggested_use": "基准测试", "status": "verified"} for model_id in model_ids}, f)
+    with open(cache_file, "w", encoding="utf-8") as f:
+        json.dump({
+            "models": [{"id": model_id, "name": model_id, "description": "基准测试模型" * 20,
+                        "pricing": {"prompt": "0.000001", "completion": "0.000002"},
+                        "context_length": 128000, "architecture": {"modality": "text->text"}}
+                       for model_id in model_ids],
+            "timestamp": time.time()
+        }, f)
+    return ModelManager(metadata_file=metadata_file, cache_file=cache_file, save_delay=60)
+
+
+def _summarize(samples: List[float]) -> Dict[str, Any]:
+    samples = sorted(samples)
+    return {
+        "mean_us": statistics.mean(samples) * 1e6,
+        "p50_us": samples[len(samples) // 2] * 1e6,
+        "p99_us": samples[int(len(samples) * 0.99)] * 1e6,
+    }
+
+
+async def measure(manager: ModelManager, model_id: str, iterations: int, rebuild: bool) -> Dict[str, Any]:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        if rebuild:
+            # 旧实现：每次调用都从API缓存重建全部 dataclass 并重新融合元数据
+            models = manager._build_snapshot(1).models
+        else:
+            models = await manager.get_all_models()
+        assert model_id in models
+        samples.append(time.perf_counter() - start)
+    return _summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型校验基准测试")
+    parser.add_argument("--models", type=int, default=300, help="模型数量 (默认: 300)")
+    parser.add_argument("--iterations", type=int, default=2000, help="校验次数 (默认: 2000)")
+    parser.add_argument("--output", help="结果输出文件 (JSON)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        manager = _build_manager(directory, args.models)
+        model_id = f"openai/benchmark-model-{args.models // 2}"
+        results = {
+            "models": args.models,
+            "rebuild_every_call": asyncio.run(measure(manager, model_id, args.iterations, rebuild=True)),
+            "snapshot": asyncio.run(measure(manager, model_id, args.iterations, rebuild=False)),
+        }
+
+    rebuild, snapshot = results["rebuild_every_call"], results["snapshot"]
+    results["speedup"] = rebuild["mean_us"] / snapshot["mean_us"]
+
+    print("=" * 60)
+    print("模型校验基准测试")
+    print("=" * 60)
+    print(f"模型数量: {args.models}  校验次数: {args.iterations}")
+    for label, result in (("每次重建", rebuild), ("复用快照", snapshot)):
+        print(f"{label}: 平均 {result['mean_us']:.1f}µs, p50 {result['p50_us']:.1f}µs, p99 {result['p99_us']:.1f}µs")
+    print(f"加速比: {results['speedup']:.0f}x")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n详细结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
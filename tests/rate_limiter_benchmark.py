@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+AI Flashcard Generator 限流中间件开销基准测试
+直接以ASGI调用一个空应用，对比有/无限流中间件时每个请求的耗时，
+估算在目标QPS下限流器占用的CPU比例
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from rate_limiter import RateLimiter, RateLimitMiddleware  # noqa: E402
+
+REQUEST_BODY = json.dumps({
+    "text": "光合作用是植物将光能转化为化学能的过程。" * 50,
+    "api_key": "sk-or-benchmark",
+    "model_name": "google/gemini-2.5-flash-preview"
+}, ensure_ascii=False).encode("utf-8")
+
+
+async def empty_app(scope, receive, send):
+    """读取请求体后返回空响应的最小ASGI应用"""
+    if scope["method"] == "POST":
+        while (await receive()).get("more_body"):
+            pass
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def build_requests(count: int, clients: int, post_ratio: float) -> List[Dict[str, Any]]:
+    requests = []
+    for _ in range(count):
+        client = random.randrange(clients)
+        post = random.random() < post_ratio
+        requests.append({
+            "type": "http",
+            "method": "POST" if post else "GET",
+            "path": "/generate_flashcards/" if post else "/supported_models",
+            "headers": [(b"content-type", b"application/json")] if post else [],
+            "client": (f"10.{client // 65536}.{client // 256 % 256}.{client % 256}", 40000),
+        })
+    return requests
+
+
+async def drive(app, requests: List[Dict[str, Any]]) -> float:
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for scope in requests:
+        delivered = False
+
+        async def receive():
+            nonlocal delivered
+            if delivered:
+                return {"type": "http.disconnect"}
+            delivered = True
+            return {"type": "http.request", "body": REQUEST_BODY, "more_body": False}
+
+        await app(scope, receive, send)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="限流中间件开销基准测试")
+    parser.add_argument("--requests", type=int, default=50000, help="请求数 (默认: 50000)")
+    parser.add_argument("--clients", type=int, default=5000, help="不同客户端IP数 (默认: 5000)")
+    parser.add_argument("--post-ratio", type=float, default=0.3, help="生成类(POST)请求占比 (默认: 0.3)")
+    parser.add_argument("--target-rps", type=int, default=2000, help="估算CPU占用时的目标QPS (默认: 2000)")
+    parser.add_argument("--output", help="结果输出文件 (JSON)")
+    args = parser.parse_args()
+
+    requests = build_requests(args.requests, args.clients, args.post_ratio)
+    # 额度足够大，只测查找与扣减开销，不触发429
+    limiter = RateLimiter(enabled=True, generation_requests=10 ** 9, read_requests=10 ** 9, window=60,
+                          max_keys=100000, trust_proxy=False, exempt_paths=frozenset())
+    limited_app = RateLimitMiddleware(empty_app, limiter=limiter)
+
+    baseline = asyncio.run(drive(empty_app, requests))
+    limited = asyncio.run(drive(limited_app, requests))
+    overhead_us = (limited - baseline) / len(requests) * 1e6
+
+    results = {
+        "requests": len(requests),
+        "clients": args.clients,
+        "baseline_us_per_request": baseline / len(requests) * 1e6,
+        "limited_us_per_request": limited / len(requests) * 1e6,
+        "overhead_us_per_request": overhead_us,
+        "cpu_share_at_target_rps": overhead_us * args.target_rps / 1e6,
+        "limiter": limiter.get_stats(),
+    }
+
+    print("=" * 60)
+    print("限流中间件开销基准测试")
+    print("=" * 60)
+    print(f"请求数: {len(requests)}  客户端: {args.clients}  POST占比: {args.post_ratio:.0%}")
+    print(f"无限流: {results['baseline_us_per_request']:.1f} µs/请求")
+    print(f"有限流: {results['limited_us_per_request']:.1f} µs/请求")
+    print(f"限流开销: {overhead_us:.1f} µs/请求，{args.target_rps} QPS 下约占 {results['cpu_share_at_target_rps']:.2%} 单核CPU")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n详细结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+AI Flashcard Generator 多worker共享缓存基准测试
+模拟uvicorn多worker部署：请求按轮询分配到N个进程，对比每个进程私有缓存
+与同主机共享缓存（SQLite WAL，默认位于 /dev/shm）在不同worker数下的命中率
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from cache_tier_benchmark import SAMPLE_VALUE, generate_traffic, load_traffic, request_key  # noqa: E402
+from response_cache import DiskCacheTier, ResponseCache  # noqa: E402
+
+
+def _worker(worker_id: int, workers: int, keys: List[str], shared_path: str, memory_entries: int,
+            miss_delay: float, barrier, results):
+    async def replay() -> Dict[str, int]:
+        tier = DiskCacheTier(shared_path) if shared_path else None
+        cache = ResponseCache(max_entries=memory_entries, max_bytes=256 * 1024 * 1024, ttl=3600, persistent=tier)
+        hits = 0
+        served = 0
+        for key in keys[worker_id::workers]:
+            served += 1
+            if await cache.lookup(key) is not None:
+                hits += 1
+                continue
+            # 模拟上游生成耗时
+            await asyncio.sleep(miss_delay)
+            await cache.store(key, SAMPLE_VALUE)
+        if tier is not None:
+            tier.close()
+        return {"hits": hits, "requests": served}
+
+    barrier.wait()
+    results.put(asyncio.run(replay()))
+
+
+def run_scenario(keys: List[str], workers: int, shared_path: str, memory_entries: int,
+                 miss_delay: float) -> Dict[str, Any]:
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=_worker, args=(i, workers, keys, shared_path, memory_entries, miss_delay, barrier, results))
+        for i in range(workers)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    hits = sum(item["hits"] for item in totals)
+    requests = sum(item["requests"] for item in totals)
+    return {
+        "workers": workers,
+        "hits": hits,
+        "requests": requests,
+        "hit_ratio": hits / requests if requests else 0,
+        "duration_s": time.perf_counter() - start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多worker共享缓存基准测试")
+    parser.add_argument("--traffic", help="录制的请求日志 (JSONL)")
+    parser.add_argument("--requests", type=int, default=4000, help="合成流量请求数 (默认: 4000)")
+    parser.add_argument("--distinct", type=int, default=800, help="合成流量中不同文本数 (默认: 800)")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf分布参数 (默认: 1.1)")
+    parser.add_argument("--workers", default="2,4,8,16", help="要测试的worker数 (默认: 2,4,8,16)")
+    parser.add_argument("--memory-entries", type=int, default=1000, help="每个worker的内存缓存条目上限 (默认: 1000)")
+    parser.add_argument("--miss-delay", type=float, default=0.001, help="未命中时模拟的生成耗时/秒 (默认: 0.001)")
+    parser.add_argument("--shared-dir", help="共享数据库目录 (默认: /dev/shm 或系统临时目录)")
+    parser.add_argument("--output", help="结果输出文件 (JSON)")
+    args = parser.parse_args()
+
+    traffic = load_traffic(args.traffic) if args.traffic else generate_traffic(args.requests, args.distinct, args.skew)
+    keys = [request_key(entry) for entry in traffic]
+    worker_counts = [int(n) for n in args.workers.split(",")]
+    base_dir = args.shared_dir or ("/dev/shm" if os.access("/dev/shm", os.W_OK) else None)
+
+    results = {"private": [], "shared": []}
+    print("=" * 60)
+    print("多worker共享缓存基准测试")
+    print("=" * 60)
+    print(f"请求数: {len(keys)}  不同请求: {len(set(keys))}")
+    print(f"{'workers':>8} {'私有缓存命中率':>14} {'共享缓存命中率':>14}")
+    for workers in worker_counts:
+        private = run_scenario(keys, workers, "", args.memory_entries, args.miss_delay)
+        with tempfile.TemporaryDirectory(dir=base_dir) as tmp:
+            shared = run_scenario(keys, workers, os.path.join(tmp, "shared.db"), args.memory_entries, args.miss_delay)
+        results["private"].append(private)
+        results["shared"].append(shared)
+        print(f"{workers:>8} {private['hit_ratio']:>14.1%} {shared['hit_ratio']:>14.1%}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n详细结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+AI Flashcard Generator - 自适应上游并发控制（AIMD）测试
+"""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from adaptive_concurrency import AdaptiveConcurrency, ConcurrencyQueueTimeout
+
+
+def test_limit_grows_additively_while_healthy():
+    """测试延迟稳定时上限加性增长，且在途调用数始终不超过上限"""
+    controller = AdaptiveConcurrency(enabled=True, initial=2, min_limit=1, max_limit=8, increase=1,
+                                     decrease_factor=0.5, latency_tolerance=3.0, max_keys=100)
+    limit = controller.get(controller.make_key("model", "sk-or-key"))
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        peak = max(peak, limit.in_flight)
+        assert limit.in_flight <= max(1, int(limit.limit))
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    async def run():
+        await asyncio.gather(*(controller.run("model", "sk-or-key", call) for _ in range(60)))
+
+    asyncio.run(run())
+    assert 2 < limit.limit <= 8
+    assert peak > 2
+    assert limit.in_flight == 0 and limit.queued == 0
+
+
+def test_throttling_cuts_limit_once_per_round(status_error):
+    """测试429乘性下降，同一轮内的多个429只下降一次"""
+    controller = AdaptiveConcurrency(enabled=True, initial=8, min_limit=1, max_limit=8, increase=1,
+                                     decrease_factor=0.5, latency_tolerance=3.0, max_keys=100)
+    limit = controller.get("model")
+
+    async def run():
+        async def ok():
+            await asyncio.sleep(0.05)
+
+        await controller.run("model", None, ok)
+
+        async def throttled():
+            raise status_error(429)
+
+        for _ in range(3):
+            with pytest.raises(httpx.HTTPStatusError):
+                await controller.run("model", None, throttled)
+
+    asyncio.run(run())
+    assert limit.limit == 4
+    assert limit.stats["throttled"] == 3
+    assert limit.stats["decreases"] == 1
+
+
+def test_latency_spike_cuts_limit():
+    """测试延迟突增（超过基线的容忍倍数）触发下降"""
+    controller = AdaptiveConcurrency(enabled=True, initial=4, min_limit=1, max_limit=8, increase=1,
+                                     decrease_factor=0.5, latency_tolerance=3.0, max_keys=100)
+    limit = controller.get("model")
+    limit.baseline_latency = 0.01
+
+    async def slow():
+        await asyncio.sleep(0.1)
+
+    asyncio.run(controller.run("model", None, slow))
+    assert limit.limit == 2
+    assert limit.stats["latency_spikes"] == 1
+
+
+def test_queue_is_fifo_and_times_out():
+    """测试超出上限的调用按FIFO排队，排队超时后退出队列"""
+    controller = AdaptiveConcurrency(enabled=True, initial=1, min_limit=1, max_limit=1, increase=1,
+                                     decrease_factor=0.5, latency_tolerance=3.0, max_keys=100)
+    order = []
+
+    async def run():
+        gate = asyncio.Event()
+
+        async def first():
+            await gate.wait()
+            order.append("first")
+
+        async def queued(name):
+            order.append(name)
+
+        tasks = [asyncio.ensure_future(controller.run("model", None, first))]
+        await asyncio.sleep(0)
+        tasks += [asyncio.ensure_future(controller.run("model", None, lambda n=n: queued(n))) for n in ("a", "b")]
+        await asyncio.sleep(0.01)
+        depth = controller.get_stats()["queued"]
+
+        with pytest.raises(ConcurrencyQueueTimeout):
+            await controller.run("model", None, lambda: queued("late"), timeout=0.02)
+        gate.set()
+        await asyncio.gather(*tasks)
+        return depth
+
+    depth = asyncio.run(run())
+    assert depth == 2
+    assert order == ["first", "a", "b"]
+    assert controller.get("model").queued == 0
+    assert controller.get("model").stats["queue_timeouts"] == 1
+
+
+def test_batch_respects_upstream_concurrency_limit(monkeypatch):
+    """测试批量生成时同一模型与Key的上游并发不超过自适应上限"""
+    import main_refactored
+    from main_refactored import BatchFlashcardItem
+    from mock_upstream import MockUpstreamServer
+
+    controller = AdaptiveConcurrency(enabled=True, initial=3, min_limit=1, max_limit=3, increase=1,
+                                     decrease_factor=0.5, latency_tolerance=3.0, max_keys=100)
+
+    async def run():
+        server = MockUpstreamServer(response_delay=0.02)
+        await server.start()
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+        monkeypatch.setattr(main_refactored, "upstream_concurrency", controller)
+        items = [BatchFlashcardItem(text=f"并发控制测试文本 {i} {time.time()}") for i in range(12)]
+        try:
+            outcomes = [outcome async for _, outcome in main_refactored.generate_batch_flashcards(
+                items=items,
+                user_api_key="test-key",
+                model_name="aimd/test-model",
+                max_concurrency=12
+            )]
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return outcomes, server.max_in_flight
+
+    outcomes, max_in_flight = asyncio.run(run())
+    assert all(not isinstance(outcome, Exception) for outcome in outcomes)
+    assert max_in_flight <= 3
+    stats = controller.get_stats()
+    assert stats["in_flight"] == 0
+    assert list(stats["keys"]) == [AdaptiveConcurrency.make_key("aimd/test-model", "test-key")]
+
+
+def test_streams_hold_their_limit_for_the_whole_stream(monkeypatch):
+    """测试流式调用在整个流期间占用并发名额，并以整个流的耗时记在单独的流式键上"""
+    import main_refactored
+    from mock_upstream import MockUpstreamServer
+    from rate_limiter import api_key_fingerprint
+    from retry_policy import RetryPolicy
+
+    controller = AdaptiveConcurrency(enabled=True, initial=1, min_limit=1, max_limit=1, increase=1,
+                                     decrease_factor=0.5, latency_tolerance=3.0, max_keys=100)
+
+    async def fake_validate(model_name):
+        return None
+
+    def stream(index):
+        async def consume():
+            return [card async for card in main_refactored.stream_flashcards_from_llm(
+                text_to_process=f"流式并发测试文本 {index}",
+                user_api_key="sk-or-stream",
+                model_name="aimd/stream-model",
+                system_prompt="system",
+                user_prompt=f"流式并发测试 {index} {time.time()}",
+                processing_info={},
+                use_cache=False
+            )]
+        return consume()
+
+    async def run():
+        server = MockUpstreamServer(stream_chunk_size=8, stream_chunk_delay=0.03)
+        await server.start()
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+        monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+        monkeypatch.setattr(main_refactored, "upstream_retry", RetryPolicy(max_attempts=1, budget=5))
+        monkeypatch.setattr(main_refactored, "upstream_concurrency", controller)
+        try:
+            start = time.monotonic()
+            results = await asyncio.gather(stream(0), stream(1))
+            elapsed = time.monotonic() - start
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return results, elapsed, server.max_in_flight
+
+    results, elapsed, max_in_flight = asyncio.run(run())
+    assert all(len(cards) == 2 for cards in results)
+    assert max_in_flight == 1
+    stats = controller.get_stats()["keys"]
+    stream_key = f"aimd/stream-model#stream|{api_key_fingerprint('sk-or-stream')}"
+    assert list(stats) == [stream_key]
+    assert stats[stream_key]["completed"] == 2 and stats[stream_key]["in_flight"] == 0
+    # 延迟样本是整个流的耗时，而非首个token的耗时
+    assert stats[stream_key]["baseline_latency"] >= elapsed / 2 * 0.8
@@ -0,0 +1,93 @@
+"""
+AI Flashcard Generator - 过载保护（准入控制）测试
+"""
+
+import asyncio
+import json
+import time
+
+from admission import AdmissionController, AdmissionMiddleware, LoopLagMonitor
+from fair_scheduler import SchedulingMiddleware
+
+
+def test_lower_priorities_are_shed_first():
+    """测试低优先级请求在较低负载时先被拒绝，交互式请求直到阈值才拒绝"""
+    controller = AdmissionController(enabled=True, max_in_flight=10, max_queue_depth=20, max_loop_lag=0.5,
+                                     retry_after=7, monitor=LoopLagMonitor())
+    controller.in_flight = 6
+    assert controller.overload_reason("interactive", queue_depth=0) is None
+    assert controller.overload_reason("batch", queue_depth=0) is None
+    assert controller.overload_reason("background", queue_depth=0) == "in_flight"
+
+    controller.in_flight = 0
+    assert controller.overload_reason("batch", queue_depth=16) == "queue_depth"
+    assert controller.overload_reason("interactive", queue_depth=16) is None
+
+    controller.monitor.record(0.6)
+    assert controller.overload_reason("interactive", queue_depth=0) == "loop_lag"
+    # 延迟回落后平滑下降，最终恢复准入
+    for _ in range(30):
+        controller.monitor.record(0.0)
+    assert controller.overload_reason("interactive", queue_depth=0) is None
+
+
+def test_middleware_sheds_before_reaching_the_app():
+    """测试过载时返回503与Retry-After且不进入业务逻辑，被准入的请求结束后归还计数"""
+    controller = AdmissionController(enabled=True, max_in_flight=1, max_queue_depth=0, max_loop_lag=0,
+                                     retry_after=7, monitor=LoopLagMonitor())
+    reached = []
+    gate = asyncio.Event()
+
+    async def app(scope, receive, send):
+        reached.append(scope["path"])
+        await gate.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    stack = SchedulingMiddleware(AdmissionMiddleware(app, controller=controller), header="")
+
+    async def request(method, path):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        await stack({"type": "http", "method": method, "path": path, "headers": []}, None, send)
+        return messages
+
+    async def run():
+        first = asyncio.create_task(request("POST", "/generate_flashcards/"))
+        await asyncio.sleep(0)
+        assert controller.in_flight == 1
+        rejected = await request("POST", "/generate_flashcards/")
+        gate.set()
+        # 查询类请求不受准入控制
+        assert (await request("GET", "/generate_flashcards/"))[0]["status"] == 200
+        return await first, rejected
+
+    admitted, rejected = asyncio.run(run())
+    assert admitted[0]["status"] == 200
+    assert rejected[0]["status"] == 503
+    assert (b"retry-after", b"7") in rejected[0]["headers"]
+    assert json.loads(rejected[1]["body"])["detail"]["error_code"] == "OVERLOADED"
+    assert reached == ["/generate_flashcards/", "/generate_flashcards/"]
+    assert controller.in_flight == 0
+    stats = controller.get_stats()
+    assert stats["shed"] == 1 and stats["shed_by_reason"]["in_flight"] == 1
+    assert stats["shed_by_priority"]["interactive"] == 1
+
+
+def test_loop_lag_monitor_detects_blocking():
+    """测试阻塞事件循环时测得的延迟上升"""
+    monitor = LoopLagMonitor(interval=0.02)
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.2)
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+    asyncio.run(run())
+    assert monitor.max_lag >= 0.15
+    assert monitor.lag > 0.05
@@ -0,0 +1,103 @@
+"""
+AI Flashcard Generator - 批量生成测试
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+
+import main_refactored
+from document_processor import iter_bounded
+from mock_upstream import MockUpstreamServer
+
+
+def test_iter_bounded_yields_in_completion_order():
+    """测试有界迭代按完成顺序产出，且并发不超过上限"""
+    running = 0
+    peak = 0
+
+    async def worker(index, delay):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(delay)
+        running -= 1
+        if index == 2:
+            raise ValueError("boom")
+        return index
+
+    async def run():
+        return [item async for item in iter_bounded([0.05, 0.01, 0.02, 0.0], worker, 2)]
+
+    results = asyncio.run(run())
+    assert [index for index, _ in results] == [1, 2, 3, 0]
+    assert isinstance(dict(results)[2], ValueError)
+    assert peak == 2
+
+
+def _post_batch(monkeypatch, body, response_delay=0.0):
+    async def fake_validate(model_name):
+        return None
+
+    async def run():
+        server = MockUpstreamServer(response_delay=response_delay)
+        await server.start()
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+        monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+        try:
+            transport = httpx.ASGITransport(app=main_refactored.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+                start = time.perf_counter()
+                response = await client.post("/generate_flashcards/batch", json=body)
+                elapsed = time.perf_counter() - start
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return response, server, elapsed
+
+    return asyncio.run(run())
+
+
+def test_batch_returns_results_in_input_order_with_item_errors(monkeypatch):
+    """测试批量结果按输入顺序返回，单个条目的错误不影响其他条目，并发受限"""
+    items = [{"text": f"批量测试文本 {i}-{time.time()}", "id": f"p{i}"} for i in range(40)]
+    items[5] = {"text": "   ", "id": "blank"}
+    response, server, elapsed = _post_batch(monkeypatch, {
+        "items": items,
+        "api_key": "test-key",
+        "model_name": "google/gemini-2.5-flash-preview",
+        "max_concurrency": 8
+    }, response_delay=0.05)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [result["index"] for result in data["results"]] == list(range(40))
+    assert [result["id"] for result in data["results"]] == [item["id"] for item in items]
+    assert data["results"][5]["error_code"] == "EMPTY_TEXT"
+    assert data["succeeded"] == 39 and data["failed"] == 1
+    assert all(result["cards_generated"] == 2 for i, result in enumerate(data["results"]) if i != 5)
+
+    # 39次上游调用、每次50ms、并发8：耗时由上游并发决定而非串行往返
+    assert server.max_in_flight <= 8
+    assert server.requests_served == 39
+    assert elapsed < 39 * 0.05 / 2
+
+
+def test_batch_ndjson_stream(monkeypatch):
+    """测试NDJSON模式逐条输出结果并以汇总行结束"""
+    items = [{"text": f"流式批量文本 {i}-{time.time()}"} for i in range(5)]
+    response, _, _ = _post_batch(monkeypatch, {
+        "items": items,
+        "api_key": "test-key",
+        "model_name": "google/gemini-2.5-flash-preview",
+        "stream": True
+    })
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.strip().split("\n")]
+    assert [line["type"] for line in lines] == ["item"] * 5 + ["done"]
+    assert sorted(line["index"] for line in lines[:-1]) == list(range(5))
+    assert lines[-1]["succeeded"] == 5
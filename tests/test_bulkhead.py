@@ -0,0 +1,173 @@
+"""
+AI Flashcard Generator - 按模型舱壁隔离测试
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from bulkhead import BulkheadFullError, BulkheadRegistry
+from mock_upstream import MockUpstreamServer
+from retry_policy import RetryPolicy
+
+SLOW = "anthropic/claude-sonnet-4"
+FAST = "google/gemini-2.5-flash-preview"
+
+
+def test_slow_model_does_not_block_fast_model():
+    """测试慢模型占满自己的舱壁后被快速拒绝，快模型不受影响"""
+    registry = BulkheadRegistry(enabled=True, default_limit=2, provider_limits={}, max_queue=1,
+                                queue_timeout=0.2, model_config=lambda model: None)
+
+    async def run():
+        gate = asyncio.Event()
+        slow = [asyncio.create_task(registry.run(SLOW, gate.wait)) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        # 2个在途 + 1个排队后，新的慢模型请求立即被拒绝
+        with pytest.raises(BulkheadFullError) as exc_info:
+            await registry.run(SLOW, gate.wait)
+        assert exc_info.value.reason == "queue_full"
+
+        start = time.monotonic()
+        assert await registry.run(FAST, lambda: asyncio.sleep(0, result="ok")) == "ok"
+        assert time.monotonic() - start < 0.05
+
+        # 排队的慢模型请求等待超时
+        with pytest.raises(BulkheadFullError) as exc_info:
+            await slow[2]
+        assert exc_info.value.reason == "timeout"
+        gate.set()
+        await asyncio.gather(*slow[:2])
+
+    asyncio.run(run())
+    stats = registry.get_stats()["bulkheads"][SLOW]
+    assert stats["in_flight"] == 0 and stats["queued"] == 0
+    assert stats["peak_in_flight"] == 2
+    assert stats["rejected_queue_full"] == 1 and stats["rejected_timeout"] == 1
+
+
+def test_config_resolution_and_live_update():
+    """测试配置优先级（模型元数据 > 提供商前缀 > 默认值），修改配置后立即生效"""
+    overrides = {SLOW: {"max_concurrent": 1, "max_queue": 5, "queue_timeout": 2}}
+    registry = BulkheadRegistry(enabled=True, default_limit=2,
+                                provider_limits={"anthropic/": 3, "anthropic/claude-3": 4},
+                                max_queue=1, queue_timeout=0.2, model_config=overrides.get)
+
+    assert registry.resolve(SLOW) == (SLOW, (1, 5, 2.0))
+    assert registry.resolve("anthropic/claude-3-haiku") == ("anthropic/claude-3", (4, 1, 0.2))
+    assert registry.resolve("anthropic/claude-3.7-sonnet") == ("anthropic/claude-3", (4, 1, 0.2))
+    assert registry.resolve("anthropic/claude-opus-4") == ("anthropic/", (3, 1, 0.2))
+    assert registry.resolve(FAST) == (FAST, (2, 1, 0.2))
+
+    async def run():
+        gate = asyncio.Event()
+        first = asyncio.create_task(registry.run(SLOW, gate.wait))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(registry.run(SLOW, lambda: asyncio.sleep(0, result="second")))
+        await asyncio.sleep(0)
+        assert registry.get(SLOW).queued == 1
+        # 调高上限后排队的请求立即执行
+        overrides[SLOW]["max_concurrent"] = 2
+        registry.get(SLOW)
+        assert await second == "second"
+        gate.set()
+        await first
+
+    asyncio.run(run())
+
+
+def test_saturated_bulkhead_falls_back_to_other_model(monkeypatch):
+    """测试舱壁已满时返回503 UPSTREAM_BUSY并切换到备用模型"""
+    import main_refactored
+    from config.health import MetricsCollector
+
+    registry = BulkheadRegistry(enabled=True, default_limit=1, provider_limits={}, max_queue=0,
+                                queue_timeout=0.2, model_config=lambda model: None)
+
+    async def fake_validate(model_name):
+        return None
+
+    async def run():
+        server = MockUpstreamServer()
+        await server.start()
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+        monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+        monkeypatch.setattr(main_refactored, "upstream_retry", RetryPolicy(max_attempts=1, budget=5))
+        monkeypatch.setattr(main_refactored, "metrics_collector", MetricsCollector())
+        monkeypatch.setattr(main_refactored, "upstream_bulkheads", registry)
+        gate = asyncio.Event()
+        blocker = asyncio.create_task(registry.run(SLOW, gate.wait))
+        await asyncio.sleep(0)
+        try:
+            cards, info = await main_refactored.generate_flashcards_from_llm(
+                text_to_process=f"舱壁测试文本 {time.time()}",
+                user_api_key="test-key",
+                model_name=SLOW,
+                use_cache=False,
+                fallback_models=[FAST]
+            )
+        finally:
+            gate.set()
+            await blocker
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return cards, info, server.models_requested
+
+    cards, info, requested = asyncio.run(run())
+    assert cards
+    assert requested == [FAST]
+    assert info["model_used"] == FAST
+    assert info["fallbacks"][0]["error_code"] == "UPSTREAM_BUSY"
+
+
+def test_long_streams_hold_the_bulkhead_until_finished(monkeypatch):
+    """测试流式调用在整个流期间占用舱壁：N个长流占满舱壁后第N+1个返回503，流结束后归还名额"""
+    import main_refactored
+    from fastapi import HTTPException
+
+    registry = BulkheadRegistry(enabled=True, default_limit=2, provider_limits={}, max_queue=0, queue_timeout=0.2,
+                                model_config=lambda model: None)
+
+    async def fake_validate(model_name):
+        return None
+
+    def stream(index):
+        async def consume():
+            return [card async for card in main_refactored.stream_flashcards_from_llm(
+                text_to_process=f"长流测试文本 {index}",
+                user_api_key="test-key",
+                model_name=SLOW,
+                system_prompt="system",
+                user_prompt=f"长流测试 {index} {time.time()}",
+                processing_info={},
+                use_cache=False
+            )]
+        return consume()
+
+    async def run():
+        # 首个token很快到达，之后的输出持续约1秒
+        server = MockUpstreamServer(stream_chunk_size=4, stream_chunk_delay=0.05)
+        await server.start()
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+        monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+        monkeypatch.setattr(main_refactored, "upstream_retry", RetryPolicy(max_attempts=1, budget=5))
+        monkeypatch.setattr(main_refactored, "upstream_bulkheads", registry)
+        try:
+            streams = [asyncio.create_task(stream(i)) for i in range(2)]
+            await asyncio.sleep(0.3)
+            assert registry.get(SLOW).in_flight == 2
+            with pytest.raises(HTTPException) as rejected:
+                await stream(2)
+            results = await asyncio.gather(*streams)
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return rejected.value, results
+
+    rejected, results = asyncio.run(run())
+    assert rejected.status_code == 503 and rejected.detail["error_code"] == "UPSTREAM_BUSY"
+    assert all(len(cards) == 2 for cards in results)
+    stats = registry.get_stats()["bulkheads"][SLOW]
+    assert stats["in_flight"] == 0 and stats["rejected_queue_full"] == 1
@@ -0,0 +1,207 @@
+"""
+AI Flashcard Generator - 按模型熔断测试
+"""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreakerRegistry, CircuitOpenError
+
+
+async def _fail(error: BaseException):
+    raise error
+
+
+async def _ok():
+    return "ok"
+
+
+def test_breaker_opens_then_recovers_through_half_open(status_error):
+    """测试失败率达到阈值后打开、快速拒绝，冷却后探测成功即关闭"""
+    registry = CircuitBreakerRegistry(enabled=True, failure_rate=0.5, min_requests=4, window=60,
+                                      open_seconds=0.1, half_open_max_calls=1,
+                                      failure_statuses=frozenset({502, 503, 504}))
+
+    async def run():
+        await registry.call("model", _ok)
+        await registry.call("model", _ok)
+        for error in (status_error(503), httpx.ReadTimeout("timed out")):
+            with pytest.raises(type(error)):
+                await registry.call("model", lambda: _fail(error))
+
+        breaker = registry.get("model")
+        assert breaker.state == OPEN
+        assert breaker.snapshot()["timeouts"] == 1
+
+        calls = []
+
+        async def tracked():
+            calls.append(1)
+            return "ok"
+
+        with pytest.raises(CircuitOpenError) as exc_info:
+            await registry.call("model", tracked)
+        assert calls == []
+        assert 0 < exc_info.value.retry_after <= 0.1
+
+        await asyncio.sleep(0.12)
+        assert breaker.state == HALF_OPEN
+        assert await registry.call("model", tracked) == "ok"
+        assert breaker.state == CLOSED
+
+    asyncio.run(run())
+
+
+def test_failed_probe_reopens_and_limits_probes(status_error):
+    """测试半开状态只放行有限探测，探测失败重新打开"""
+    registry = CircuitBreakerRegistry(enabled=True, failure_rate=0.5, min_requests=1, window=60,
+                                      open_seconds=0.1, half_open_max_calls=1,
+                                      failure_statuses=frozenset({502, 503, 504}))
+
+    async def run():
+        with pytest.raises(httpx.ConnectError):
+            await registry.call("model", lambda: _fail(httpx.ConnectError("refused")))
+        await asyncio.sleep(0.12)
+
+        probe_started = asyncio.Event()
+
+        async def slow_probe():
+            probe_started.set()
+            await asyncio.sleep(0.05)
+            raise status_error(502)
+
+        probe = asyncio.ensure_future(registry.call("model", slow_probe))
+        await probe_started.wait()
+        with pytest.raises(CircuitOpenError):
+            await registry.call("model", _ok)
+        with pytest.raises(httpx.HTTPStatusError):
+            await probe
+        assert registry.get("model").state == OPEN
+        assert registry.get_stats()["open"] == ["model"]
+
+    asyncio.run(run())
+
+
+def test_client_errors_do_not_trip_breaker(status_error):
+    """测试401等说明模型可用的错误不计为失败，熔断器之间按模型隔离"""
+    registry = CircuitBreakerRegistry(enabled=True, failure_rate=0.5, min_requests=2, window=60,
+                                      open_seconds=0.1, half_open_max_calls=1,
+                                      failure_statuses=frozenset({502, 503, 504}))
+
+    async def run():
+        for _ in range(3):
+            with pytest.raises(httpx.HTTPStatusError):
+                await registry.call("model-a", lambda: _fail(status_error(401)))
+        for _ in range(2):
+            with pytest.raises(httpx.HTTPStatusError):
+                await registry.call("model-b", lambda: _fail(status_error(503)))
+
+    asyncio.run(run())
+    assert registry.get("model-a").state == CLOSED
+    assert registry.get("model-b").state == OPEN
+
+
+def test_open_circuit_fails_fast_or_falls_back(monkeypatch):
+    """测试熔断打开时生成请求立即返回503，配置备用模型时改用备用模型"""
+    import main_refactored
+    from mock_upstream import MockUpstreamServer
+    from retry_policy import RetryPolicy
+
+    async def fake_validate(model_name):
+        return None
+
+    registry = CircuitBreakerRegistry(enabled=True, failure_rate=0.5, min_requests=1, window=60,
+                                      open_seconds=30, half_open_max_calls=1,
+                                      failure_statuses=frozenset({502, 503, 504}))
+
+    async def run():
+        server = MockUpstreamServer(failing_models={"broken/model": 503})
+        await server.start()
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+        monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+        monkeypatch.setattr(main_refactored, "upstream_retry", RetryPolicy(max_attempts=1, budget=5))
+        monkeypatch.setattr(main_refactored, "upstream_breakers", registry)
+
+        async def generate(**kwargs):
+            return await main_refactored.generate_flashcards_from_llm(
+                text_to_process=f"熔断测试文本 {time.time()}",
+                user_api_key="test-key",
+                model_name="broken/model",
+                use_cache=False,
+                **kwargs
+            )
+
+        try:
+            with pytest.raises(HTTPException) as first:
+                await generate()
+            start = time.monotonic()
+            with pytest.raises(HTTPException) as second:
+                await generate()
+            elapsed = time.monotonic() - start
+            cards, info = await generate(fallback_models=["healthy/model"])
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return first.value, second.value, elapsed, cards, info, server.models_requested
+
+    first, second, elapsed, cards, info, requested = asyncio.run(run())
+    assert first.status_code == 503 and first.detail["error_code"] == "SERVICE_UNAVAILABLE"
+    assert second.status_code == 503 and second.detail["error_code"] == "CIRCUIT_OPEN"
+    assert int(second.headers["Retry-After"]) >= 1
+    assert elapsed < 0.5
+    assert len(cards) == 2 and info["model_used"] == "healthy/model"
+    assert info["fallbacks"][0]["error_code"] == "CIRCUIT_OPEN"
+    # 熔断期间不再请求故障模型
+    assert requested == ["broken/model", "healthy/model"]
+
+
+def test_streams_failing_mid_way_open_the_breaker(monkeypatch):
+    """测试首个token之后才失败的流式调用计为该模型的失败，持续失败时熔断打开"""
+    import main_refactored
+    from mock_upstream import MockUpstreamServer
+    from retry_policy import RetryPolicy
+
+    registry = CircuitBreakerRegistry(enabled=True, failure_rate=0.5, min_requests=2, window=60, open_seconds=30,
+                                      half_open_max_calls=1, failure_statuses=frozenset({502, 503, 504}))
+
+    async def fake_validate(model_name):
+        return None
+
+    async def stream(index):
+        return [card async for card in main_refactored.stream_flashcards_from_llm(
+            text_to_process=f"流中途失败测试文本 {index}",
+            user_api_key="test-key",
+            model_name="breaker/stream-model",
+            system_prompt="system",
+            user_prompt=f"流中途失败测试 {index} {time.time()}",
+            processing_info={},
+            use_cache=False
+        )]
+
+    async def run():
+        server = MockUpstreamServer(stream_chunk_size=8, stream_error=True)
+        await server.start()
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+        monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+        monkeypatch.setattr(main_refactored, "upstream_retry", RetryPolicy(max_attempts=1, budget=5))
+        monkeypatch.setattr(main_refactored, "upstream_breakers", registry)
+        errors = []
+        try:
+            for index in range(3):
+                with pytest.raises(HTTPException) as error:
+                    await stream(index)
+                errors.append(error.value.detail["error_code"])
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return errors, server.requests_served
+
+    errors, served = asyncio.run(run())
+    assert errors == ["STREAM_ERROR", "STREAM_ERROR", "CIRCUIT_OPEN"]
+    assert served == 2
+    breaker = registry.get("breaker/stream-model").snapshot()
+    assert breaker["state"] == OPEN and breaker["failures"] == 2 and breaker["calls"] == 2
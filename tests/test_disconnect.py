@@ -0,0 +1,124 @@
+"""
+AI Flashcard Generator - 客户端断开时取消生成测试
+"""
+
+import asyncio
+import json
+import time
+
+from config.health import MetricsCollector
+from disconnect import CancelOnDisconnectMiddleware
+from mock_upstream import MockUpstreamServer
+
+MODEL = "google/gemini-2.5-flash-preview"
+BODY = json.dumps({"text": "断开测试"}).encode()
+
+
+def _receive(disconnect_after: float):
+    """先交付请求体，disconnect_after 秒后报告客户端断开"""
+    messages = [{"type": "http.request", "body": BODY, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(disconnect_after)
+        return {"type": "http.disconnect"}
+
+    return receive
+
+
+def _scope(method="POST", path="/generate_flashcards/"):
+    return {"type": "http", "method": method, "path": path, "headers": []}
+
+
+def test_disconnect_cancels_handler(monkeypatch):
+    """测试响应完成前客户端断开时取消处理任务，且应用仍能读到完整请求体"""
+    import disconnect
+
+    metrics = MetricsCollector()
+    monkeypatch.setattr(disconnect, "metrics_collector", metrics)
+    state = {}
+
+    async def app(scope, receive, send):
+        state["body"] = (await receive())["body"]
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        start = time.monotonic()
+        await CancelOnDisconnectMiddleware(app, enabled=True)(_scope(), _receive(0.05), send)
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(run())
+    assert elapsed < 1
+    assert state == {"body": BODY, "cancelled": True}
+    assert sent == []
+    assert metrics.get_metrics()["client_disconnects"] == 1
+
+
+def test_completed_responses_and_other_routes_are_untouched(monkeypatch):
+    """测试响应已发送完毕后的断开不计为取消，查询类请求直接透传"""
+    import disconnect
+
+    metrics = MetricsCollector()
+    monkeypatch.setattr(disconnect, "metrics_collector", metrics)
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["method"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    async def send(message):
+        pass
+
+    middleware = CancelOnDisconnectMiddleware(app, enabled=True)
+    asyncio.run(middleware(_scope(), _receive(0), send))
+    asyncio.run(middleware(_scope("GET", "/supported_models"), _receive(0), send))
+    assert calls == ["POST", "GET"]
+    assert metrics.get_metrics()["client_disconnects"] == 0
+
+
+def test_cancelled_generation_cancels_upstream_call(monkeypatch):
+    """测试生成请求被取消时上游调用随之取消并计入指标"""
+    import main_refactored
+
+    async def fake_validate(model_name):
+        return None
+
+    async def run():
+        server = MockUpstreamServer(response_delay=5)
+        await server.start()
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+        monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+        monkeypatch.setattr(main_refactored, "metrics_collector", MetricsCollector())
+        try:
+            task = asyncio.create_task(main_refactored.generate_flashcards_from_llm(
+                text_to_process=f"断开测试文本 {time.time()}",
+                user_api_key="test-key",
+                model_name=MODEL
+            ))
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if server.in_flight:
+                    break
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            return main_refactored.metrics_collector.get_metrics()
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+
+    metrics = asyncio.run(run())
+    assert metrics["upstream_calls_cancelled"] == {MODEL: 1}
@@ -0,0 +1,125 @@
+"""
+AI Flashcard Generator - 长文档模式测试
+验证分块、卡片预算分配与有界并发
+"""
+
+import asyncio
+import time
+
+import main_refactored
+from document_processor import (
+    allocate_card_budget,
+    chunk_size_for_context,
+    run_bounded,
+    split_document,
+)
+from main_refactored import FlashcardPair
+
+
+def _make_document(sections: int = 10, paragraphs: int = 6) -> str:
+    parts = []
+    for s in range(sections):
+        parts.append(f"# 第{s + 1}节 标题")
+        for p in range(paragraphs):
+            parts.append(f"第{s + 1}节第{p + 1}段。" + "光合作用将光能转化为化学能。" * 20)
+    return "\n\n".join(parts)
+
+
+def test_split_document_respects_chunk_size():
+    """测试分块不超过上限且不丢失段落"""
+    document = _make_document()
+    chunks = split_document(document, 2000)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 2000 for chunk in chunks)
+    assert sum(chunk.count("段。") for chunk in chunks) == document.count("段。")
+
+
+def test_split_document_aligns_to_headings():
+    """测试标题处优先断块"""
+    chunks = split_document(_make_document(sections=4, paragraphs=3), 3000)
+    assert all(chunk.startswith("# 第") for chunk in chunks)
+
+
+def test_split_document_splits_oversized_paragraph():
+    """测试超长段落按句子切分"""
+    paragraph = "这是一个很长的句子。" * 500
+    chunks = split_document(paragraph, 1000)
+    assert all(0 < len(chunk) <= 1000 for chunk in chunks)
+    assert "".join(chunks) == paragraph
+
+
+def test_chunk_size_for_context():
+    """测试分块大小随上下文长度变化"""
+    assert chunk_size_for_context(0, 8000) == 8000
+    assert chunk_size_for_context(1_000_000, 8000) == 8000
+    assert chunk_size_for_context(4096, 8000) == 2048
+    assert chunk_size_for_context(100, 8000) == 1000
+
+
+def test_allocate_card_budget():
+    """测试全局卡片预算按长度分配"""
+    chunks = ["a" * 100, "b" * 300, "c" * 600]
+    budgets = allocate_card_budget(chunks, 20)
+    assert sum(budgets) == 20
+    assert budgets[0] <= budgets[1] <= budgets[2]
+    assert min(budgets) >= 1
+
+    assert allocate_card_budget(chunks, 2) == [0, 1, 1]
+
+
+def test_run_bounded_limits_concurrency():
+    """测试信号量限制并发且结果按输入顺序返回"""
+    active = 0
+    peak = 0
+
+    async def worker(index, item):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        if item == "boom":
+            raise ValueError(item)
+        return item
+
+    results = asyncio.run(run_bounded(["a", "b", "boom", "c", "d"], worker, 2))
+    assert peak == 2
+    assert results[:2] == ["a", "b"]
+    assert isinstance(results[2], ValueError)
+
+
+def test_document_generation_wall_clock_is_bounded(monkeypatch):
+    """测试文档模式的耗时取决于最慢的分块而非分块数量"""
+    calls = []
+
+    async def fake_generate(text_to_process, user_api_key, model_name, max_cards=None, **kwargs):
+        calls.append(max_cards)
+        await asyncio.sleep(0.05)
+        cards = [FlashcardPair(q=f"{text_to_process[:12]}-{i}", a="答案") for i in range(max_cards)]
+        return cards, {'template_used': 'general'}
+
+    async def fake_validate(model_name):
+        return None
+
+    async def fake_get_all_models(force_refresh=False):
+        return {}
+
+    monkeypatch.setattr(main_refactored, "generate_flashcards_from_llm", fake_generate)
+    monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+    monkeypatch.setattr(main_refactored.model_manager, "get_all_models", fake_get_all_models)
+
+    document = _make_document(sections=12, paragraphs=10)
+    start = time.perf_counter()
+    cards, info = asyncio.run(main_refactored.generate_document_flashcards(
+        text=document,
+        user_api_key="test-key",
+        model_name="google/gemini-2.5-flash-preview",
+        max_cards=40,
+        max_concurrency=16
+    ))
+    elapsed = time.perf_counter() - start
+
+    assert info['chunks'] == len(calls) > 4
+    assert len(cards) == 40
+    assert elapsed < 0.05 * info['chunks'] / 2
@@ -0,0 +1,253 @@
+"""
+AI Flashcard Generator - 多租户加权公平排队与优先级通道测试
+"""
+
+import asyncio
+
+import pytest
+
+from fair_scheduler import (FairScheduler, SchedulerQueueTimeout, SchedulingMiddleware, current_priority,
+                            current_tenant, resolve_priority, resolve_tenant)
+
+
+async def _dispatch_order(scheduler: FairScheduler, submissions):
+    """占满名额后按顺序提交调用，返回各租户实际执行的顺序"""
+    order = []
+    gate = asyncio.Event()
+
+    async def blocker():
+        await gate.wait()
+
+    async def call(tenant):
+        order.append(tenant)
+        await asyncio.sleep(0)
+
+    first = asyncio.create_task(scheduler.run("blocker", blocker))
+    await asyncio.sleep(0)
+    tasks = []
+    for tenant in submissions:
+        tasks.append(asyncio.create_task(scheduler.run(tenant, lambda tenant=tenant: call(tenant))))
+        await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(first, *tasks)
+    return order
+
+
+def test_batch_tenant_does_not_starve_interactive_tenant():
+    """测试批量租户排满队列时，后到的交互式请求在下一个空出的名额执行"""
+    scheduler = FairScheduler(enabled=True, capacity=1, weights={}, default_weight=1.0, max_tenants=100,
+                              reserved_shares={}, headroom=0)
+
+    order = asyncio.run(_dispatch_order(scheduler, ["batch"] * 20 + ["interactive"]))
+    assert order.index("interactive") <= 1
+    stats = scheduler.get_stats()
+    assert stats["in_flight"] == 0 and stats["queued"] == 0
+    assert stats["tenants"]["batch"]["dispatched"] == 20
+
+
+def test_weights_share_slots_proportionally():
+    """测试加权轮询：权重为3的租户每轮获得三倍的名额"""
+    scheduler = FairScheduler(enabled=True, capacity=1, weights={"heavy": 3.0}, default_weight=1.0, max_tenants=100,
+                              reserved_shares={}, headroom=0)
+
+    order = asyncio.run(_dispatch_order(scheduler, ["heavy", "light"] * 12))
+    first_round = order[:8]
+    assert first_round.count("heavy") == 6
+    assert first_round.count("light") == 2
+
+
+def test_cancelled_waiter_leaves_queue():
+    """测试取消排队中的调用：等待者移出队列，名额不泄漏"""
+    scheduler = FairScheduler(enabled=True, capacity=1, weights={}, default_weight=1.0, max_tenants=100,
+                              reserved_shares={}, headroom=0)
+
+    async def run():
+        gate = asyncio.Event()
+        holder = asyncio.create_task(scheduler.run("a", gate.wait))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(scheduler.run("b", lambda: asyncio.sleep(0)))
+        await asyncio.sleep(0)
+        assert scheduler.get_stats()["queued"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.get_stats()["queued"] == 0
+        gate.set()
+        await holder
+        await scheduler.run("c", lambda: asyncio.sleep(0))
+
+    asyncio.run(run())
+    assert scheduler.in_flight == 0
+
+
+def test_tenant_resolution_and_middleware():
+    """测试租户识别：可信请求头优先，否则按API Key指纹，未配置请求头时忽略"""
+    assert resolve_tenant("sk-or-a") != resolve_tenant("sk-or-b")
+    assert resolve_tenant("sk-or-a").startswith("key:")
+    assert resolve_tenant(None) == "anonymous"
+    assert resolve_tenant("sk-or-a", tenant="tenant:acme") == "tenant:acme"
+
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(resolve_tenant("sk-or-a"))
+
+    async def call(middleware):
+        scope = {"type": "http", "path": "/generate_flashcards/", "headers": [(b"x-tenant-id", b"acme")]}
+        await middleware(scope, None, None)
+
+    asyncio.run(call(SchedulingMiddleware(app, header="X-Tenant-ID")))
+    asyncio.run(call(SchedulingMiddleware(app, header="")))
+    assert seen[0] == "tenant:acme"
+    assert seen[1] == resolve_tenant("sk-or-a")
+    assert current_tenant.get() is None
+
+
+def test_priority_classification_only_downgrades():
+    """测试优先级按接口划分，请求头只能降低优先级"""
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(resolve_priority())
+
+    async def call(path, priority=None):
+        headers = [(b"x-request-priority", priority.encode())] if priority else []
+        await SchedulingMiddleware(app, header="")({"type": "http", "path": path, "headers": headers}, None, None)
+
+    asyncio.run(call("/generate_flashcards/"))
+    asyncio.run(call("/generate_flashcards/", "background"))
+    asyncio.run(call("/generate_flashcards/batch"))
+    asyncio.run(call("/generate_flashcards/batch", "interactive"))
+    asyncio.run(call("/jobs", "background"))
+    assert seen == ["interactive", "background", "batch", "batch", "background"]
+    assert current_priority.get() is None
+    assert resolve_priority("batch") == "batch"
+
+
+def test_interactive_lane_reclaims_borrowed_capacity():
+    """测试批量请求可借用空闲名额，但留出余量且归还的名额优先交给交互式请求"""
+    scheduler = FairScheduler(enabled=True, capacity=4, weights={}, default_weight=1.0, max_tenants=100,
+                              reserved_shares={"interactive": 0.5, "batch": 0.25}, headroom=1)
+    started = []
+
+    async def run():
+        gate = asyncio.Event()
+
+        async def call(name):
+            started.append(name)
+            await gate.wait()
+
+        batch = [asyncio.create_task(scheduler.run("pipeline", lambda: call("batch"), priority="batch"))
+                 for _ in range(6)]
+        await asyncio.sleep(0)
+        # 空闲时批量请求可以借用交互式保留的名额，但留出1个余量
+        lanes = scheduler.get_stats()["lanes"]
+        assert lanes["batch"]["in_flight"] == 3 and lanes["batch"]["queued"] == 3
+
+        ui = [asyncio.create_task(scheduler.run("ui", lambda: call("ui"))) for _ in range(3)]
+        await asyncio.sleep(0)
+        # 余量名额立即交给交互式请求
+        assert started == ["batch"] * 3 + ["ui"]
+        gate.set()
+        await asyncio.gather(*batch, *ui)
+
+    asyncio.run(run())
+    # 批量请求归还的名额先交给排队的交互式请求
+    assert started[4:6] == ["ui", "ui"]
+    stats = scheduler.get_stats()
+    assert stats["in_flight"] == 0 and stats["queued"] == 0
+    assert stats["lanes"]["batch"]["borrowed"] > 0
+
+
+def test_batch_reservation_is_not_starved():
+    """测试交互式请求持续排队时，批量通道仍能获得其保留名额"""
+    scheduler = FairScheduler(enabled=True, capacity=4, weights={}, default_weight=1.0, max_tenants=100,
+                              reserved_shares={"batch": 0.25}, headroom=0)
+    started = []
+
+    async def run():
+        gate = asyncio.Event()
+
+        async def call(name):
+            started.append(name)
+            await gate.wait()
+
+        ui = [asyncio.create_task(scheduler.run("ui", lambda: call("ui"))) for _ in range(8)]
+        await asyncio.sleep(0)
+        batch = asyncio.create_task(scheduler.run("pipeline", lambda: call("batch"), priority="batch"))
+        await asyncio.sleep(0)
+        assert started == ["ui"] * 4
+        gate.set()
+        await asyncio.gather(batch, *ui)
+
+    asyncio.run(run())
+    # 第一个交互式请求完成后，批量请求先于剩余的交互式请求获得名额
+    assert started.index("batch") == 4
+
+
+def test_queued_calls_time_out_within_the_request_budget():
+    """测试排队超过 queue_timeout 或调用方剩余预算时以 SchedulerQueueTimeout 失败，名额与队列不泄漏"""
+    scheduler = FairScheduler(enabled=True, capacity=1, weights={}, default_weight=1.0, max_tenants=100,
+                              reserved_shares={}, headroom=0, queue_timeout=0.05)
+
+    async def run():
+        gate = asyncio.Event()
+        holder = asyncio.create_task(scheduler.run("a", gate.wait))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerQueueTimeout):
+            await scheduler.run("b", lambda: asyncio.sleep(0))
+        # 调用方剩余预算小于 queue_timeout 时按剩余预算等待
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        with pytest.raises(SchedulerQueueTimeout):
+            await scheduler.run("b", lambda: asyncio.sleep(0), timeout=0.01)
+        assert loop.time() - start < 0.05
+        gate.set()
+        await holder
+        await scheduler.run("c", lambda: asyncio.sleep(0))
+
+    asyncio.run(run())
+    stats = scheduler.get_stats()
+    assert stats["in_flight"] == 0 and stats["queued"] == 0
+    assert stats["queue_timeout"] == 0.05
+    assert stats["timed_out"] == 2 and stats["lanes"]["interactive"]["timed_out"] == 2
+
+
+def test_generation_queue_time_counts_against_the_retry_budget(monkeypatch):
+    """测试生成请求在公平队列中的等待计入重试预算：排队超出预算时返回503 UPSTREAM_BUSY，否则上游只获得剩余预算"""
+    import main_refactored
+    from fastapi import HTTPException
+    from retry_policy import RetryPolicy
+
+    scheduler = FairScheduler(enabled=True, capacity=1, weights={}, default_weight=1.0, max_tenants=100,
+                              reserved_shares={}, headroom=0, queue_timeout=10)
+    budgets = []
+
+    async def fake_fetch(model_name, payload, headers, processing_info, user_api_key=None, budget=None):
+        budgets.append(budget)
+        return [], {}
+
+    monkeypatch.setattr(main_refactored, "fair_scheduler", scheduler)
+    monkeypatch.setattr(main_refactored, "upstream_retry", RetryPolicy(max_attempts=1, budget=0.3))
+    monkeypatch.setattr(main_refactored, "_fetch_flashcards", fake_fetch)
+
+    def generate(index):
+        return main_refactored._generate_with_model(
+            "budget/model", "system", f"排队预算测试 {index}", {}, "sk-or-budget", use_cache=False
+        )
+
+    async def run():
+        gate = asyncio.Event()
+        holder = asyncio.create_task(scheduler.run("other", gate.wait))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as busy:
+            await generate(1)
+        asyncio.get_running_loop().call_later(0.1, gate.set)
+        await generate(2)
+        await holder
+        return busy.value
+
+    busy = asyncio.run(run())
+    assert busy.status_code == 503 and busy.detail["error_code"] == "UPSTREAM_BUSY"
+    assert len(budgets) == 1 and 0 < budgets[0] <= 0.2 + 0.02
+    assert scheduler.get_stats()["timed_out"] == 1
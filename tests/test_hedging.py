@@ -0,0 +1,233 @@
+"""
+AI Flashcard Generator - 对冲请求测试
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from hedging import HedgingPolicy, LatencyTracker
+
+
+def _policy(enabled: bool = True, min_delay: float = 0.01, min_samples: int = 5,
+            max_fraction: float = 1.0, window: int = 100) -> HedgingPolicy:
+    """已积累10个20ms延迟样本（"model" 键）的对冲策略"""
+    policy = HedgingPolicy(enabled=enabled, quantile=0.95, min_delay=min_delay, min_samples=min_samples,
+                           max_fraction=max_fraction, window=window)
+    for _ in range(10):
+        policy.latencies.record("model", 0.02)
+    return policy
+
+
+def test_latency_tracker_quantile():
+    """测试分位数估算"""
+    tracker = LatencyTracker(window=100)
+    for i in range(1, 101):
+        tracker.record("m", i / 100)
+    assert tracker.quantile("m", 0.95) == 0.96
+    assert tracker.quantile("other", 0.95) is None
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    """测试首个请求超过阈值时发出对冲，对冲获胜后取消慢请求"""
+    policy = _policy()
+    cancelled = []
+    delays = [1.0, 0.01]
+
+    async def attempt():
+        delay = delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return delay
+
+    start = time.monotonic()
+    result = asyncio.run(policy.run("model", attempt))
+    assert result == 0.01
+    assert time.monotonic() - start < 0.5
+    assert cancelled == [1.0]
+    stats = policy.get_stats()
+    assert stats["hedges_sent"] == 1 and stats["hedge_wins"] == 1 and stats["extra_requests"] == 1
+
+
+def test_no_hedge_without_enough_samples_or_when_disabled():
+    """测试样本不足或未开启时不对冲"""
+    async def attempt():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    for policy in (_policy(min_samples=50), _policy(enabled=False)):
+        assert asyncio.run(policy.run("model", attempt)) == "ok"
+        assert policy.get_stats()["hedges_sent"] == 0
+
+
+def test_failed_attempt_does_not_win():
+    """测试先完成但失败的请求不会获胜，采用另一方的成功结果"""
+    policy = _policy()
+    outcomes = [("slow-fail", 0.05), ("ok", 0.1)]
+
+    async def attempt():
+        outcome, delay = outcomes.pop(0)
+        await asyncio.sleep(delay)
+        if outcome == "slow-fail":
+            raise RuntimeError("primary failed")
+        return outcome
+
+    assert asyncio.run(policy.run("model", attempt)) == "ok"
+    assert policy.get_stats()["hedge_wins"] == 1
+
+    failing = _policy()
+
+    async def always_fail():
+        await asyncio.sleep(0.03)
+        raise RuntimeError("both failed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(failing.run("model", always_fail))
+
+
+def test_externally_cancelled_attempt_does_not_fail_the_call():
+    """测试某个尝试被外部取消（而非调用方取消）时，采用另一方的结果而不是抛出 CancelledError"""
+    policy = _policy()
+    delays = [0.1, None]
+
+    async def attempt():
+        delay = delays.pop(0)
+        if delay is None:
+            asyncio.current_task().cancel()
+            await asyncio.sleep(1)
+        await asyncio.sleep(delay)
+        return "primary"
+
+    assert asyncio.run(policy.run("model", attempt)) == "primary"
+    stats = policy.get_stats()
+    assert stats["hedges_sent"] == 1 and stats["primary_wins"] == 1
+
+
+def test_hedge_fraction_is_capped():
+    """测试对冲请求占比不超过上限"""
+    policy = _policy(max_fraction=0.2, window=1000)
+    for _ in range(1000):
+        policy.latencies.record("model", 0.01)
+
+    async def attempt():
+        await asyncio.sleep(0.03)
+        return "ok"
+
+    async def run():
+        for _ in range(20):
+            await policy.run("model", attempt)
+
+    asyncio.run(run())
+    stats = policy.get_stats()
+    assert stats["hedges_sent"] <= 4
+    assert stats["skipped_budget"] == 20 - stats["hedges_sent"]
+
+
+def test_discard_releases_losing_result():
+    """测试落败但已成功的结果会被释放（如关闭流式响应）"""
+    policy = _policy()
+    discarded = []
+    delays = [0.05, 0.0]
+
+    async def attempt():
+        delay = delays.pop(0)
+        await asyncio.sleep(delay)
+        return delay
+
+    async def discard(result):
+        discarded.append(result)
+
+    async def run():
+        result = await policy.run("model", attempt, discard=discard)
+        await asyncio.sleep(0.1)
+        return result
+
+    assert asyncio.run(run()) == 0.0
+    # 慢请求在对冲获胜时被取消，而非完成后被丢弃
+    assert discarded == []
+
+
+def test_generation_hedges_stalled_upstream(monkeypatch):
+    """测试生成请求在上游偶发卡顿时由对冲请求返回结果"""
+    import main_refactored
+    from mock_upstream import MockUpstreamServer
+
+    async def fake_validate(model_name):
+        return None
+
+    policy = _policy(min_delay=0.05)
+    for _ in range(10):
+        policy.latencies.record("hedge/test-model", 0.01)
+
+    async def run():
+        server = MockUpstreamServer(response_delays=[2.0])
+        await server.start()
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+        monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+        monkeypatch.setattr(main_refactored, "upstream_hedging", policy)
+        try:
+            start = time.monotonic()
+            cards, _ = await main_refactored.generate_flashcards_from_llm(
+                text_to_process=f"对冲测试文本 {time.time()}",
+                user_api_key="test-key",
+                model_name="hedge/test-model",
+                use_cache=False
+            )
+            elapsed = time.monotonic() - start
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return cards, elapsed
+
+    cards, elapsed = asyncio.run(run())
+    assert len(cards) == 2
+    assert elapsed < 1.0
+    assert policy.get_stats()["hedge_wins"] == 1
+
+
+def test_hedge_takes_its_own_bulkhead_slot(monkeypatch):
+    """测试对冲请求另占舱壁名额：舱壁已满时跳过对冲，有空闲名额时对冲且不超过上限"""
+    import main_refactored
+    from bulkhead import BulkheadRegistry
+    from mock_upstream import MockUpstreamServer
+
+    async def fake_validate(model_name):
+        return None
+
+    async def generate(limit):
+        policy = _policy(min_delay=0.05)
+        for _ in range(10):
+            policy.latencies.record("hedge/test-model", 0.01)
+        bulkheads = BulkheadRegistry(enabled=True, default_limit=limit, provider_limits={},
+                                     max_queue=10, queue_timeout=5, model_config=lambda model_name: None)
+        server = MockUpstreamServer(response_delays=[0.3])
+        await server.start()
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+        monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+        monkeypatch.setattr(main_refactored, "upstream_hedging", policy)
+        monkeypatch.setattr(main_refactored, "upstream_bulkheads", bulkheads)
+        try:
+            await main_refactored.generate_flashcards_from_llm(
+                text_to_process=f"对冲名额测试文本 {limit} {time.time()}",
+                user_api_key="test-key",
+                model_name="hedge/test-model",
+                use_cache=False
+            )
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        bulkhead = bulkheads.get("hedge/test-model")
+        assert bulkhead.in_flight == 0
+        return policy.get_stats(), bulkhead.peak_in_flight
+
+    stats, peak = asyncio.run(generate(1))
+    assert stats["hedges_sent"] == 0 and stats["skipped_capacity"] == 1
+    assert peak == 1
+
+    stats, peak = asyncio.run(generate(2))
+    assert stats["hedges_sent"] == 1 and stats["hedge_wins"] == 1
+    assert peak == 2
@@ -0,0 +1,187 @@
+"""
+AI Flashcard Generator - 异步任务队列测试
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+import main_refactored
+from job_queue import JobRunner, JobStore, WebhookURLError, validate_webhook_url
+from mock_upstream import MockUpstreamServer
+
+
+def test_job_resumes_unfinished_chunks_after_crash(tmp_path):
+    """测试worker崩溃后，任务由新的worker接管且只处理未完成的分块"""
+    store = JobStore(str(tmp_path / "jobs.db"))
+    processed = {"first": [], "second": []}
+
+    def make_processor(name, hang_on=None):
+        async def process(job, index, text, budget):
+            if index == hang_on:
+                await asyncio.Event().wait()
+            processed[name].append(index)
+            return {"flashcards": [{"q": f"问题{index}", "a": text}], "processing_info": {}}
+        return process
+
+    async def run():
+        job_id = await store.create({"model_name": "m", "max_concurrency": 1}, "key", None,
+                                    ["块0", "块1", "块2"], [None, None, None])
+
+        # 第一个worker处理完分块0后卡在分块1，随后进程"崩溃"（不归还租约）
+        first = JobRunner(store, make_processor("first", hang_on=1), workers=1, lease_seconds=0.3, poll_interval=0.05)
+        first.start()
+        await asyncio.sleep(0.2)
+        for task in first._tasks:
+            task.cancel()
+        await asyncio.gather(*first._tasks, return_exceptions=True)
+
+        # 租约过期后第二个worker接管
+        second = JobRunner(store, make_processor("second"), workers=1, lease_seconds=0.3, poll_interval=0.05)
+        second.start()
+        for _ in range(100):
+            job = await store.get(job_id)
+            if job["status"] == "completed":
+                break
+            await asyncio.sleep(0.05)
+        await second.stop()
+        return job, second.stats
+
+    job, stats = asyncio.run(run())
+    store.close()
+    assert processed["first"] == [0]
+    assert processed["second"] == [1, 2]
+    assert job["status"] == "completed"
+    assert [chunk["status"] for chunk in job["chunks"]] == ["done"] * 3
+    assert stats["jobs_resumed"] == 1
+
+
+def test_job_stops_processing_after_losing_its_lease(tmp_path):
+    """测试心跳发现租约已丢失后，worker在当前分块完成后停止，不再处理剩余分块，也不结束任务"""
+    store = JobStore(str(tmp_path / "jobs.db"))
+    processed = []
+
+    async def process(job, index, text, budget):
+        await asyncio.sleep(0.05)
+        processed.append(index)
+        return {"flashcards": [{"q": f"问题{index}", "a": text}], "processing_info": {}}
+
+    async def lost_renew(job_id, owner, lease_seconds):
+        return False
+
+    async def run():
+        job_id = await store.create({"model_name": "m", "max_concurrency": 1}, "key", None,
+                                    ["块0", "块1", "块2", "块3"], [None] * 4)
+        runner = JobRunner(store, process, workers=1, lease_seconds=0.06, poll_interval=0.05)
+        job = await store.claim(runner.owner, runner.lease_seconds, runner.max_attempts)
+        # 模拟租约过期后被其他worker接管：续约失败
+        store.renew = lost_renew
+        await runner._run_job(job)
+        return await store.get(job_id), runner.stats
+
+    job, stats = asyncio.run(run())
+    store.close()
+    assert processed == [0]
+    assert job["status"] == "running"
+    assert [chunk["status"] for chunk in job["chunks"]] == ["done", "pending", "pending", "pending"]
+    assert stats["jobs_lost"] == 1 and stats["jobs_completed"] == 0
+
+
+def test_job_api_submit_poll_and_webhook(monkeypatch, tmp_path):
+    """测试提交任务后立即返回，轮询得到结果，并回调webhook"""
+    async def fake_validate(model_name):
+        return None
+
+    async def fake_get_all_models():
+        return {}
+
+    async def run():
+        upstream = MockUpstreamServer(response_delay=0.02)
+        webhook = MockUpstreamServer()
+        await upstream.start()
+        await webhook.start()
+
+        store = JobStore(str(tmp_path / "jobs.db"))
+        runner = JobRunner(store, workers=1, poll_interval=0.05)
+        runner.configure(main_refactored._process_job_chunk, main_refactored._build_job_result)
+        monkeypatch.setattr(main_refactored, "job_store", store)
+        monkeypatch.setattr(main_refactored, "job_runner", runner)
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", upstream.chat_url)
+        monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+        monkeypatch.setattr(main_refactored.model_manager, "get_all_models", fake_get_all_models)
+        # 本地模拟的webhook接收端需显式加入允许列表
+        monkeypatch.setenv("JOB_WEBHOOK_ALLOWED_HOSTS", "127.0.0.1")
+        runner.start()
+        try:
+            transport = httpx.ASGITransport(app=main_refactored.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                submitted = await client.post("/jobs", json={
+                    "text": "异步任务测试文本",
+                    "api_key": "test-key",
+                    "model_name": "google/gemini-2.5-flash-preview",
+                    "webhook_url": webhook.chat_url
+                })
+                status = None
+                for _ in range(100):
+                    status = (await client.get(submitted.json()["status_url"])).json()
+                    if status["status"] == "completed" and status["processing_info"]["webhook_status"] == "delivered":
+                        break
+                    await asyncio.sleep(0.05)
+                missing = await client.get("/jobs/does-not-exist")
+        finally:
+            await runner.stop()
+            store.close()
+            await upstream.stop()
+            await webhook.stop()
+            await main_refactored.upstream_client.shutdown()
+        return submitted, status, missing, webhook.requests_served
+
+    submitted, status, missing, webhooks = asyncio.run(run())
+    assert submitted.status_code == 202
+    assert submitted.json()["chunks"] == 1
+    assert status["status"] == "completed"
+    assert status["cards_generated"] == 2
+    assert status["progress"] == {"chunks": 1, "completed": 1, "failed": 0, "pending": 0}
+    assert webhooks == 1
+    assert missing.status_code == 404
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://example.com/hook",
+    "http://127.0.0.1:8000/hook",
+    "http://localhost/hook",
+    "http://10.0.0.5/hook",
+    "http://192.168.1.1/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[::1]/hook",
+    "http://[::ffff:10.0.0.1]/hook",
+    "http://0.0.0.0/hook",
+])
+def test_webhook_url_rejects_internal_addresses(url):
+    """测试webhook地址不能指向内网、本机、链路本地或元数据地址"""
+    with pytest.raises(WebhookURLError):
+        asyncio.run(validate_webhook_url(url))
+
+
+def test_webhook_allowlist_and_submit_rejection(monkeypatch):
+    """测试配置允许列表后只放行列出的主机；提交指向内网的webhook返回400"""
+    monkeypatch.setenv("JOB_WEBHOOK_ALLOWED_HOSTS", "hooks.internal,127.0.0.1")
+    asyncio.run(validate_webhook_url("http://127.0.0.1:9000/hook"))
+    with pytest.raises(WebhookURLError):
+        asyncio.run(validate_webhook_url("https://example.com/hook"))
+    monkeypatch.delenv("JOB_WEBHOOK_ALLOWED_HOSTS")
+
+    async def run():
+        transport = httpx.ASGITransport(app=main_refactored.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/jobs", json={
+                "text": "异步任务测试文本",
+                "api_key": "test-key",
+                "model_name": "google/gemini-2.5-flash-preview",
+                "webhook_url": "http://169.254.169.254/latest/meta-data/"
+            })
+
+    response = asyncio.run(run())
+    assert response.status_code == 400
+    assert "内网" in response.json()["detail"]
@@ -0,0 +1,143 @@
+"""
+AI Flashcard Generator - 备用模型链测试
+"""
+
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from config.health import MetricsCollector
+from mock_upstream import MockUpstreamServer
+from retry_policy import RetryPolicy
+
+PRIMARY = "google/gemini-2.5-flash-preview"
+FALLBACKS = ["openai/gpt-4.1-mini", "anthropic/claude-3-haiku"]
+
+
+def _patch_upstream(monkeypatch, main_refactored, server):
+    async def fake_validate(model_name):
+        return None
+
+    monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+    monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+    # 不重试，直接观察模型切换
+    monkeypatch.setattr(main_refactored, "upstream_retry", RetryPolicy(max_attempts=1, budget=5))
+    monkeypatch.setattr(main_refactored, "metrics_collector", MetricsCollector())
+
+
+def test_falls_back_in_order_on_transient_errors(monkeypatch):
+    """测试主模型与第一个备用模型不可用时按顺序切换，并报告实际使用的模型"""
+    import main_refactored
+
+    async def run():
+        server = MockUpstreamServer(failing_models={PRIMARY: 503, FALLBACKS[0]: 429})
+        await server.start()
+        _patch_upstream(monkeypatch, main_refactored, server)
+        try:
+            cards, info = await main_refactored.generate_flashcards_from_llm(
+                text_to_process=f"备用模型测试文本 {time.time()}",
+                user_api_key="test-key",
+                model_name=PRIMARY,
+                use_cache=False,
+                fallback_models=FALLBACKS
+            )
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return cards, info, server.models_requested, main_refactored.metrics_collector.get_metrics()
+
+    cards, info, requested, metrics = asyncio.run(run())
+    assert len(cards) == 2
+    assert requested == [PRIMARY, FALLBACKS[0], FALLBACKS[1]]
+    assert info["model_used"] == FALLBACKS[1]
+    assert info["model_requested"] == PRIMARY
+    assert [attempt["status_code"] for attempt in info["fallbacks"]] == [503, 429]
+    assert metrics["model_fallbacks"] == {PRIMARY: {FALLBACKS[0]: 1}, FALLBACKS[0]: {FALLBACKS[1]: 1}}
+
+
+def test_credential_errors_do_not_fall_back(monkeypatch):
+    """测试401等与模型无关的错误不切换备用模型"""
+    import main_refactored
+
+    async def run():
+        server = MockUpstreamServer(failing_models={PRIMARY: 401})
+        await server.start()
+        _patch_upstream(monkeypatch, main_refactored, server)
+        try:
+            with pytest.raises(HTTPException) as exc_info:
+                await main_refactored.generate_flashcards_from_llm(
+                    text_to_process=f"备用模型测试文本 {time.time()}",
+                    user_api_key="bad-key",
+                    model_name=PRIMARY,
+                    use_cache=False,
+                    fallback_models=FALLBACKS
+                )
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return exc_info.value, server.models_requested
+
+    error, requested = asyncio.run(run())
+    assert error.status_code == 401
+    assert requested == [PRIMARY]
+
+
+def test_template_fallbacks_are_checked_against_model_list(monkeypatch):
+    """测试模板配置的备用模型按模型列表过滤、去重，请求指定的备用模型优先"""
+    import main_refactored
+    from prompt_manager import CustomPromptTemplate, prompt_manager
+
+    async def fake_models():
+        return {PRIMARY: {}, FALLBACKS[0]: {}, FALLBACKS[1]: {}}
+
+    monkeypatch.setattr(main_refactored.model_manager, "get_all_models", fake_models)
+    prompt_manager.add_custom_template("fallback_test", CustomPromptTemplate(
+        name="备用模型测试",
+        description="备用模型测试模板",
+        system_prompt="生成抽认卡，最多{max_cards}张。",
+        user_prompt_template="请处理以下文本：{text}",
+        fallback_models=[PRIMARY, "retired/model", FALLBACKS[1], FALLBACKS[1]]
+    ))
+    try:
+        _, _, processing_info = main_refactored._build_prompts("测试文本", "fallback_test")
+        template_chain = asyncio.run(main_refactored._fallback_chain(PRIMARY, None, processing_info))
+        request_chain = asyncio.run(main_refactored._fallback_chain(PRIMARY, [FALLBACKS[0]], processing_info))
+    finally:
+        prompt_manager.remove_template("fallback_test")
+
+    assert template_chain == [FALLBACKS[1]]
+    assert request_chain == [FALLBACKS[0]]
+
+
+def test_stream_falls_back_before_first_token(monkeypatch):
+    """测试流式生成在收到首个token前切换备用模型"""
+    import main_refactored
+
+    async def run():
+        server = MockUpstreamServer(failing_models={PRIMARY: 502})
+        await server.start()
+        _patch_upstream(monkeypatch, main_refactored, server)
+        text = f"流式备用模型测试文本 {time.time()}"
+        system_prompt, user_prompt, processing_info = main_refactored._build_prompts(text)
+        try:
+            cards = [card async for card in main_refactored.stream_flashcards_from_llm(
+                text_to_process=text,
+                user_api_key="test-key",
+                model_name=PRIMARY,
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                processing_info=processing_info,
+                use_cache=False,
+                fallback_chain=[FALLBACKS[0]]
+            )]
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return cards, processing_info
+
+    cards, info = asyncio.run(run())
+    assert len(cards) == 2
+    assert info["model_used"] == FALLBACKS[0]
+    assert info["fallbacks"][0]["model"] == PRIMARY
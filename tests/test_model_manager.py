@@ -0,0 +1,305 @@
+"""
+AI Flashcard Generator - 模型元数据持久化测试
+"""
+
+import asyncio
+import json
+import os
+import time
+
+from mock_upstream import MockUpstreamServer
+from model_manager import CatalogFetch, ModelManager, OpenRouterModel
+
+KNOWN = "google/gemini-2.5-flash-preview"
+DISCOVERED = "openai/gpt-4o-mini"
+
+
+def _manager(tmp_path, models=(KNOWN,), save_delay=0.05, age=0) -> ModelManager:
+    metadata_file = tmp_path / "metadata.json"
+    metadata_file.write_text(json.dumps({
+        KNOWN: {"suggested_use": "快速响应", "status": "verified", "last_updated": "2025-01-01"}
+    }), encoding="utf-8")
+    cache_file = tmp_path / "cache.json"
+    cache_file.write_text(json.dumps({
+        "models": [{"id": model_id, "name": model_id, "context_length": 1000} for model_id in models],
+        "timestamp": time.time() - age
+    }), encoding="utf-8")
+    return ModelManager(metadata_file=str(metadata_file), cache_file=str(cache_file), save_delay=save_delay)
+
+
+def test_unchanged_catalog_is_not_rewritten(tmp_path):
+    """测试元数据未变化时，重复获取模型列表不会写盘"""
+    manager = _manager(tmp_path)
+    before = os.stat(manager.metadata_file).st_mtime_ns
+
+    async def run():
+        for _ in range(50):
+            models = await manager.get_all_models()
+            assert KNOWN in models
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert manager.persistence_stats["writes"] == 0
+    assert os.stat(manager.metadata_file).st_mtime_ns == before
+
+
+def test_changes_are_coalesced_into_one_atomic_write(tmp_path):
+    """测试防抖时间内的多次修改合并为一次原子写入，退出时写入剩余修改"""
+    manager = _manager(tmp_path, models=(KNOWN, DISCOVERED))
+
+    async def run():
+        await manager.get_all_models()
+        assert manager.update_model_metadata(KNOWN, {"quality_rating": 5})
+        assert manager.update_model_metadata(KNOWN, {"local_notes": "已验证"})
+        assert manager.persistence_stats["writes"] == 0
+        await asyncio.sleep(0.2)
+        assert manager.persistence_stats["writes"] == 1
+
+        manager.update_model_metadata(DISCOVERED, {"status": "testing"})
+        await manager.close()
+
+    asyncio.run(run())
+    assert manager.persistence_stats["writes"] == 2
+    assert manager.get_sync_status()["metadata_persistence"]["pending_changes"] == 0
+    with open(manager.metadata_file, encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved[KNOWN]["quality_rating"] == 5 and saved[KNOWN]["local_notes"] == "已验证"
+    assert saved[DISCOVERED]["status"] == "testing"
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_catalog_snapshot_is_reused_until_inputs_change(tmp_path):
+    """测试目录快照在API缓存与元数据未变化时复用，修改元数据或同步后重建"""
+    manager = _manager(tmp_path, models=(KNOWN, DISCOVERED))
+
+    async def run():
+        first = await manager.get_all_models()
+        snapshot = manager.get_snapshot()
+        assert await manager.get_all_models() is first
+        assert snapshot.is_active(KNOWN) and DISCOVERED in snapshot
+
+        manager.update_model_metadata(DISCOVERED, {"status": "deprecated"})
+        updated = manager.get_snapshot()
+        assert updated.version == snapshot.version + 1
+        assert not updated.is_active(DISCOVERED)
+        assert list(manager.get_supported_models_legacy_format()) == [KNOWN]
+
+        await manager.close()
+
+    asyncio.run(run())
+
+
+def test_expired_catalog_is_served_stale_while_refreshing(tmp_path):
+    """测试缓存过期时请求不等待刷新；刷新失败或返回空列表时保留原数据，成功后替换"""
+    manager = _manager(tmp_path, models=(KNOWN, DISCOVERED), age=3610)
+    responses = [CatalogFetch(), RuntimeError("upstream down"),
+                 CatalogFetch(models=[OpenRouterModel(id=KNOWN, name="Gemini Flash")])]
+    gate = asyncio.Event()
+
+    async def fake_fetch():
+        await gate.wait()
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    manager._fetch_models = fake_fetch
+
+    async def run():
+        start = time.monotonic()
+        models = await manager.get_all_models()
+        assert time.monotonic() - start < 0.05
+        assert set(models) == {KNOWN, DISCOVERED}
+        status = manager.get_sync_status()
+        assert status["refresh"]["in_progress"] and status["staleness_seconds"] >= 10
+
+        gate.set()
+        await manager._refresh_task
+        assert not await manager.refresh()
+        assert set(await manager.get_all_models()) == {KNOWN, DISCOVERED}
+        assert manager.local_metadata[DISCOVERED].status == "new"
+        assert manager.refresh_stats["consecutive_failures"] == 2
+        assert manager.refresh_stats["last_error"] == "upstream down"
+
+        # 仍然过期：上面的调用已在后台发起下一次刷新
+        await manager._refresh_task
+        models = await manager.get_all_models()
+        assert models[KNOWN].name == "Gemini Flash"
+        assert manager.local_metadata[DISCOVERED].status == "deprecated"
+        await manager.close()
+
+    asyncio.run(run())
+    status = manager.get_sync_status()
+    assert status["cache_valid"] and status["staleness_seconds"] == 0
+    assert status["refresh"]["consecutive_failures"] == 0 and status["refresh"]["failures"] == 2
+    with open(manager.cache_file, encoding="utf-8") as f:
+        assert [model["id"] for model in json.load(f)["models"]] == [KNOWN]
+
+
+def test_concurrent_refreshes_fetch_once_across_workers(tmp_path):
+    """测试并发刷新在进程内合并为一次；另一个worker等待文件锁后直接采用刚写入的缓存文件"""
+    leader = _manager(tmp_path, models=(KNOWN,), age=3610)
+    # 共享同一缓存文件的第二个实例：flock 按打开的文件描述计算，与另一个进程的效果相同
+    other = ModelManager(metadata_file=leader.metadata_file, cache_file=leader.cache_file, save_delay=0.05)
+    gate = asyncio.Event()
+    fetches = {"leader": 0, "other": 0}
+
+    def fake_fetch(name):
+        async def fetch():
+            fetches[name] += 1
+            await gate.wait()
+            return CatalogFetch(models=[OpenRouterModel(id=KNOWN, name="Gemini Flash")])
+        return fetch
+
+    leader._fetch_models = fake_fetch("leader")
+    other._fetch_models = fake_fetch("other")
+
+    async def run():
+        herd = [asyncio.create_task(leader.refresh()) for _ in range(20)]
+        for _ in range(5):
+            await leader.get_all_models()
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(other.refresh())
+        await asyncio.sleep(0.1)
+        gate.set()
+        assert all(await asyncio.gather(*herd))
+        assert await follower
+        await leader.close()
+        await other.close()
+
+    asyncio.run(run())
+    assert fetches == {"leader": 1, "other": 0}
+    assert other.get_snapshot().models[KNOWN].name == "Gemini Flash"
+    assert other.refresh_stats["adopted_from_file"] == 1
+    wait = leader.get_sync_status()["refresh"]["wait"]
+    assert wait["followers"] >= 19 and wait["follower_wait_max"] >= 0.1
+    assert other.get_sync_status()["refresh"]["wait"]["lock_waits"] == 1
+
+
+def test_conditional_sync_applies_model_level_diff(monkeypatch, tmp_path):
+    """测试条件请求与内容哈希跳过未变化的同步；有变化时只更新差异涉及的模型并记录差异"""
+    import model_manager as model_manager_module
+    from http_client import upstream_client
+
+    claude = "anthropic/claude-sonnet-4"
+    catalog = [
+        {"id": KNOWN, "name": "Gemini Flash", "pricing": {"prompt": "0.15"}, "context_length": 1048576},
+        {"id": claude, "name": "Claude Sonnet 4", "pricing": {"prompt": "3"}, "context_length": 200000},
+        {"id": "openai/dall-e-3", "name": "DALL-E 3"},
+    ]
+    manager = _manager(tmp_path, models=(KNOWN, DISCOVERED))
+    manager.local_metadata[DISCOVERED] = model_manager_module.ModelMetadata(suggested_use="经济实用")
+
+    async def run():
+        server = MockUpstreamServer(catalog=catalog)
+        await server.start()
+        monkeypatch.setattr(model_manager_module, "OPENROUTER_MODELS_URL", server.models_url)
+        try:
+            manager.get_snapshot()
+            assert await manager.refresh(force=True)
+            first = manager.get_snapshot()
+            diff = manager.get_sync_status()["last_diff"]
+            assert diff["added"] == [claude] and diff["removed"] == [DISCOVERED]
+            assert diff["changed"][KNOWN]["context_length"] == {"old": 1000, "new": 1048576}
+            assert first.models[KNOWN].context_length == 1048576
+            assert manager.local_metadata[claude].status == "new"
+            assert manager.local_metadata[DISCOVERED].status == "deprecated"
+            assert not first.is_active(DISCOVERED)
+
+            # 上游支持ETag时返回304；不支持时内容哈希相同，同样不更新快照
+            assert await manager.refresh(force=True)
+            server.catalog_etag = False
+            assert await manager.refresh(force=True)
+            assert manager.get_snapshot() is first
+
+            server.catalog[0] = {**catalog[0], "pricing": {"prompt": "0.1"}}
+            assert await manager.refresh(force=True)
+            second = manager.get_snapshot()
+            assert second.models[KNOWN].pricing == {"prompt": "0.1"}
+            assert second.models[claude] is first.models[claude]
+            return server.catalog_statuses
+        finally:
+            await server.stop()
+            await upstream_client.shutdown()
+            await manager.close()
+
+    statuses = asyncio.run(run())
+    assert statuses == [200, 304, 200, 200]
+    status = manager.get_sync_status()
+    assert status["refresh"]["not_modified"] == 2
+    assert status["last_diff"]["changed"] == {KNOWN: {"pricing": {"old": {"prompt": "0.15"}, "new": {"prompt": "0.1"}}}}
+    assert status["last_diff"]["added"] == [] and status["conditional_sync"]["content_hash"]
+
+
+def test_refresher_survives_unexpected_errors(monkeypatch, tmp_path):
+    """测试后台刷新遇到意外错误（如锁文件无法打开）时记录失败并继续重试，不会退出"""
+    import model_manager as model_manager_module
+
+    manager = _manager(tmp_path, age=3610)
+    manager.retry_interval = 0.01
+    adopt = manager._adopt_cache_file
+    errors = [RuntimeError("disk error")]
+
+    async def flaky_adopt(started_at, force):
+        if errors:
+            raise errors.pop(0)
+        return await adopt(started_at, force)
+
+    async def fake_fetch():
+        return CatalogFetch(models=[OpenRouterModel(id=KNOWN, name="Gemini Flash")])
+
+    real_open = os.open
+
+    def failing_open(path, *args, **kwargs):
+        if str(path).endswith(".lock"):
+            raise PermissionError("read-only file system")
+        return real_open(path, *args, **kwargs)
+
+    manager._adopt_cache_file = flaky_adopt
+    manager._fetch_models = fake_fetch
+    monkeypatch.setattr(model_manager_module.os, "open", failing_open)
+
+    async def run():
+        manager.start_refresher()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if manager.refresh_stats["last_success"]:
+                break
+        assert not manager._refresher.done()
+        await manager.stop_refresher()
+        await manager.close()
+
+    asyncio.run(run())
+    stats = manager.refresh_stats
+    assert stats["failures"] == 1 and stats["consecutive_failures"] == 0
+    assert manager.get_snapshot().models[KNOWN].name == "Gemini Flash"
+    assert manager.refresh_wait_stats["lock_errors"] >= 2
+
+
+def test_failed_write_only_restores_changed_entries(tmp_path):
+    """测试写盘失败时只把本次取出的已修改条目重新标记，之后成功写入"""
+    manager = _manager(tmp_path, models=(KNOWN, DISCOVERED), save_delay=60)
+    write = manager._write_metadata
+    outcomes = [False]
+
+    def flaky_write(data):
+        if outcomes:
+            manager.persistence_stats["failed_writes"] += 1
+            return outcomes.pop(0)
+        return write(data)
+
+    async def run():
+        await manager.get_all_models()
+        assert await manager.flush()
+        manager._write_metadata = flaky_write
+        manager.update_model_metadata(KNOWN, {"quality_rating": 4})
+        assert manager._dirty == {KNOWN}
+        assert not await manager.flush()
+        assert manager._dirty == {KNOWN}
+        assert await manager.flush()
+        await manager.close()
+
+    asyncio.run(run())
+    assert manager.persistence_stats["failed_writes"] == 1
+    with open(manager.metadata_file, encoding="utf-8") as f:
+        assert json.load(f)[KNOWN]["quality_rating"] == 4
@@ -0,0 +1,157 @@
+"""
+AI Flashcard Generator - 令牌桶限流测试
+"""
+
+import asyncio
+
+import httpx
+from fastapi import FastAPI, Request
+
+from rate_limiter import RateLimiter, RateLimitMiddleware, TokenBucketLimiter
+
+
+def test_token_bucket_refills_over_time():
+    """测试令牌耗尽后拒绝，并按补充速率恢复"""
+    limiter = TokenBucketLimiter(capacity=2, refill_rate=1.0, max_keys=10)
+    assert limiter.acquire("a", now=0)[0]
+    assert limiter.acquire("a", now=0)[0]
+    allowed, remaining, wait = limiter.acquire("a", now=0)
+    assert not allowed and remaining == 0 and wait == 1.0
+    # 其他键不受影响
+    assert limiter.acquire("b", now=0)[0]
+    assert limiter.acquire("a", now=1.0)[0]
+
+
+def test_idle_keys_are_evicted_and_memory_is_bounded():
+    """测试已回满的空闲桶被淘汰，键数量不超过上限"""
+    limiter = TokenBucketLimiter(capacity=10, refill_rate=10.0, max_keys=100)
+    for i in range(1000):
+        limiter.acquire(f"key-{i}", now=0)
+    assert len(limiter) == 100
+    # 1秒后旧桶都已回满，新键到来时被清理
+    limiter.acquire("fresh", now=2.0)
+    assert len(limiter) == 1
+    assert limiter.get_stats()["evicted"] == 1000
+
+
+def _app(limiter: RateLimiter) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+
+    @app.post("/generate_flashcards/")
+    async def generate(request: Request):
+        body = await request.json()
+        return {"api_key": body["api_key"]}
+
+    @app.get("/supported_models")
+    async def models():
+        return {"models": []}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+
+    return app
+
+
+def test_middleware_limits_by_api_key_and_ip():
+    """测试同一API Key跨IP共享额度、429带限流头，查询类请求与豁免路径独立计数"""
+    limiter = RateLimiter(enabled=True, generation_requests=2, read_requests=3, window=60,
+                          max_keys=1000, trust_proxy=True, exempt_paths=frozenset({"/health"}))
+
+    async def run():
+        transport = httpx.ASGITransport(app=_app(limiter))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            generations = []
+            for ip in ("10.0.0.1", "10.0.0.2", "10.0.0.3"):
+                generations.append(await client.post(
+                    "/generate_flashcards/",
+                    json={"text": "测试", "api_key": "sk-or-shared"},
+                    headers={"X-Forwarded-For": ip}
+                ))
+            other_key = await client.post(
+                "/generate_flashcards/",
+                json={"text": "测试", "api_key": "sk-or-other"},
+                headers={"X-Forwarded-For": "10.0.0.4"}
+            )
+            reads = [await client.get("/supported_models") for _ in range(4)]
+            health = [await client.get("/health") for _ in range(5)]
+        return generations, other_key, reads, health
+
+    generations, other_key, reads, health = asyncio.run(run())
+    assert [r.status_code for r in generations] == [200, 200, 429]
+    # 请求体被限流中间件读取后仍能完整交给应用
+    assert generations[0].json() == {"api_key": "sk-or-shared"}
+    assert generations[0].headers["X-RateLimit-Limit"] == "2"
+    assert generations[1].headers["X-RateLimit-Remaining"] == "0"
+    rejected = generations[2]
+    assert int(rejected.headers["Retry-After"]) >= 1
+    assert rejected.json()["detail"]["error_code"] == "RATE_LIMITED"
+    assert other_key.status_code == 200
+    assert [r.status_code for r in reads] == [200, 200, 200, 429]
+    assert all(r.status_code == 200 for r in health)
+    assert limiter.get_stats()["generation"]["rejected"] == 1
+
+
+def test_client_ip_only_trusts_headers_from_trusted_proxies():
+    """测试仅信任可信代理设置的IP头，X-Forwarded-For 取最右侧的非可信地址"""
+    limiter = RateLimiter(enabled=True, generation_requests=2, read_requests=2, window=60, max_keys=100,
+                          trust_proxy=True, trusted_proxies=["10.0.0.10", "192.168.0.0/24"],
+                          exempt_paths=frozenset())
+
+    def scope(peer, *headers):
+        return {"client": (peer, 40000), "headers": [(name, value) for name, value in headers]}
+
+    spoofed = (b"x-forwarded-for", b"1.1.1.1, 203.0.113.7, 192.168.0.5")
+    assert limiter.client_ip(scope("10.0.0.10", spoofed)) == "203.0.113.7"
+    assert limiter.client_ip(scope("10.0.0.10", (b"x-real-ip", b"203.0.113.8"), spoofed)) == "203.0.113.8"
+    # 直连客户端伪造的头部被忽略
+    assert limiter.client_ip(scope("198.51.100.1", (b"x-real-ip", b"1.1.1.1"), spoofed)) == "198.51.100.1"
+    assert RateLimiter(trust_proxy=False, trusted_proxies=["10.0.0.10"]).client_ip(
+        scope("10.0.0.10", (b"x-real-ip", b"1.1.1.1"))) == "10.0.0.10"
+
+
+def test_rejected_request_does_not_consume_other_buckets():
+    """测试API Key桶已耗尽时，被拒绝的请求不扣减IP桶"""
+    limiter = RateLimiter(enabled=True, generation_requests=2, read_requests=2, window=60, max_keys=100,
+                          trust_proxy=False, trusted_proxies=[], exempt_paths=frozenset())
+    assert limiter.check(True, "10.0.0.1", "sk-or-busy")[0]
+    assert limiter.check(True, "10.0.0.2", "sk-or-busy")[0]
+    for _ in range(5):
+        assert not limiter.check(True, "10.0.0.1", "sk-or-busy")[0]
+    allowed, headers = limiter.check(True, "10.0.0.1", "sk-or-other")
+    assert allowed and headers["X-RateLimit-Remaining"] == "0"
+    assert limiter.get_stats()["generation"]["rejected"] == 5
+
+
+def test_api_key_bucket_follows_body_key_not_headers():
+    """测试轮换请求头中的Key无法绕过按请求体 api_key 计数的额度，非生成接口的写请求按查询类计数"""
+    limiter = RateLimiter(enabled=True, generation_requests=2, read_requests=10, window=60, max_keys=1000,
+                          trust_proxy=True, trusted_proxies=["127.0.0.1"], exempt_paths=frozenset(),
+                          generation_paths=["/generate_flashcards"])
+    app = _app(limiter)
+
+    @app.post("/templates/{template_id}")
+    async def save_template(template_id: str):
+        return {"template_id": template_id}
+
+    async def run():
+        transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 40000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            generations = []
+            for i in range(3):
+                generations.append(await client.post(
+                    "/generate_flashcards/",
+                    json={"text": "测试", "api_key": "sk-or-fixed"},
+                    headers={"X-Forwarded-For": f"10.0.1.{i}", "X-API-Key": f"rotated-{i}",
+                             "Authorization": f"Bearer rotated-{i}"}
+                ))
+            templates = [await client.post("/templates/t1", headers={"X-Forwarded-For": "10.0.2.1"})
+                         for _ in range(3)]
+        return generations, templates
+
+    generations, templates = asyncio.run(run())
+    assert [r.status_code for r in generations] == [200, 200, 429]
+    assert all(r.status_code == 200 for r in templates)
+    assert templates[0].headers["X-RateLimit-Limit"] == "10"
+    assert limiter.get_stats()["generation"]["keys"] == 4
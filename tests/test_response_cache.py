@@ -0,0 +1,182 @@
+"""
+AI Flashcard Generator - 响应缓存测试
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import response_cache
+from response_cache import DiskCacheTier, ResponseCache, make_request_key
+
+
+def test_request_key_is_deterministic_and_complete():
+    """测试缓存键确定且覆盖完整请求身份"""
+    long_prompt = "系统提示词" * 50
+    key = make_request_key("model-a", long_prompt, "用户提示词", {"max_cards": 5})
+
+    assert key == make_request_key("model-a", long_prompt, "用户提示词", {"max_cards": 5})
+    assert len(key) == 64
+    # 模型、max_cards、用户提示词、系统提示词第100个字符之后的差异都会改变键
+    assert key != make_request_key("model-b", long_prompt, "用户提示词", {"max_cards": 5})
+    assert key != make_request_key("model-a", long_prompt, "用户提示词", {"max_cards": 6})
+    assert key != make_request_key("model-a", long_prompt, "另一段用户提示词", {"max_cards": 5})
+    assert key != make_request_key("model-a", long_prompt + "！", "用户提示词", {"max_cards": 5})
+
+
+def test_lru_eviction_by_entry_count():
+    """测试超出条目数上限时淘汰最久未使用的条目"""
+    cache = ResponseCache(max_entries=2, max_bytes=10_000, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # a 变为最近使用
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_eviction_by_byte_budget():
+    """测试超出字节预算时淘汰条目"""
+    cache = ResponseCache(max_entries=100, max_bytes=1000, ttl=60)
+    for i in range(10):
+        cache.set(f"k{i}", "x", size_bytes=300)
+
+    stats = cache.get_stats()
+    assert stats["entries"] == 3
+    assert stats["bytes"] <= 1000
+    assert cache.get("k9") == "x"
+
+    cache.set("huge", "y", size_bytes=5000)
+    assert cache.get("huge") is None
+
+
+def test_ttl_expiry_and_sweep():
+    """测试过期条目读取失效，并可被清扫"""
+    cache = ResponseCache(max_entries=100, max_bytes=100_000, ttl=0.01)
+    for i in range(5):
+        cache.set(f"k{i}", i)
+    cache.set("long", "kept", ttl=60)
+    time.sleep(0.02)
+
+    assert cache.get("k0") is None
+    assert cache.sweep() == 4
+    assert len(cache) == 1
+    assert cache.get("long") == "kept"
+
+    stats = cache.get_stats()
+    assert stats["expirations"] == 5
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_memory_stays_bounded_under_churn():
+    """测试大量不同请求写入后，占用始终不超过预算"""
+    cache = ResponseCache(max_entries=500, max_bytes=200_000, ttl=3600)
+    value = {"flashcards": [{"q": "问题" * 10, "a": "答案" * 40}] * 5, "processing_info": {}}
+    for i in range(20_000):
+        cache.set(make_request_key("model", "system", f"text {i}"), value)
+
+    stats = cache.get_stats()
+    assert stats["entries"] <= 500
+    assert stats["bytes"] <= 200_000
+    assert stats["evictions"] == 20_000 - stats["entries"]
+
+
+def test_disk_tier_survives_restart_and_promotes_to_memory(tmp_path):
+    """测试持久化层在重启后仍可命中，并回填内存缓存"""
+    path = str(tmp_path / "cache.db")
+    value = {"flashcards": [{"q": "问题", "a": "答案"}], "processing_info": {"template_used": "general"}}
+
+    async def run():
+        before = ResponseCache(max_entries=10, max_bytes=100_000, ttl=60, persistent=DiskCacheTier(path))
+        await before.store("key", value)
+        before.persistent.close()
+
+        after = ResponseCache(max_entries=10, max_bytes=100_000, ttl=60, persistent=DiskCacheTier(path))
+        assert len(after) == 0
+        result = await after.lookup("key")
+        promoted = "key" in after
+        missing = await after.lookup("other")
+        stats = after.get_stats()
+        after.persistent.close()
+        return result, promoted, missing, stats
+
+    result, promoted, missing, stats = asyncio.run(run())
+    assert result == value
+    assert promoted
+    assert missing is None
+    assert stats["persistent"]["hits"] == 1
+    assert stats["persistent"]["misses"] == 1
+
+
+def test_disk_tier_ttl_and_compaction(tmp_path):
+    """测试持久化层过期失效，压缩后占用回到容量上限以内并保留最近访问的条目"""
+    async def run():
+        tier = DiskCacheTier(str(tmp_path / "cache.db"), max_bytes=2000, ttl=60)
+        await tier.set("expiring", "x", ttl=0.01)
+        await asyncio.sleep(0.02)
+        expired = await tier.get("expiring")
+
+        for i in range(10):
+            await tier.set(f"k{i}", "x" * 300)
+        await asyncio.sleep(0.01)
+        await tier.get("k0")  # k0 变为最近访问
+        result = await tier.compact()
+        size = await tier.size()
+        kept = await tier.get("k0")
+        evicted = await tier.get("k1")
+        tier.close()
+        return expired, result, size, kept, evicted, tier.stats
+
+    expired, result, size, kept, evicted, tier_stats = asyncio.run(run())
+    assert expired is None
+    assert tier_stats["expirations"] == 1
+    assert result["evicted"] > 0
+    assert size["bytes"] <= 2000
+    assert kept == "x" * 300
+    assert evicted is None
+
+
+def test_disk_tier_drops_corrupt_entries(tmp_path):
+    """测试损坏的持久化条目按未命中处理、计入错误并被删除"""
+    async def run():
+        tier = DiskCacheTier(str(tmp_path / "cache.db"), max_bytes=100000, ttl=60)
+        await tier._run(tier._set_sync, "corrupt", '{"cards": [', 60)
+        first = await tier.get("corrupt")
+        size = await tier.size()
+        tier.close()
+        return first, size, tier.stats
+
+    first, size, stats = asyncio.run(run())
+    assert first is None
+    assert size["entries"] == 0
+    assert stats["errors"] == 1 and stats["hits"] == 0
+
+
+def test_shared_tier_is_visible_across_processes(tmp_path):
+    """测试另一个进程（不同hash盐）写入的条目在本进程可命中"""
+    path = str(tmp_path / "shared.db")
+    script = (
+        "import asyncio\n"
+        "from response_cache import DiskCacheTier, ResponseCache, make_request_key\n"
+        f"cache = ResponseCache(persistent=DiskCacheTier({path!r}))\n"
+        "key = make_request_key('model', 'system', 'text', {'max_cards': 5})\n"
+        "asyncio.run(cache.store(key, {'flashcards': [], 'processing_info': {'worker': 'other'}}))\n"
+        "cache.persistent.close()\n"
+    )
+    src_dir = os.path.dirname(os.path.abspath(response_cache.__file__))
+    env = {**os.environ, "PYTHONHASHSEED": "12345", "PYTHONPATH": src_dir}
+    subprocess.run([sys.executable, "-c", script], check=True, env=env, cwd=src_dir)
+
+    async def run():
+        cache = ResponseCache(persistent=DiskCacheTier(path))
+        value = await cache.lookup(make_request_key("model", "system", "text", {"max_cards": 5}))
+        cache.persistent.close()
+        return value
+
+    assert asyncio.run(run()) == {"flashcards": [], "processing_info": {"worker": "other"}}
@@ -0,0 +1,148 @@
+"""
+AI Flashcard Generator - 上游重试策略测试
+"""
+
+import asyncio
+import time
+from email.utils import formatdate
+
+import httpx
+import pytest
+
+from retry_policy import RetryPolicy, parse_retry_after
+
+
+def test_parse_retry_after():
+    """测试解析秒数与HTTP日期两种格式"""
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("not a date") is None
+    assert 8 <= parse_retry_after(formatdate(time.time() + 10, usegmt=True)) <= 10
+
+
+def test_retries_transient_errors_then_succeeds(status_error):
+    """测试可重试状态码按退避重试直到成功，退避不超过上限"""
+    policy = RetryPolicy(max_attempts=4, base_delay=0.01, max_delay=0.02, budget=5,
+                         retry_statuses=frozenset({429, 503}))
+    failures = [status_error(503), status_error(429)]
+    retries = []
+
+    async def attempt(remaining):
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    result = asyncio.run(policy.run(attempt, on_retry=lambda n, error, delay: retries.append(delay)))
+    assert result == "ok"
+    assert len(retries) == 2
+    assert all(0 <= delay <= 0.02 for delay in retries)
+
+
+def test_non_retryable_errors_are_raised_immediately(status_error):
+    """测试400与请求已送达后的超时不重试"""
+    policy = RetryPolicy(max_attempts=5, base_delay=0, max_delay=0, budget=5, retry_statuses=frozenset({503}))
+    calls = 0
+
+    async def run(error):
+        nonlocal calls
+        calls = 0
+
+        async def attempt(remaining):
+            nonlocal calls
+            calls += 1
+            raise error
+
+        with pytest.raises(type(error)):
+            await policy.run(attempt)
+        return calls
+
+    assert asyncio.run(run(status_error(400))) == 1
+    assert asyncio.run(run(httpx.ReadTimeout("read timeout"))) == 1
+    assert asyncio.run(run(httpx.ConnectError("refused"))) == 5
+
+
+def test_retry_after_is_honored_within_budget(status_error):
+    """测试遵循Retry-After；等待会超出总预算时直接失败"""
+    policy = RetryPolicy(max_attempts=3, base_delay=10, max_delay=10, budget=1,
+                         retry_statuses=frozenset({429}))
+    delays = []
+    failures = [status_error(429, retry_after="0.05")]
+
+    async def attempt(remaining):
+        assert remaining <= 1
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    assert asyncio.run(policy.run(attempt, on_retry=lambda n, error, delay: delays.append(delay))) == "ok"
+    assert delays == [0.05]
+
+    async def always_throttled(remaining):
+        raise status_error(429, retry_after="30")
+
+    start = time.monotonic()
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(policy.run(always_throttled))
+    assert time.monotonic() - start < 0.5
+
+
+def test_generation_recovers_from_transient_upstream_errors(monkeypatch):
+    """测试生成请求在上游返回503后自动重试成功，并按模型记录重试次数"""
+    import main_refactored
+    from config.health import MetricsCollector
+    from mock_upstream import MockUpstreamServer
+
+    async def fake_validate(model_name):
+        return None
+
+    async def run():
+        server = MockUpstreamServer(failures=[503, 502], retry_after="0")
+        await server.start()
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+        monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+        monkeypatch.setattr(main_refactored, "upstream_retry", RetryPolicy(
+            max_attempts=3, base_delay=0.01, max_delay=0.01, budget=5, retry_statuses=frozenset({502, 503})
+        ))
+        monkeypatch.setattr(main_refactored, "metrics_collector", MetricsCollector())
+        try:
+            cards, _ = await main_refactored.generate_flashcards_from_llm(
+                text_to_process=f"重试测试文本 {time.time()}",
+                user_api_key="test-key",
+                model_name="retry/test-model",
+                use_cache=False
+            )
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return cards, server.requests_served, main_refactored.metrics_collector.get_metrics()
+
+    cards, served, metrics = asyncio.run(run())
+    assert len(cards) == 2
+    assert served == 3
+    stats = metrics["upstream_retries"]["retry/test-model"]
+    assert stats["retries"] == 2
+    assert stats["recovered"] == 1
+    assert stats["reasons"] == {"503": 1, "502": 1}
+
+
+def test_no_attempt_starts_after_request_deadline(monkeypatch, status_error):
+    """测试默认重试预算受请求超时约束，截止时间之后不再发起尝试"""
+    monkeypatch.delenv("UPSTREAM_RETRY_BUDGET", raising=False)
+    monkeypatch.setenv("REQUEST_TIMEOUT", "60")
+    assert RetryPolicy().budget < 30
+    monkeypatch.setenv("REQUEST_TIMEOUT", "0.5")
+    policy = RetryPolicy(max_attempts=20, base_delay=0.02, max_delay=0.05, retry_statuses=frozenset({503}))
+    assert policy.budget == pytest.approx(0.45)
+    starts = []
+
+    async def attempt(remaining):
+        starts.append((time.monotonic(), remaining))
+        await asyncio.sleep(0.1)
+        raise status_error(503)
+
+    start = time.monotonic()
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(policy.run(attempt))
+    assert len(starts) >= 2
+    assert all(started < start + policy.budget and remaining > 0 for started, remaining in starts)
+    assert time.monotonic() - start < 0.5 + 0.1
@@ -0,0 +1,162 @@
+"""
+AI Flashcard Generator - 在途请求合并测试
+"""
+
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_duplicates_share_one_call():
+    """测试并发的相同请求只执行一次"""
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.do("key", fetch) for _ in range(10)))
+        return flights, results
+
+    flights, results = asyncio.run(run())
+    assert calls == 1
+    assert [value for value, _ in results] == ["result"] * 10
+    assert sum(1 for _, shared in results if shared) == 9
+    assert flights.get_stats()["coalesced"] == 9
+    assert flights.in_flight == 0
+
+
+def test_errors_propagate_to_all_waiters():
+    """测试上游异常传播给所有等待者"""
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        flights = SingleFlight()
+        return await asyncio.gather(*(flights.do("key", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_unshareable_error_makes_follower_retry():
+    """测试不可共享的错误会让follower用自己的调用重试"""
+    async def leader_fetch():
+        await asyncio.sleep(0.01)
+        raise PermissionError("invalid key")
+
+    async def follower_fetch():
+        return "own result"
+
+    async def run():
+        flights = SingleFlight()
+        share_error = lambda e: not isinstance(e, PermissionError)
+        return await asyncio.gather(
+            flights.do("key", leader_fetch, share_error=share_error),
+            flights.do("key", follower_fetch, share_error=share_error),
+            return_exceptions=True
+        )
+
+    leader_result, follower_result = asyncio.run(run())
+    assert isinstance(leader_result, PermissionError)
+    assert follower_result == ("own result", False)
+
+
+def test_cancellation_only_cancels_upstream_when_all_waiters_leave():
+    """测试单个等待者取消不影响其他等待者，全部取消时上游任务被取消"""
+    async def run():
+        flights = SingleFlight()
+        upstream_cancelled = asyncio.Event()
+
+        async def fetch():
+            try:
+                await asyncio.sleep(0.05)
+                return "done"
+            except asyncio.CancelledError:
+                upstream_cancelled.set()
+                raise
+
+        first = asyncio.create_task(flights.do("a", fetch))
+        second = asyncio.create_task(flights.do("a", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == ("done", True)
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        lonely = asyncio.create_task(flights.do("b", fetch))
+        await asyncio.sleep(0)
+        lonely.cancel()
+        await asyncio.sleep(0.01)
+        return upstream_cancelled.is_set(), flights.get_stats()
+
+    cancelled, stats = asyncio.run(run())
+    assert cancelled
+    assert stats["cancelled"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_detached_flight_finishes_without_waiters():
+    """测试 detach=True 时所有等待者离开后上游任务继续执行到完成"""
+    async def run():
+        flights = SingleFlight()
+        finished = asyncio.Event()
+
+        async def fetch():
+            await asyncio.sleep(0.02)
+            finished.set()
+            return "cached"
+
+        waiter = asyncio.create_task(flights.do("a", fetch, detach=True))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.wait_for(finished.wait(), 1)
+        await asyncio.sleep(0)
+        return flights.get_stats()
+
+    stats = asyncio.run(run())
+    assert stats["cancelled"] == 0 and stats["detached"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_generate_flashcards_coalesces_identical_requests(monkeypatch):
+    """测试相同文本/模板/模型的并发生成请求只调用一次上游"""
+    import main_refactored
+    from mock_upstream import MockUpstreamServer
+
+    async def fake_validate(model_name):
+        return None
+
+    async def run():
+        server = MockUpstreamServer(response_delay=0.05)
+        await server.start()
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+        monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+        try:
+            results = await asyncio.gather(*(
+                main_refactored.generate_flashcards_from_llm(
+                    text_to_process="合并测试文本",
+                    user_api_key="test-key",
+                    model_name="google/gemini-2.5-flash-preview",
+                    use_cache=False
+                )
+                for _ in range(8)
+            ))
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return server.requests_served, results
+
+    served, results = asyncio.run(run())
+    assert served == 1
+    assert sum(1 for _, info in results if info.get('coalesced')) == 7
+    assert all(len(cards) == 2 for cards, _ in results)
@@ -0,0 +1,137 @@
+"""
+AI Flashcard Generator - 流式生成测试
+验证增量解析器与 parse_llm_output 结果一致，以及SSE端点的事件输出
+"""
+
+import asyncio
+import json
+
+import httpx
+
+import main_refactored
+from main_refactored import StreamingFlashcardParser, parse_llm_output
+
+SAMPLE_OUTPUTS = [
+    """Q: 什么是机器学习？
+A: 机器学习是人工智能的一个分支，让计算机能从数据中学习。
+
+---
+
+Q: 监督学习的特点是什么？
+A: 监督学习使用标记的训练数据进行学习。""",
+
+    """Q：深度学习的核心是什么？
+A：深度学习的核心是神经网络。
+---
+Q：CNN的主要用途是什么？
+A：CNN主要用于图像处理和计算机视觉任务。""",
+
+    """Q: Python有哪些特点？
+A: Python具有以下特点：
+1. 语法简洁易懂
+2. 跨平台支持
+3. 丰富的库生态
+Q: 什么是列表推导式？
+A: 列表推导式是Python中创建列表的简洁方式
+Q: 没有答案的问题？
+---
+A: 没有问题的答案""",
+]
+
+
+def _feed_in_chunks(text: str, size: int):
+    parser = StreamingFlashcardParser()
+    cards = []
+    for i in range(0, len(text), size):
+        cards.extend(parser.feed(text[i:i + size]))
+    cards.extend(parser.close())
+    return cards
+
+
+def test_streaming_parser_matches_batch_parser():
+    """测试增量解析与整体解析结果一致（不同分片大小）"""
+    for output in SAMPLE_OUTPUTS:
+        expected = parse_llm_output(output)
+        for size in (1, 3, 16, len(output)):
+            assert _feed_in_chunks(output, size) == expected
+
+
+def test_streaming_parser_emits_cards_early():
+    """测试卡片在下一张卡片开始时即被产出，无需等待输出结束"""
+    parser = StreamingFlashcardParser()
+    assert parser.feed("Q: 问题一\nA: 答案一\n") == []
+    cards = parser.feed("---\n")
+    assert [card.q for card in cards] == ["问题一"]
+    assert parser.feed("Q: 问题二\nA: 答案二") == []
+    assert [card.a for card in parser.close()] == ["答案二"]
+
+
+def test_stream_endpoint_emits_sse_events(monkeypatch):
+    """测试SSE端点逐张推送卡片并以done事件结束"""
+    from mock_upstream import MockUpstreamServer
+
+    async def fake_validate(model_name):
+        return None
+
+    async def run():
+        server = MockUpstreamServer(stream_chunk_size=7)
+        await server.start()
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+        monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+        try:
+            transport = httpx.ASGITransport(app=main_refactored.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                response = await client.post("/generate_flashcards/stream", json={
+                    "text": "流式测试文本",
+                    "api_key": "test-key",
+                    "model_name": "google/gemini-2.5-flash-preview"
+                })
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return response
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        event_line, data_line = block.split("\n")
+        events.append((event_line[len("event: "):], json.loads(data_line[len("data: "):])))
+
+    assert [name for name, _ in events] == ["card", "card", "done"]
+    assert events[0][1]["q"] == "什么是机器学习？"
+    assert events[-1][1]["cards_generated"] == 2
+
+
+def test_stream_skips_malformed_upstream_chunks(monkeypatch):
+    """测试上游流中无法解析的数据行被跳过，后续卡片照常推送"""
+    from mock_upstream import MockUpstreamServer
+
+    async def fake_validate(model_name):
+        return None
+
+    async def run():
+        server = MockUpstreamServer(stream_chunk_size=7, malformed_stream_lines=2)
+        await server.start()
+        monkeypatch.setattr(main_refactored, "OPENROUTER_CHAT_URL", server.chat_url)
+        monkeypatch.setattr(main_refactored, "_validate_model", fake_validate)
+        try:
+            transport = httpx.ASGITransport(app=main_refactored.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                response = await client.post("/generate_flashcards/stream", json={
+                    "text": "损坏数据行流式测试文本",
+                    "api_key": "test-key",
+                    "model_name": "google/gemini-2.5-flash-preview"
+                })
+        finally:
+            await server.stop()
+            await main_refactored.upstream_client.shutdown()
+        return response
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    events = [block.split("\n")[0][len("event: "):] for block in response.text.strip().split("\n\n")]
+    assert events == ["card", "card", "done"]
+    assert "什么是机器学习？" in response.text
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+AI Flashcard Generator 上游连接池基准测试
+对比「每次请求新建AsyncClient」与「共享连接池客户端」在高并发下的单请求延迟
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from http_client import UpstreamClientManager  # noqa: E402
+from mock_upstream import MockUpstreamServer  # noqa: E402
+
+
+class UpstreamPoolBenchmark:
+    def __init__(self, concurrency: int = 64, rounds: int = 5,
+                 handshake_delay: float = 0.05, response_delay: float = 0.02):
+        self.concurrency = concurrency
+        self.rounds = rounds
+        self.server = MockUpstreamServer(handshake_delay=handshake_delay, response_delay=response_delay)
+        self.payload = {
+            "model": "google/gemini-2.5-flash-preview",
+            "messages": [{"role": "user", "content": "benchmark"}]
+        }
+
+    async def _per_request_client(self) -> float:
+        """旧实现：每个请求新建一个客户端"""
+        start = time.perf_counter()
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            response = await client.post(self.server.chat_url, json=self.payload)
+            response.raise_for_status()
+        return time.perf_counter() - start
+
+    async def _shared_client(self, manager: UpstreamClientManager) -> float:
+        """新实现：复用应用级连接池"""
+        start = time.perf_counter()
+        response = await manager.get_client().post(self.server.chat_url, json=self.payload)
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    async def _run_mode(self, mode: str) -> Dict[str, Any]:
+        latencies: List[float] = []
+        opened_before = self.server.connections_opened
+
+        manager = UpstreamClientManager(
+            max_connections=self.concurrency,
+            max_keepalive_connections=self.concurrency
+        )
+        await manager.startup()
+        try:
+            for _ in range(self.rounds):
+                if mode == "per_request":
+                    tasks = [self._per_request_client() for _ in range(self.concurrency)]
+                else:
+                    tasks = [self._shared_client(manager) for _ in range(self.concurrency)]
+                latencies.extend(await asyncio.gather(*tasks))
+        finally:
+            await manager.shutdown()
+
+        latencies_ms = sorted(latency * 1000 for latency in latencies)
+        return {
+            "requests": len(latencies_ms),
+            "connections_opened": self.server.connections_opened - opened_before,
+            "avg_ms": statistics.mean(latencies_ms),
+            "median_ms": statistics.median(latencies_ms),
+            "p95_ms": latencies_ms[int(len(latencies_ms) * 0.95) - 1],
+        }
+
+    async def run(self) -> Dict[str, Any]:
+        await self.server.start()
+        try:
+            per_request = await self._run_mode("per_request")
+            shared = await self._run_mode("shared")
+        finally:
+            await self.server.stop()
+
+        return {
+            "concurrency": self.concurrency,
+            "rounds": self.rounds,
+            "handshake_delay_ms": self.server.handshake_delay * 1000,
+            "response_delay_ms": self.server.response_delay * 1000,
+            "per_request_client": per_request,
+            "shared_client": shared,
+            "saved_per_request_ms": per_request["avg_ms"] - shared["avg_ms"],
+        }
+
+    def print_results(self, results: Dict[str, Any]):
+        print("=" * 60)
+        print("上游连接池基准测试")
+        print("=" * 60)
+        print(f"并发数: {results['concurrency']}  轮数: {results['rounds']}")
+        print(f"模拟建连开销: {results['handshake_delay_ms']:.0f} ms  模拟响应延迟: {results['response_delay_ms']:.0f} ms")
+        for label, key in (("每请求新建客户端", "per_request_client"), ("共享连接池客户端", "shared_client")):
+            stats = results[key]
+            print(f"\n{label}:")
+            print(f"  新建连接数: {stats['connections_opened']}")
+            print(f"  平均延迟: {stats['avg_ms']:.2f} ms")
+            print(f"  中位数: {stats['median_ms']:.2f} ms")
+            print(f"  95百分位: {stats['p95_ms']:.2f} ms")
+        print(f"\n⚡ 单请求平均节省: {results['saved_per_request_ms']:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上游连接池基准测试")
+    parser.add_argument("--concurrency", type=int, default=64, help="并发请求数 (默认: 64)")
+    parser.add_argument("--rounds", type=int, default=5, help="测试轮数 (默认: 5)")
+    parser.add_argument("--handshake-ms", type=float, default=50.0, help="模拟的建连开销 (默认: 50ms)")
+    parser.add_argument("--response-ms", type=float, default=20.0, help="模拟的上游响应延迟 (默认: 20ms)")
+    parser.add_argument("--output", help="结果输出文件 (JSON)")
+    args = parser.parse_args()
+
+    benchmark = UpstreamPoolBenchmark(
+        concurrency=args.concurrency,
+        rounds=args.rounds,
+        handshake_delay=args.handshake_ms / 1000,
+        response_delay=args.response_ms / 1000
+    )
+    results = asyncio.run(benchmark.run())
+    benchmark.print_results(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n详细结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()